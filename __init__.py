@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
+import time
+
 def classFactory(iface):
+    # The load time of the plugin is measured from here to the end of initGui and logged to the "Transmat profile" tab
+    load_start = time.perf_counter()
     from .process import transmat
-    return transmat(iface)
\ No newline at end of file
+    return transmat(iface, load_start)
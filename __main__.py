@@ -0,0 +1,153 @@
+# Batch entry point: python -m transmat <matrix|mask|transitions|count|harmonize|cube|zonal|bands> [options]
+import argparse
+import sys
+from qgis.core import *
+
+COMMANDS = {
+    "matrix": "transmat:matrix",
+    "mask": "transmat:mask",
+    "transitions": "transmat:transitions",
+    "count": "transmat:count",
+    "harmonize": "transmat:harmonize",
+    "cube": "transmat:cube",
+    "zonal": "transmat:zonal",
+    "bands": "transmat:bands",
+}
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="python -m transmat", description="Transition matrices and masks between two raster layers.")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("rasters", nargs="+", help="paths of raster 1 and raster 2, or of every date (cube), oldest first")
+    parser.add_argument("--band1", type=int, default=1)
+    parser.add_argument("--band2", type=int, default=1)
+    parser.add_argument("--nodata", type=float, default=0)
+    parser.add_argument("--ignore-layer-nodata", action="store_true", help="count pixels the no-data value or mask band of a layer marks as missing (matrix, mask, transitions, count, zonal)")
+    parser.add_argument("--no-harmonize", action="store_true", help="fail instead of harmonizing incompatible rasters")
+    parser.add_argument("--default-raster", type=int, choices=[1, 2], default=1)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--extent", help="xmin,xmax,ymin,ymax [EPSG:code] to count (matrix, mask, transitions, count)")
+    parser.add_argument("--area", help="polygon layer whose features limit the counted pixels (matrix, mask, transitions, count)")
+    parser.add_argument("--reclassify", help="min,max,class,... rows mapping value ranges to classes, empty bounds are open (matrix, mask, transitions, count)")
+    parser.add_argument("--values", choices=["count", "ha", "km2"], default="count", help="cell counts or ellipsoidal areas (matrix)")
+    parser.add_argument("--zones", help="zone raster or polygon layer (zonal)")
+    parser.add_argument("--zone-band", type=int, default=1, help="band of the zone raster (zonal)")
+    parser.add_argument("--zone-field", help="field naming the polygon zones (zonal)")
+    parser.add_argument("--from-value", type=float, help="class in raster 1 (mask)")
+    parser.add_argument("--to-value", type=float, help="class in raster 2 (mask)")
+    parser.add_argument("--transitions", help="from:to;from:to transitions exported as mask bands instead of transition codes (transitions), or counted (count)")
+    parser.add_argument("--regions", help="polygon layer with the regions to count in (count)")
+    parser.add_argument("--region-field", help="field naming the regions (count)")
+    parser.add_argument("--compression", choices=["DEFLATE", "ZSTD"], default="DEFLATE", help="GeoTIFF compression (transitions)")
+    parser.add_argument("--nbits", action="store_true", help="write 1-bit masks (transitions)")
+    parser.add_argument("--cog", action="store_true", help="write a Cloud Optimized GeoTIFF (transitions)")
+    parser.add_argument("--output", help="output file (matrix, mask, transitions, count, zonal, bands)")
+    parser.add_argument("--output1", help="harmonized raster 1 (harmonize)")
+    parser.add_argument("--output2", help="harmonized raster 2 (harmonize)")
+    parser.add_argument("--reference", type=int, default=1, help="position of the reference raster (cube)")
+    parser.add_argument("--all-pairs", action="store_true", help="count every pair of dates (cube)")
+    parser.add_argument("--npy", help="transition cube as .npy (cube)")
+    parser.add_argument("--bands1", default="1", help="comma-separated bands of raster 1, paired in order with --bands2 (bands)")
+    parser.add_argument("--bands2", default="1", help="comma-separated bands of raster 2 (bands)")
+    parser.add_argument("--confidence1", type=int, help="confidence band of raster 1 (bands)")
+    parser.add_argument("--confidence2", type=int, help="confidence band of raster 2 (bands)")
+    parser.add_argument("--min-confidence", type=float, help="pixels with a lower confidence are not counted (bands)")
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "cube":
+        if len(arguments.rasters) < 2:
+            parser.error("cube needs at least two rasters")
+    elif len(arguments.rasters) != 2:
+        parser.error(f"{arguments.command} needs exactly two rasters")
+    return arguments
+
+def algorithm_parameters(arguments):
+    if arguments.command == "cube":
+        return {
+            "LAYERS": arguments.rasters,
+            "BAND": arguments.band1,
+            "NODATA": arguments.nodata,
+            "HARMONIZE": not arguments.no_harmonize,
+            "REFERENCE": arguments.reference,
+            "ALL_PAIRS": arguments.all_pairs,
+            "WORKERS": arguments.workers,
+            "OUTPUT": arguments.output,
+            "OUTPUT_NPY": arguments.npy,
+        }
+
+    parameters = {
+        "RASTER1": arguments.rasters[0],
+        "BAND1": arguments.band1,
+        "RASTER2": arguments.rasters[1],
+        "BAND2": arguments.band2,
+        "NODATA": arguments.nodata,
+        "DEFAULT_RASTER": arguments.default_raster - 1,
+    }
+    if arguments.command == "harmonize":
+        parameters["OUTPUT1"] = arguments.output1
+        parameters["OUTPUT2"] = arguments.output2
+        return parameters
+
+    parameters["HARMONIZE"] = not arguments.no_harmonize
+    parameters["LAYER_NODATA"] = not arguments.ignore_layer_nodata
+    parameters["OUTPUT"] = arguments.output
+    if arguments.command == "bands":
+        del parameters["BAND1"], parameters["BAND2"]
+        parameters["BANDS1"] = [int(band) for band in arguments.bands1.split(",")]
+        parameters["BANDS2"] = [int(band) for band in arguments.bands2.split(",")]
+        parameters["CONFIDENCE1"] = arguments.confidence1
+        parameters["CONFIDENCE2"] = arguments.confidence2
+        parameters["MIN_CONFIDENCE"] = arguments.min_confidence
+        parameters["WORKERS"] = arguments.workers
+        return parameters
+    if arguments.command == "zonal":
+        parameters["ZONES"] = arguments.zones
+        parameters["ZONE_BAND"] = arguments.zone_band
+        parameters["ZONE_FIELD"] = arguments.zone_field
+        parameters["WORKERS"] = arguments.workers
+        return parameters
+
+    parameters["EXTENT"] = arguments.extent
+    parameters["AREA"] = arguments.area
+    if arguments.reclassify:
+        parameters["RECLASS_TABLE"] = arguments.reclassify.split(",")
+    if arguments.command == "matrix":
+        parameters["WORKERS"] = arguments.workers
+        parameters["VALUES"] = ["count", "ha", "km2"].index(arguments.values)
+    elif arguments.command == "transitions":
+        parameters["WORKERS"] = arguments.workers
+        parameters["TRANSITIONS"] = arguments.transitions or ""
+        parameters["COMPRESSION"] = ["DEFLATE", "ZSTD"].index(arguments.compression)
+        parameters["NBITS"] = arguments.nbits
+        parameters["COG"] = arguments.cog
+    elif arguments.command == "count":
+        parameters["WORKERS"] = arguments.workers
+        parameters["TRANSITIONS"] = arguments.transitions or ""
+        parameters["REGIONS"] = arguments.regions
+        parameters["REGION_FIELD"] = arguments.region_field
+    else:
+        parameters["FROM_VALUE"] = arguments.from_value
+        parameters["TO_VALUE"] = arguments.to_value
+    return parameters
+
+def main(argv=None):
+    arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+
+    # Headless QGIS without a GUI, with the Transmat provider registered
+    application = QgsApplication([], False)
+    application.initQgis()
+    from .provider import transmat_provider
+    QgsApplication.processingRegistry().addProvider(transmat_provider())
+
+    algorithm = QgsApplication.processingRegistry().createAlgorithmById(COMMANDS[arguments.command])
+    context = QgsProcessingContext()
+    feedback = QgsProcessingFeedback()
+    results, ok = algorithm.run(algorithm_parameters(arguments), context, feedback)
+
+    if ok:
+        for key, value in results.items():
+            print(f"{key}: {value}")
+    application.exitQgis()
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
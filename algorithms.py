@@ -0,0 +1,487 @@
+from qgis.core import *
+from qgis.PyQt.QtCore import QCoreApplication
+from .units import AREA_UNITS
+
+DEFAULT_RASTERS = ["Raster 1", "Raster 2"]
+MATRIX_VALUES = ["Cell count"] + list(AREA_UNITS)
+COMPRESSIONS = ["DEFLATE", "ZSTD"]
+
+def renderer():
+    # The counting engine (NumPy, GDAL) is imported when an algorithm runs, not when QGIS loads the provider
+    from .geospatial import renderer as engine
+    return engine()
+
+class transmat_algorithm(QgsProcessingAlgorithm):
+    # Inputs shared by all Transmat algorithms: two rasters, their bands and the no-data value
+    def tr(self, string):
+        return QCoreApplication.translate("Transmat", string)
+
+    def group(self):
+        return self.tr("Transition analysis")
+
+    def groupId(self):
+        return "transition_analysis"
+
+    def createInstance(self):
+        return type(self)()
+
+    def add_raster_parameters(self, harmonize=True):
+        self.addParameter(QgsProcessingParameterRasterLayer("RASTER1", self.tr("Raster 1")))
+        self.addParameter(QgsProcessingParameterBand("BAND1", self.tr("Raster 1 band"), 1, "RASTER1"))
+        self.addParameter(QgsProcessingParameterRasterLayer("RASTER2", self.tr("Raster 2")))
+        self.addParameter(QgsProcessingParameterBand("BAND2", self.tr("Raster 2 band"), 1, "RASTER2"))
+        self.addParameter(QgsProcessingParameterNumber("NODATA", self.tr("No-Data value"), QgsProcessingParameterNumber.Double, 0))
+        if harmonize:
+            self.addParameter(QgsProcessingParameterBoolean("LAYER_NODATA", self.tr("Use layer no-data values and masks"), True))
+            self.addParameter(QgsProcessingParameterBoolean("HARMONIZE", self.tr("Auto-compatibility fix"), True))
+        self.addParameter(QgsProcessingParameterEnum("DEFAULT_RASTER", self.tr("Default raster"), DEFAULT_RASTERS, defaultValue=0))
+
+    def add_area_parameters(self):
+        self.addParameter(QgsProcessingParameterExtent("EXTENT", self.tr("Extent"), optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSource("AREA", self.tr("Polygons"), [QgsProcessing.TypeVectorPolygon], optional=True))
+
+    def add_class_parameters(self):
+        self.addParameter(QgsProcessingParameterMatrix("RECLASS_TABLE", self.tr("Reclassification table"), headers=[self.tr("Minimum"), self.tr("Maximum"), self.tr("Class")], optional=True))
+
+    def class_parameters(self, parameters, context):
+        # Rows of (minimum, maximum, class) or None; an empty bound is open
+        values = self.parameterAsMatrix(parameters, "RECLASS_TABLE", context) if "RECLASS_TABLE" in parameters else []
+        if not values:
+            return None
+        if len(values) % 3:
+            raise QgsProcessingException(self.tr("The reclassification table needs a minimum, a maximum and a class in every row."))
+        import numpy as np
+        try:
+            return np.array([np.nan if value in ("", None) else float(value) for value in values]).reshape(-1, 3)
+        except ValueError:
+            raise QgsProcessingException(self.tr("The reclassification table must contain numbers."))
+
+    def area_parameters(self, parameters, context):
+        # Union of the polygons, or the extent, limits the counted pixels; (None, None) counts the whole raster
+        source = self.parameterAsSource(parameters, "AREA", context)
+        if source is not None:
+            geometries = [feature.geometry() for feature in source.getFeatures() if feature.hasGeometry()]
+            if not geometries:
+                raise QgsProcessingException(self.tr("The polygon layer has no features."))
+            return QgsGeometry.unaryUnion(geometries), source.sourceCrs()
+
+        if parameters.get("EXTENT"):
+            extent_crs = self.parameterAsExtentCrs(parameters, "EXTENT", context)
+            return QgsGeometry.fromRect(self.parameterAsExtent(parameters, "EXTENT", context, extent_crs)), extent_crs
+
+        return None, None
+
+    def raster_parameters(self, parameters, context):
+        raster1_layer = self.parameterAsRasterLayer(parameters, "RASTER1", context)
+        raster2_layer = self.parameterAsRasterLayer(parameters, "RASTER2", context)
+        if raster1_layer is None or raster2_layer is None:
+            raise QgsProcessingException(self.tr("Please select two raster layers."))
+        raster1_band = self.parameterAsInt(parameters, "BAND1", context)
+        raster2_band = self.parameterAsInt(parameters, "BAND2", context)
+        null_value = self.parameterAsDouble(parameters, "NODATA", context)
+        default_raster = DEFAULT_RASTERS[self.parameterAsEnum(parameters, "DEFAULT_RASTER", context)]
+        return raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, default_raster
+
+    def transition_cells(self, matrix_renderer, transitions):
+        # (row, column) cells of from:to;from:to transitions between classes of the matrix; the renderer is cleaned up on an error
+        cells = []
+        for transition in transitions.split(";"):
+            try:
+                from_value, to_value = (float(value) for value in transition.split(":"))
+            except ValueError:
+                matrix_renderer.cleanup()
+                raise QgsProcessingException(self.tr("Transitions must be given as from:to pairs separated by semicolons."))
+            row = matrix_renderer.class_index(from_value)
+            column = matrix_renderer.class_index(to_value)
+            if row is None or column is None:
+                matrix_renderer.cleanup()
+                raise QgsProcessingException(self.tr("{} is not a transition between classes of the rasters.").format(transition))
+            cells.append((row, column))
+        return cells
+
+    def compute(self, parameters, context, feedback, keep_index):
+        raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, default_raster = self.raster_parameters(parameters, context)
+        compatibility_fix = self.parameterAsBoolean(parameters, "HARMONIZE", context)
+        workers = self.parameterAsInt(parameters, "WORKERS", context) if "WORKERS" in parameters else 1
+        area, area_crs = self.area_parameters(parameters, context)
+        reclass_table = self.class_parameters(parameters, context)
+        values = MATRIX_VALUES[self.parameterAsEnum(parameters, "VALUES", context)] if "VALUES" in parameters else "Cell count"
+        layer_nodata = self.parameterAsBoolean(parameters, "LAYER_NODATA", context) if "LAYER_NODATA" in parameters else True
+
+        matrix_renderer = renderer()
+        result = matrix_renderer.generate(raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, compatibility_fix, default_raster, max(1, workers), keep_index, feedback, area=area, area_crs=area_crs, reclass_table=reclass_table, pixel_areas=values in AREA_UNITS, layer_nodata=layer_nodata)
+        if isinstance(result, str):
+            matrix_renderer.cleanup()
+            raise QgsProcessingException(result)
+        feedback.pushInfo(matrix_renderer.profile.summary())
+        return matrix_renderer
+
+
+class transition_matrix_algorithm(transmat_algorithm):
+    def name(self):
+        return "matrix"
+
+    def displayName(self):
+        return self.tr("Transition matrix")
+
+    def shortHelpString(self):
+        return self.tr("Counts the transitions between the classes of two raster layers and saves the matrix as a .csv file. Matrices with many classes are saved as a from;to;count list of the transitions that occur. Instead of the cell counts the ellipsoidal area of the transitions can be saved.")
+
+    def initAlgorithm(self, config=None):
+        self.add_raster_parameters()
+        self.add_area_parameters()
+        self.add_class_parameters()
+        self.addParameter(QgsProcessingParameterNumber("WORKERS", self.tr("Worker threads"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterEnum("VALUES", self.tr("Values"), MATRIX_VALUES, defaultValue=0))
+        self.addParameter(QgsProcessingParameterFileDestination("OUTPUT", self.tr("Transition matrix"), "CSV files (*.csv)"))
+        self.addOutput(QgsProcessingOutputString("CLASSES", self.tr("Class values")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        matrix_renderer = self.compute(parameters, context, feedback, keep_index=False)
+        filename = self.parameterAsFileOutput(parameters, "OUTPUT", context)
+        values = MATRIX_VALUES[self.parameterAsEnum(parameters, "VALUES", context)]
+        matrix_renderer.save_matrix(filename, values if values in AREA_UNITS else None)
+        matrix_renderer.cleanup()
+        classes = ";".join(str(v) for v in matrix_renderer.unique_values)
+        return {"OUTPUT": filename, "CLASSES": classes}
+
+
+class transition_mask_algorithm(transmat_algorithm):
+    def name(self):
+        return "mask"
+
+    def displayName(self):
+        return self.tr("Transition mask")
+
+    def shortHelpString(self):
+        return self.tr("Saves a mask of the pixels whose value changed from the From value in raster 1 to the To value in raster 2.")
+
+    def initAlgorithm(self, config=None):
+        self.add_raster_parameters()
+        self.add_area_parameters()
+        self.add_class_parameters()
+        self.addParameter(QgsProcessingParameterNumber("FROM_VALUE", self.tr("From value (raster 1)"), QgsProcessingParameterNumber.Double))
+        self.addParameter(QgsProcessingParameterNumber("TO_VALUE", self.tr("To value (raster 2)"), QgsProcessingParameterNumber.Double))
+        self.addParameter(QgsProcessingParameterRasterDestination("OUTPUT", self.tr("Transition mask")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        matrix_renderer = self.compute(parameters, context, feedback, keep_index=True)
+        row = matrix_renderer.class_index(self.parameterAsDouble(parameters, "FROM_VALUE", context))
+        column = matrix_renderer.class_index(self.parameterAsDouble(parameters, "TO_VALUE", context))
+        if row is None or column is None:
+            raise QgsProcessingException(self.tr("The From and To values must be classes of the rasters."))
+
+        filename = self.parameterAsOutputLayer(parameters, "OUTPUT", context)
+        matrix_renderer.save_transition_mask(filename, [(row, column)])
+        matrix_renderer.cleanup()
+        return {"OUTPUT": filename}
+
+
+class transition_raster_algorithm(transmat_algorithm):
+    def name(self):
+        return "transitions"
+
+    def displayName(self):
+        return self.tr("Transition raster")
+
+    def shortHelpString(self):
+        return self.tr("Saves every transition as one categorical raster of transition codes (from index * number of classes + to index + 1, "
+                       "0 where nothing was counted), or one mask band per transition listed as from:to pairs, e.g. 1:2;1:3. "
+                       "The GeoTIFF is tiled and compressed and written tile by tile.")
+
+    def initAlgorithm(self, config=None):
+        self.add_raster_parameters()
+        self.add_area_parameters()
+        self.add_class_parameters()
+        self.addParameter(QgsProcessingParameterString("TRANSITIONS", self.tr("Transitions to export as masks (from:to;from:to)"), optional=True))
+        self.addParameter(QgsProcessingParameterEnum("COMPRESSION", self.tr("Compression"), COMPRESSIONS, defaultValue=0))
+        self.addParameter(QgsProcessingParameterBoolean("NBITS", self.tr("1-bit masks"), False))
+        self.addParameter(QgsProcessingParameterBoolean("COG", self.tr("Cloud Optimized GeoTIFF"), False))
+        self.addParameter(QgsProcessingParameterNumber("WORKERS", self.tr("Worker threads"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterRasterDestination("OUTPUT", self.tr("Transition raster")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        matrix_renderer = self.compute(parameters, context, feedback, keep_index=True)
+
+        transitions = self.parameterAsString(parameters, "TRANSITIONS", context).strip()
+        cells = self.transition_cells(matrix_renderer, transitions) if transitions else None
+
+        filename = self.parameterAsOutputLayer(parameters, "OUTPUT", context)
+        result = matrix_renderer.export_transitions(
+            filename,
+            cells,
+            COMPRESSIONS[self.parameterAsEnum(parameters, "COMPRESSION", context)],
+            self.parameterAsBoolean(parameters, "NBITS", context),
+            self.parameterAsBoolean(parameters, "COG", context),
+            feedback
+        )
+        matrix_renderer.cleanup()
+        if result is not None:
+            raise QgsProcessingException(result)
+        return {"OUTPUT": filename}
+
+
+class transition_count_algorithm(transmat_algorithm):
+    def name(self):
+        return "count"
+
+    def displayName(self):
+        return self.tr("Transition pixels per region")
+
+    def shortHelpString(self):
+        return self.tr("Counts the pixels of a set of transitions, given as from:to pairs, e.g. 1:2;3:2 for everything that became 2, "
+                       "inside every polygon of a region layer. The pair codes are kept from the matrix computation, so every region "
+                       "only reads the tiles it overlaps that hold one of the transitions. Saved as a .csv (region, pixels).")
+
+    def initAlgorithm(self, config=None):
+        self.add_raster_parameters()
+        self.add_area_parameters()
+        self.add_class_parameters()
+        self.addParameter(QgsProcessingParameterString("TRANSITIONS", self.tr("Transitions to count (from:to;from:to)")))
+        self.addParameter(QgsProcessingParameterFeatureSource("REGIONS", self.tr("Regions"), [QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterField("REGION_FIELD", self.tr("Region name field"), parentLayerParameterName="REGIONS", optional=True))
+        self.addParameter(QgsProcessingParameterNumber("WORKERS", self.tr("Worker threads"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterFileDestination("OUTPUT", self.tr("Transition pixels"), "CSV files (*.csv)"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        regions = self.parameterAsSource(parameters, "REGIONS", context)
+        if regions is None:
+            raise QgsProcessingException(self.tr("Please select a region layer."))
+        region_field = self.parameterAsString(parameters, "REGION_FIELD", context)
+
+        matrix_renderer = self.compute(parameters, context, feedback, keep_index=True)
+        cells = self.transition_cells(matrix_renderer, self.parameterAsString(parameters, "TRANSITIONS", context).strip())
+
+        filename = self.parameterAsFileOutput(parameters, "OUTPUT", context)
+        n_regions = max(1, regions.featureCount())
+        with open(filename, "w") as csv_file:
+            csv_file.write("region;pixels\n")
+            for number, feature in enumerate(regions.getFeatures()):
+                if feedback.isCanceled():
+                    break
+                if not feature.hasGeometry():
+                    continue
+                name = feature[region_field] if region_field else feature.id()
+                csv_file.write(f"{name};{matrix_renderer.count_selection(cells, feature.geometry(), regions.sourceCrs())}\n")
+                feedback.setProgress(100 * (number + 1) / n_regions)
+        matrix_renderer.cleanup()
+        return {"OUTPUT": filename}
+
+
+class harmonize_algorithm(transmat_algorithm):
+    def name(self):
+        return "harmonize"
+
+    def displayName(self):
+        return self.tr("Harmonize rasters")
+
+    def shortHelpString(self):
+        return self.tr("Reprojects the non-default raster onto the default raster and clips both to their intersection.")
+
+    def initAlgorithm(self, config=None):
+        self.add_raster_parameters(harmonize=False)
+        self.addParameter(QgsProcessingParameterRasterDestination("OUTPUT1", self.tr("Harmonized raster 1")))
+        self.addParameter(QgsProcessingParameterRasterDestination("OUTPUT2", self.tr("Harmonized raster 2")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, default_raster = self.raster_parameters(parameters, context)
+        harmonize_renderer = renderer()
+        fixed_layers = harmonize_renderer.fix_rasters(raster1_layer, raster2_layer, default_raster, raster1_band, raster2_band, null_value, feedback)
+        if isinstance(fixed_layers, str):
+            harmonize_renderer.cleanup()
+            raise QgsProcessingException(fixed_layers)
+
+        idx = 0 if default_raster == "Raster 1" else 1
+        outputs = {}
+        for key, layer in (("OUTPUT1", fixed_layers[idx]), ("OUTPUT2", fixed_layers[1 - idx])):
+            filename = self.parameterAsOutputLayer(parameters, key, context)
+            from osgeo import gdal
+            gdal.Translate(filename, layer.source())
+            outputs[key] = filename
+        harmonize_renderer.cleanup()
+        return outputs
+
+
+class transition_cube_algorithm(transmat_algorithm):
+    def name(self):
+        return "cube"
+
+    def displayName(self):
+        return self.tr("Multi-date transition matrices")
+
+    def shortHelpString(self):
+        return self.tr("Counts the transitions between every consecutive pair of an ordered list of rasters, plus the first to last pair "
+                       "(or every pair), over one shared class list. Saved as a long-format .csv and optionally as a .npy array.")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterMultipleLayers("LAYERS", self.tr("Rasters (oldest first)"), QgsProcessing.TypeRaster))
+        self.addParameter(QgsProcessingParameterNumber("BAND", self.tr("Band"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterNumber("NODATA", self.tr("No-Data value"), QgsProcessingParameterNumber.Double, 0))
+        self.addParameter(QgsProcessingParameterBoolean("HARMONIZE", self.tr("Auto-compatibility fix"), True))
+        self.addParameter(QgsProcessingParameterNumber("REFERENCE", self.tr("Reference raster (position in the list)"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterBoolean("ALL_PAIRS", self.tr("Count every pair of dates"), False))
+        self.addParameter(QgsProcessingParameterNumber("WORKERS", self.tr("Worker threads"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterFileDestination("OUTPUT", self.tr("Transition matrices"), "CSV files (*.csv)"))
+        self.addParameter(QgsProcessingParameterFileDestination("OUTPUT_NPY", self.tr("Transition cube"), "NumPy files (*.npy)", optional=True, createByDefault=False))
+        self.addOutput(QgsProcessingOutputString("CLASSES", self.tr("Class values")))
+        self.addOutput(QgsProcessingOutputString("PAIRS", self.tr("Date pairs")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        layers = self.parameterAsLayerList(parameters, "LAYERS", context)
+        if len(layers) < 2:
+            raise QgsProcessingException(self.tr("Please select at least two raster layers."))
+        reference_index = self.parameterAsInt(parameters, "REFERENCE", context) - 1
+        if reference_index >= len(layers):
+            raise QgsProcessingException(self.tr("The reference raster must be one of the selected rasters."))
+
+        band = self.parameterAsInt(parameters, "BAND", context)
+        cube_renderer = renderer()
+        result = cube_renderer.generate_cube(
+            layers,
+            [band] * len(layers),
+            self.parameterAsDouble(parameters, "NODATA", context),
+            self.parameterAsBoolean(parameters, "HARMONIZE", context),
+            reference_index,
+            self.parameterAsBoolean(parameters, "ALL_PAIRS", context),
+            max(1, self.parameterAsInt(parameters, "WORKERS", context)),
+            feedback
+        )
+        if isinstance(result, str):
+            cube_renderer.cleanup()
+            raise QgsProcessingException(result)
+
+        outputs = {}
+        outputs["OUTPUT"] = self.parameterAsFileOutput(parameters, "OUTPUT", context)
+        cube_renderer.save_cube(outputs["OUTPUT"])
+        npy_filename = self.parameterAsFileOutput(parameters, "OUTPUT_NPY", context)
+        if npy_filename:
+            cube_renderer.save_cube(npy_filename)
+            outputs["OUTPUT_NPY"] = npy_filename
+        cube_renderer.cleanup()
+        outputs["CLASSES"] = ";".join(str(v) for v in cube_renderer.unique_values)
+        outputs["PAIRS"] = ";".join(f"{s + 1}-{t + 1}" for s, t in cube_renderer.pairs)
+        return outputs
+
+
+class zonal_transitions_algorithm(transmat_algorithm):
+    def name(self):
+        return "zonal"
+
+    def displayName(self):
+        return self.tr("Zonal transition matrices")
+
+    def shortHelpString(self):
+        return self.tr("Counts the transitions between two rasters separately for every zone of a zone raster or of a polygon layer, "
+                       "in one pass over the rasters. Saved as a long-format .csv (zone, from, to, count, area in map units).")
+
+    def initAlgorithm(self, config=None):
+        self.add_raster_parameters()
+        self.addParameter(QgsProcessingParameterMapLayer("ZONES", self.tr("Zones (raster or polygon layer)"), types=[QgsProcessing.TypeRaster, QgsProcessing.TypeVectorPolygon]))
+        self.addParameter(QgsProcessingParameterNumber("ZONE_BAND", self.tr("Zone raster band"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterField("ZONE_FIELD", self.tr("Zone name field"), parentLayerParameterName="ZONES", optional=True))
+        self.addParameter(QgsProcessingParameterNumber("WORKERS", self.tr("Worker threads"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterFileDestination("OUTPUT", self.tr("Zonal transitions"), "CSV files (*.csv)"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, default_raster = self.raster_parameters(parameters, context)
+        zone_layer = self.parameterAsLayer(parameters, "ZONES", context)
+        if zone_layer is None:
+            raise QgsProcessingException(self.tr("Please select a zone layer."))
+
+        zonal_renderer = renderer()
+        result = zonal_renderer.generate_zones(
+            raster1_layer,
+            raster2_layer,
+            raster1_band,
+            raster2_band,
+            null_value,
+            zone_layer,
+            self.parameterAsInt(parameters, "ZONE_BAND", context),
+            self.parameterAsString(parameters, "ZONE_FIELD", context) or None,
+            self.parameterAsBoolean(parameters, "HARMONIZE", context),
+            default_raster,
+            max(1, self.parameterAsInt(parameters, "WORKERS", context)),
+            feedback,
+            self.parameterAsBoolean(parameters, "LAYER_NODATA", context) if "LAYER_NODATA" in parameters else True
+        )
+        if isinstance(result, str):
+            zonal_renderer.cleanup()
+            raise QgsProcessingException(result)
+
+        filename = self.parameterAsFileOutput(parameters, "OUTPUT", context)
+        zonal_renderer.save_zones(filename)
+        zonal_renderer.cleanup()
+        return {"OUTPUT": filename}
+
+
+class band_stack_algorithm(transmat_algorithm):
+    def name(self):
+        return "bands"
+
+    def displayName(self):
+        return self.tr("Band stack transition matrices")
+
+    def shortHelpString(self):
+        return self.tr("Counts one transition matrix per band pair of two multi-band rasters, e.g. several classification schemes, "
+                       "reading all bands of a tile in one pass. The n-th band of raster 1 is paired with the n-th band of raster 2, "
+                       "a single band is paired with every band of the other raster. With a confidence band and a minimum confidence "
+                       "only the pixels whose confidence reaches it are counted. Saved as a long-format .csv (band1, band2, from, to, count).")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterRasterLayer("RASTER1", self.tr("Raster 1")))
+        self.addParameter(QgsProcessingParameterBand("BANDS1", self.tr("Raster 1 bands"), None, "RASTER1", allowMultiple=True))
+        self.addParameter(QgsProcessingParameterRasterLayer("RASTER2", self.tr("Raster 2")))
+        self.addParameter(QgsProcessingParameterBand("BANDS2", self.tr("Raster 2 bands"), None, "RASTER2", allowMultiple=True))
+        self.addParameter(QgsProcessingParameterNumber("NODATA", self.tr("No-Data value"), QgsProcessingParameterNumber.Double, 0))
+        self.addParameter(QgsProcessingParameterBoolean("LAYER_NODATA", self.tr("Use layer no-data values and masks"), True))
+        self.addParameter(QgsProcessingParameterBoolean("HARMONIZE", self.tr("Auto-compatibility fix"), True))
+        self.addParameter(QgsProcessingParameterEnum("DEFAULT_RASTER", self.tr("Default raster"), DEFAULT_RASTERS, defaultValue=0))
+        self.addParameter(QgsProcessingParameterBand("CONFIDENCE1", self.tr("Raster 1 confidence band"), None, "RASTER1", optional=True))
+        self.addParameter(QgsProcessingParameterBand("CONFIDENCE2", self.tr("Raster 2 confidence band"), None, "RASTER2", optional=True))
+        self.addParameter(QgsProcessingParameterNumber("MIN_CONFIDENCE", self.tr("Minimum confidence"), QgsProcessingParameterNumber.Double, optional=True))
+        self.addParameter(QgsProcessingParameterNumber("WORKERS", self.tr("Worker threads"), QgsProcessingParameterNumber.Integer, 1, minValue=1))
+        self.addParameter(QgsProcessingParameterFileDestination("OUTPUT", self.tr("Band pair transitions"), "CSV files (*.csv)"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        raster1_layer = self.parameterAsRasterLayer(parameters, "RASTER1", context)
+        raster2_layer = self.parameterAsRasterLayer(parameters, "RASTER2", context)
+        if raster1_layer is None or raster2_layer is None:
+            raise QgsProcessingException(self.tr("Please select two raster layers."))
+
+        bands1 = self.parameterAsInts(parameters, "BANDS1", context)
+        bands2 = self.parameterAsInts(parameters, "BANDS2", context)
+        if len(bands1) == 1:
+            bands1 = bands1 * len(bands2)
+        if len(bands2) == 1:
+            bands2 = bands2 * len(bands1)
+        if not bands1 or len(bands1) != len(bands2):
+            raise QgsProcessingException(self.tr("Select as many bands of raster 1 as of raster 2, or a single band of one of them."))
+
+        confidence_bands = (self.parameterAsInt(parameters, "CONFIDENCE1", context) or None, self.parameterAsInt(parameters, "CONFIDENCE2", context) or None)
+        min_confidence = self.parameterAsDouble(parameters, "MIN_CONFIDENCE", context) if parameters.get("MIN_CONFIDENCE") is not None else None
+        if min_confidence is not None and confidence_bands == (None, None):
+            raise QgsProcessingException(self.tr("A minimum confidence needs a confidence band."))
+
+        bands_renderer = renderer()
+        result = bands_renderer.generate_bands(
+            raster1_layer,
+            raster2_layer,
+            list(zip(bands1, bands2)),
+            self.parameterAsDouble(parameters, "NODATA", context),
+            self.parameterAsBoolean(parameters, "HARMONIZE", context),
+            DEFAULT_RASTERS[self.parameterAsEnum(parameters, "DEFAULT_RASTER", context)],
+            max(1, self.parameterAsInt(parameters, "WORKERS", context)),
+            feedback,
+            confidence_bands,
+            min_confidence,
+            self.parameterAsBoolean(parameters, "LAYER_NODATA", context)
+        )
+        if isinstance(result, str):
+            bands_renderer.cleanup()
+            raise QgsProcessingException(result)
+        feedback.pushInfo(bands_renderer.profile.summary())
+
+        filename = self.parameterAsFileOutput(parameters, "OUTPUT", context)
+        bands_renderer.save_bands(filename)
+        bands_renderer.cleanup()
+        return {"OUTPUT": filename}
@@ -0,0 +1,324 @@
+# Benchmarks of the counting pipeline on synthetic rasters, headless with GDAL and NumPy only:
+# python -m transmat.benchmark --sizes 2048 8192 --classes 8 200 --output results.json
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+from osgeo import gdal, osr
+from .counting import TILE_PIXELS, class_presence, combine_masks, count_pairs, encode_pairs, map_tiles, pair_index, tile_size, tile_windows, transition_counter
+from .rasters import band_reader, read_valid, snap_bounds, warp_options
+
+# Bump when stages or cases change, so results of different versions are only compared when they measure the same thing
+BENCHMARK_VERSION = 2
+
+STAGES = ["harmonize", "read", "count", "mask", "export"]
+
+# Grid of the synthetic rasters: 10 m pixels in UTM zone 34N
+ORIGIN = (500000.0, 5800000.0)
+PIXEL_SIZE = 10.0
+EPSG = 32634
+MISMATCH_EPSG = 3035
+
+def class_values(n_classes, dtype):
+    # Class values of a synthetic raster: 1, 2, ... for small integer types, a sparse range for 32-bit integers, fractions for floats
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return (np.arange(1, n_classes + 1) * 0.25).astype(dtype)
+    if dtype.itemsize >= 4:
+        return (1 + np.arange(n_classes) * 1000).astype(dtype)
+    if n_classes >= np.iinfo(dtype).max:
+        raise ValueError(f"{n_classes} classes do not fit into {dtype}")
+    return np.arange(1, n_classes + 1).astype(dtype)
+
+GDAL_TYPES = {
+    "uint8": gdal.GDT_Byte,
+    "uint16": gdal.GDT_UInt16,
+    "int16": gdal.GDT_Int16,
+    "uint32": gdal.GDT_UInt32,
+    "int32": gdal.GDT_Int32,
+    "float32": gdal.GDT_Float32,
+    "float64": gdal.GDT_Float64,
+}
+
+def create_raster(path, width, height, dtype, null_value, origin=ORIGIN, epsg=EPSG):
+    data_type = GDAL_TYPES[np.dtype(dtype).name]
+    dataset = gdal.GetDriverByName("GTiff").Create(path, width, height, 1, data_type, ["TILED=YES", "BLOCKXSIZE=256", "BLOCKYSIZE=256", "BIGTIFF=IF_SAFER"])
+    dataset.SetGeoTransform((origin[0], PIXEL_SIZE, 0, origin[1], 0, -PIXEL_SIZE))
+    reference = osr.SpatialReference()
+    reference.ImportFromEPSG(epsg)
+    dataset.SetProjection(reference.ExportToWkt())
+    dataset.GetRasterBand(1).SetNoDataValue(float(null_value))
+    return dataset
+
+def synthetic_pair(directory, width, height, dtype="uint8", n_classes=8, nodata_fraction=0.0, change_fraction=0.1, mismatch="none", null_value=0, patch_size=32, seed=0):
+    # Two class rasters of patches of patch_size pixels, the second with change_fraction of the pixels moved to another class.
+    # mismatch "extent" shifts the second raster by a few pixels and half a pixel, "crs" also reprojects it.
+    # Written strip by strip, so rasters larger than the memory can be generated
+    rng = np.random.default_rng(seed)
+    values = class_values(n_classes, dtype)
+    patches = rng.integers(0, n_classes, (-(-height // patch_size), -(-width // patch_size)))
+
+    path1 = os.path.join(directory, "raster1.tif")
+    path2 = os.path.join(directory, "raster2.tif")
+    origin2 = ORIGIN if mismatch == "none" else (ORIGIN[0] + 3.5 * PIXEL_SIZE, ORIGIN[1] - 2.5 * PIXEL_SIZE)
+    raster1 = create_raster(path1, width, height, dtype, null_value)
+    raster2 = create_raster(path2, width, height, dtype, null_value, origin2)
+
+    for y in range(0, height, 256):
+        rows = min(256, height - y)
+        strip = np.repeat(np.repeat(patches[y // patch_size:(y + rows - 1) // patch_size + 1], patch_size, axis=0), patch_size, axis=1)
+        strip = strip[y % patch_size:y % patch_size + rows, :width]
+        changed = rng.random(strip.shape) < change_fraction
+        strip2 = np.where(changed, rng.integers(0, n_classes, strip.shape), strip)
+
+        strip1 = values[strip]
+        strip2 = values[strip2]
+        if nodata_fraction:
+            strip1[rng.random(strip.shape) < nodata_fraction] = null_value
+            strip2[rng.random(strip.shape) < nodata_fraction] = null_value
+        raster1.GetRasterBand(1).WriteArray(strip1, 0, y)
+        raster2.GetRasterBand(1).WriteArray(strip2, 0, y)
+    raster1 = raster2 = None
+
+    if mismatch == "crs":
+        reprojected = os.path.join(directory, "raster2_reprojected.tif")
+        gdal.Warp(reprojected, path2, dstSRS=f"EPSG:{MISMATCH_EPSG}", resampleAlg="near", creationOptions=["TILED=YES"])
+        path2 = reprojected
+    return path1, path2
+
+def dataset_bounds(dataset, srs_wkt):
+    # (x min, y min, x max, y max) of a north-up dataset in the coordinates of srs_wkt
+    x_min, x_res, _, y_max, _, y_res = dataset.GetGeoTransform()
+    bounds = (x_min, y_max + dataset.RasterYSize * y_res, x_min + dataset.RasterXSize * x_res, y_max)
+    source = osr.SpatialReference(wkt=dataset.GetProjection())
+    target = osr.SpatialReference(wkt=srs_wkt)
+    if source.IsSame(target):
+        return bounds
+    for reference in (source, target):
+        reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return osr.CoordinateTransformation(source, target).TransformBounds(*bounds, 21)
+
+def harmonize(directory, paths, null_value):
+    # Warped VRTs of the rasters on the grid of the first one, clipped to the intersection of their extents, with the bounds and
+    # warp options harmonize_series uses
+    datasets = [gdal.Open(path) for path in paths]
+    reference = datasets[0]
+    geotransform = reference.GetGeoTransform()
+    extents = [dataset_bounds(dataset, reference.GetProjection()) for dataset in datasets]
+    intersection = (max(e[0] for e in extents), max(e[1] for e in extents), min(e[2] for e in extents), min(e[3] for e in extents))
+    bounds = snap_bounds(geotransform, intersection)
+
+    warped = []
+    for number, (path, dataset) in enumerate(zip(paths, datasets)):
+        dst_path = os.path.join(directory, f"raster{number + 1}_warped.vrt")
+        gdal.Warp(dst_path, path, **warp_options(
+            dataset.GetProjection(),
+            reference.GetProjection(),
+            bounds,
+            geotransform[1],
+            -geotransform[5],
+            null_value,
+            reference.GetRasterBand(1).DataType,
+            dataset.GetRasterBand(1).GetNoDataValue()
+        ))
+        warped.append(dst_path)
+    return warped
+
+def stream_tiles(path1, path2, null_value, function, workers=1):
+    # Read both rasters in the aligned tiles of the plugin, through the readers it uses, and apply
+    # function(window, tile1, tile2, mask) to every tile, mask holding the pixels with data in both
+    dataset = gdal.Open(path1)
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    block_width, block_height = dataset.GetRasterBand(1).GetBlockSize()
+    tile_width, tile_height = tile_size(block_width, block_height, width, height, TILE_PIXELS)
+
+    # Datasets are not thread-safe, every thread opens its own
+    local = threading.local()
+
+    def read_tile(window):
+        if not hasattr(local, "readers"):
+            local.readers = [band_reader(gdal.Open(path), 1, null_value) for path in (path1, path2)]
+        (tile1, valid1), (tile2, valid2) = [read_valid(reader, window) for reader in local.readers]
+        return function(window, tile1, tile2, combine_masks(valid1, valid2))
+
+    return list(map_tiles(read_tile, list(tile_windows(width, height, tile_width, tile_height)), workers)), width, height
+
+def measure(function):
+    # Wall time, peak of the memory allocated through Python and NumPy, and the result of function()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, result
+
+def run_case(directory, case, repeat=3):
+    # Timings of every stage of one case; the fastest of the repeats is kept
+    null_value = case["null_value"]
+    path1, path2 = synthetic_pair(
+        directory,
+        case["size"],
+        case["size"],
+        case["dtype"],
+        case["classes"],
+        case["nodata_fraction"],
+        case["change_fraction"],
+        case["mismatch"],
+        null_value,
+        seed=case["seed"]
+    )
+
+    def harmonize_stage():
+        return harmonize(directory, [path1, path2], null_value) if case["mismatch"] != "none" else [path1, path2]
+
+    def read_stage():
+        return stream_tiles(path1, path2, null_value, lambda window, tile1, tile2, mask: tile1.nbytes + tile2.nbytes, case["workers"])
+
+    def count_stage():
+        def count_tile(window, tile1, tile2, mask):
+            pair_codes, unique_values = encode_pairs(tile1, tile2, null_value, mask)
+            return window, pair_codes, unique_values, count_pairs(pair_codes, unique_values.size)
+
+        tiles, width, height = stream_tiles(path1, path2, null_value, count_tile, case["workers"])
+        counter = transition_counter(null_value)
+        index = pair_index(width, height, path=os.path.join(directory, "pair_codes.bin"))
+        for window, pair_codes, unique_values, counts in tiles:
+            counter.add_counts(counts, unique_values)
+            index.add(window, pair_codes, unique_values, *class_presence(counts))
+        return counter.result(), index
+
+    def mask_stage():
+        # Mask of the most frequent change, as computed when a cell is clicked and saved
+        return index.mask([(unique_values[row], unique_values[column])])
+
+    def export_stage():
+        # Transition code raster written tile by tile, as export_transitions writes it
+        n_classes = unique_values.size
+        dataset = gdal.GetDriverByName("GTiff").Create(os.path.join(directory, "transitions.tif"), index.width, index.height, 1, gdal.GDT_UInt32, ["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", "COMPRESS=DEFLATE"])
+        for (x, y, _, _), codes in index.transition_tiles(unique_values):
+            dataset.GetRasterBand(1).WriteArray(np.where(codes == n_classes * n_classes, 0, codes + 1).astype(np.uint32), x, y)
+        dataset = None
+
+    results = []
+    for stage in STAGES:
+        timings = []
+        for _ in range(repeat):
+            seconds, peak, result = measure({"harmonize": harmonize_stage, "read": read_stage, "count": count_stage, "mask": mask_stage, "export": export_stage}[stage])
+            timings.append((seconds, peak))
+
+        # Later stages work on the harmonized rasters and on the result of the count
+        if stage == "harmonize":
+            path1, path2 = result
+        elif stage == "count":
+            (counts, unique_values), index = result
+            changes = counts if isinstance(counts, np.ndarray) else counts.toarray()
+            changes = changes - np.diag(np.diag(changes))
+            row, column = np.unravel_index(np.argmax(changes), changes.shape) if changes.size else (0, 0)
+
+        seconds = [timing[0] for timing in timings]
+        results.append(dict(case, **{
+            "stage": stage,
+            "seconds": min(seconds),
+            "mean_seconds": float(np.mean(seconds)),
+            "peak_bytes": max(timing[1] for timing in timings),
+            "megapixels_per_second": case["size"] * case["size"] / 1e6 / min(seconds) if min(seconds) else None,
+        }))
+    return results
+
+def environment():
+    metadata = os.path.join(os.path.dirname(__file__), "metadata.txt")
+    version = None
+    if os.path.isfile(metadata):
+        with open(metadata) as metadata_file:
+            version = next((line.split("=", 1)[1].strip() for line in metadata_file if line.startswith("version=")), None)
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "transmat_version": version,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "gdal": gdal.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def compare(baseline_path, results_path):
+    # Ratio of the fastest time of every case and stage to the baseline, below 1 is faster
+    keys = ["size", "dtype", "classes", "nodata_fraction", "change_fraction", "mismatch", "workers", "stage"]
+    with open(baseline_path) as baseline_file:
+        baseline = {tuple(result[key] for key in keys): result for result in json.load(baseline_file)["results"]}
+    with open(results_path) as results_file:
+        results = json.load(results_file)["results"]
+
+    print(";".join(keys + ["baseline_seconds", "seconds", "ratio"]))
+    for result in results:
+        old = baseline.get(tuple(result[key] for key in keys))
+        if old is None or not old["seconds"]:
+            continue
+        print(";".join([str(result[key]) for key in keys] + [f"{old['seconds']:.4f}", f"{result['seconds']:.4f}", f"{result['seconds'] / old['seconds']:.3f}"]))
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(prog="python -m transmat.benchmark", description="Time and memory of the transmat stages on synthetic rasters.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1024, 4096], help="width and height of the rasters in pixels")
+    parser.add_argument("--dtypes", nargs="+", default=["uint8"], choices=sorted(GDAL_TYPES))
+    parser.add_argument("--classes", type=int, nargs="+", default=[8])
+    parser.add_argument("--nodata-fractions", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--change-fraction", type=float, default=0.1)
+    parser.add_argument("--mismatch", nargs="+", default=["none"], choices=["none", "extent", "crs"])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results as .json, printed if not given")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "RESULTS"), help="compare two result files instead of running")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+    if arguments.compare:
+        compare(*arguments.compare)
+        return 0
+
+    gdal.UseExceptions()
+    results = []
+    for size in arguments.sizes:
+        for dtype in arguments.dtypes:
+            for n_classes in arguments.classes:
+                for nodata_fraction in arguments.nodata_fractions:
+                    for mismatch in arguments.mismatch:
+                        for workers in arguments.workers:
+                            case = {
+                                "size": size,
+                                "dtype": dtype,
+                                "classes": n_classes,
+                                "nodata_fraction": nodata_fraction,
+                                "change_fraction": arguments.change_fraction,
+                                "mismatch": mismatch,
+                                "workers": workers,
+                                "null_value": 0,
+                                "seed": arguments.seed,
+                            }
+                            directory = tempfile.mkdtemp(prefix="transmat_benchmark_")
+                            try:
+                                results += run_case(directory, case, arguments.repeat)
+                            finally:
+                                shutil.rmtree(directory, ignore_errors=True)
+                            print(f"{size} px {dtype} {n_classes} classes {nodata_fraction} no data {mismatch} {workers} workers: "
+                                  + ", ".join(f"{result['stage']} {result['seconds']:.3f} s" for result in results[-len(STAGES):]), file=sys.stderr)
+
+    output = json.dumps({"environment": environment(), "results": results}, indent=1)
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+from qgis.core import *
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from osgeo import gdal
+from .counting import pair_index
+from .tiles import matrix_arrays, stored_matrix, tile_store, trusted
+
+# Bump when the stored format or the counting results change
+CACHE_VERSION = 4
+
+# Size of the cached results before the least recently used entries are removed
+CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# Size of the tile stores, which hold the pair codes of whole rasters, before the least recently used ones are removed;
+# the store used last is always kept
+TILE_STORE_BYTES = 8 * 1024 * 1024 * 1024
+
+def file_stamps(layer:QgsRasterLayer):
+    # [path, size, modification time] of every file a GDAL layer reads, the sources of a VRT included, or None when that is
+    # not known: other providers, connection strings and remote or virtual files can change without a visible trace
+    path = layer.source().split("|")[0]
+    if layer.providerType() != "gdal" or not os.path.isfile(path):
+        return None
+    try:
+        dataset = gdal.Open(path)
+    except RuntimeError:
+        dataset = None
+    stamps = []
+    for name in (dataset.GetFileList() if dataset is not None else None) or [path]:
+        stamp = file_stamp(name)
+        if stamp is None:
+            return None
+        stamps.append([name, *stamp])
+    return stamps
+
+def layer_fingerprint(layer:QgsRasterLayer, band, file_state=True):
+    # A file that was rewritten gets a new modification time or size, the crs, extent and no-data settings cover changes made in QGIS.
+    # Without file_state only the layout is described, which stays the same when pixels are edited in place.
+    # The stamps are None when the files of the layer are not known, see trusted
+    provider = layer.dataProvider()
+    return [
+        layer.source(),
+        file_stamps(layer) if file_state else None,
+        band,
+        layer.crs().authid(),
+        layer.extent().toString(),
+        layer.width(),
+        layer.height(),
+        provider.sourceNoDataValue(band) if provider.sourceHasNoDataValue(band) else None,
+        provider.useSourceNoDataValue(band),
+        [[null_range.min(), null_range.max(), null_range.bounds()] for null_range in provider.userNoDataValues(band)],
+    ]
+
+def file_stamp(path):
+    # Size and modification time of a file, None if it is missing
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+class result_cache:
+    # On-disk cache of count matrices, pair-code indexes and harmonized rasters, one directory per input fingerprint
+    def __init__(self, directory=None, max_bytes=CACHE_BYTES, max_tile_bytes=TILE_STORE_BYTES):
+        self.directory = directory or os.path.join(QgsApplication.qgisSettingsDirPath(), "transmat_cache")
+        self.max_bytes = max_bytes
+        self.max_tile_bytes = max_tile_bytes
+
+    def key(self, layers, bands, *options, file_state=True):
+        # None when a layer has no file stamps, its results are then not cached
+        fingerprints = [layer_fingerprint(layer, band, file_state) for layer, band in zip(layers, bands)]
+        if file_state and not all(trusted(fingerprint) for fingerprint in fingerprints):
+            return None
+        description = json.dumps([CACHE_VERSION, fingerprints, list(options)], default=str)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def tiles(self, layers, bands, *options):
+        # Tile store of the inputs with the same layout and settings, kept across edits of their pixels
+        return tile_store(os.path.join(self.directory, "tiles_" + self.key(layers, bands, *options, file_state=False)))
+
+    def load(self, key, matrix_renderer):
+        # Fills the renderer and returns the paths and names of the cached harmonized rasters ([] if none), or None on a miss
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            with open(os.path.join(path, "entry.json")) as entry_file:
+                entry = json.load(entry_file)
+            arrays = np.load(os.path.join(path, "matrix.npz"), allow_pickle=False)
+        except (OSError, ValueError):
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        matrix_renderer.unique_values = arrays["unique_values"]
+        matrix_renderer.n_classes = matrix_renderer.unique_values.size
+        matrix_renderer.transition_counts = stored_matrix(arrays, "transition_counts", matrix_renderer.n_classes)
+        matrix_renderer.transition_areas = stored_matrix(arrays, "transition_areas", matrix_renderer.n_classes)
+        matrix_renderer.value_to_index = {val: idx for idx, val in enumerate(matrix_renderer.unique_values)}
+        matrix_renderer.width = entry["width"]
+        matrix_renderer.height = entry["height"]
+        matrix_renderer.extent = QgsRectangle(*entry["extent"])
+        matrix_renderer.raster1_layer_crs = QgsCoordinateReferenceSystem.fromWkt(entry["crs"])
+        matrix_renderer.mask_cache.clear()
+        matrix_renderer.mask_cache_bytes = 0
+
+        # The index refers to the pair codes where they were written, mostly in a tile store; a file that changed since
+        # (a later run recounted the tile, or the store was removed) makes the entry a miss so the matrix is counted again
+        matrix_renderer.pair_index = None
+        if "index" in entry:
+            files = {os.path.join(self.directory, name): state for name, state in entry["index"]["files"].items()}
+            if any(file_stamp(name) != state for name, state in files.items()):
+                return None
+            index_arrays = np.load(os.path.join(path, "index.npz"), allow_pickle=False)
+            matrix_renderer.pair_index = pair_index(entry["width"], entry["height"])
+            for number, (window, (name, offset, dtype, shape)) in enumerate(zip(index_arrays["windows"], entry["index"]["tiles"])):
+                location = (os.path.join(self.directory, name), offset, dtype, tuple(shape))
+                arrays = [index_arrays[f"{array}_{number}"] for array in ("classes", "overview", "from_present", "to_present")]
+                matrix_renderer.pair_index.add_stored(tuple(int(v) for v in window), location, *arrays)
+            for directory in {os.path.dirname(name) for name in files}:
+                os.utime(directory)
+
+        # Mark the entry as recently used
+        os.utime(path)
+        return [(os.path.join(path, filename), name) for filename, name in entry["harmonized"]]
+
+    def store(self, key, matrix_renderer, harmonized_layers=None):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # The entry is written next to the cache and renamed into place, so a half-written entry is never read
+        staging = tempfile.mkdtemp(dir=self.directory, prefix="staging_")
+        extent = matrix_renderer.extent
+        entry = {
+            "width": matrix_renderer.width,
+            "height": matrix_renderer.height,
+            "extent": [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()],
+            "crs": matrix_renderer.raster1_layer_crs.toWkt(),
+            "harmonized": [],
+        }
+        for number, layer in enumerate(harmonized_layers or []):
+            filename = f"raster{number + 1}{os.path.splitext(layer.source())[1]}"
+            shutil.copyfile(layer.source(), os.path.join(staging, filename))
+            entry["harmonized"].append([filename, layer.name()])
+
+        if matrix_renderer.pair_index is not None:
+            self.store_index(staging, key, entry, matrix_renderer.pair_index)
+
+        with open(os.path.join(staging, "entry.json"), "w") as entry_file:
+            json.dump(entry, entry_file)
+        arrays = matrix_arrays("transition_counts", matrix_renderer.transition_counts)
+        if matrix_renderer.transition_areas is not None:
+            arrays.update(matrix_arrays("transition_areas", matrix_renderer.transition_areas))
+        np.savez(os.path.join(staging, "matrix.npz"), unique_values=matrix_renderer.unique_values, **arrays)
+
+        path = os.path.join(self.directory, key)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(staging, path)
+        self.evict()
+
+    def store_index(self, staging, key, entry, index):
+        # Bitmaps and overviews go into index.npz, the pair codes are referred to where they are, with the size and modification
+        # time of their files. Codes outside of a tile store (an index counted without one) are written to the entry's pair_codes.bin
+        index_arrays = {"windows": np.array([tile[0] for tile in index.tiles], dtype=np.int64).reshape(-1, 4)}
+        tiles = []
+        for number, tile in enumerate(index.tiles):
+            _, location, unique_values, _, overview, from_present, to_present = tile
+            store = None if isinstance(location, np.ndarray) else os.path.dirname(location[0])
+            if store is None or os.path.dirname(store) != self.directory or not os.path.basename(store).startswith("tiles_"):
+                pair_codes = np.ascontiguousarray(index.codes(tile))
+                with open(os.path.join(staging, "pair_codes.bin"), "ab") as codes_file:
+                    offset = codes_file.tell()
+                    pair_codes.tofile(codes_file)
+                tiles.append([os.path.join(key, "pair_codes.bin"), offset, pair_codes.dtype.str, list(pair_codes.shape)])
+            else:
+                path, offset, dtype, shape = location
+                tiles.append([os.path.relpath(path, self.directory), offset, dtype, list(shape)])
+            index_arrays[f"classes_{number}"] = unique_values
+            index_arrays[f"overview_{number}"] = overview
+            index_arrays[f"from_present_{number}"] = from_present
+            index_arrays[f"to_present_{number}"] = to_present
+        np.savez(os.path.join(staging, "index.npz"), **index_arrays)
+
+        # Files are described as they are now; the entry's own file keeps its state when the staging directory is renamed
+        files = {}
+        for name, _, _, _ in tiles:
+            path = os.path.join(staging, "pair_codes.bin") if name == os.path.join(key, "pair_codes.bin") else os.path.join(self.directory, name)
+            files[name] = file_stamp(path)
+        entry["index"] = {"tiles": tiles, "files": files}
+
+    def evict(self):
+        # Remove the least recently used results until they fit into max_bytes, and the least recently used tile stores
+        # until they fit into max_tile_bytes; the tile store used last is kept, its next run may only recount a few tiles
+        results, stores = [], []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path) and not name.startswith("staging_"):
+                (stores if name.startswith("tiles_") else results).append((os.path.getmtime(path), entry_size(path), path))
+
+        for entries, max_bytes, keep in ((results, self.max_bytes, 0), (stores, self.max_tile_bytes, 1)):
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries[:len(entries) - keep]:
+                if total <= max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
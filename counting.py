@@ -0,0 +1,705 @@
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of pixels read from each raster at once when streaming the transition matrix
+TILE_PIXELS = 4 * 1024 * 1024
+
+# Integer rasters whose values span at most this many numbers are mapped to classes through a lookup table
+LOOKUP_RANGE = 1 << 16
+
+# Up to this many classes a matrix is a dense array, above it only the nonzero counts are kept
+DENSE_CLASSES = 1024
+
+
+def integer_range(rasters):
+    # (lowest value, number of values) spanned by integer rasters, or None for other types or ranges wider than LOOKUP_RANGE.
+    # 8 and 16 bit types are covered by their whole range, so the pixels do not have to be scanned
+    if not rasters or any(raster.dtype.kind not in "iu" for raster in rasters):
+        return None
+    low = min(np.iinfo(raster.dtype).min for raster in rasters)
+    high = max(np.iinfo(raster.dtype).max for raster in rasters)
+    if high - low + 1 > LOOKUP_RANGE:
+        filled = [raster for raster in rasters if raster.size]
+        if not filled:
+            return None
+        low = min(int(raster.min()) for raster in filled)
+        high = max(int(raster.max()) for raster in filled)
+        if high - low + 1 > LOOKUP_RANGE:
+            return None
+    return low, high - low + 1
+
+
+def data_pixels(raster, null_value):
+    # Pixels that hold data: not the no-data value and, in float rasters, not NaN
+    valid = raster != null_value
+    if raster.dtype.kind == "f":
+        valid &= ~np.isnan(raster)
+    return valid
+
+
+def combine_masks(*masks):
+    # Pixels inside every given mask, None when no mask is given
+    combined = None
+    for mask in masks:
+        if mask is not None:
+            combined = mask if combined is None else combined & mask
+    return combined
+
+
+class class_encoder:
+    # Sorted classes of some rasters without the no-data value, and the mapping of raster values to class indices.
+    # Integer rasters with a small value range go through a lookup table indexed by value - low,
+    # other types and sparse value ranges are sorted and searched
+    def __init__(self, rasters, null_value, mask=None):
+        # The range covers every pixel so that any pixel can be looked up, the classes only come from the pixels in the mask,
+        # which is one mask for all rasters or a list with a mask (or None) per raster
+        self.range = integer_range(rasters)
+        if mask is not None:
+            masks = mask if isinstance(mask, list) else [mask] * len(rasters)
+            rasters = [raster if raster_mask is None else raster[raster_mask] for raster, raster_mask in zip(rasters, masks)]
+        dtype = np.result_type(*rasters)
+
+        if self.range is None:
+            unique_values = np.unique(np.concatenate([np.unique(raster) for raster in rasters]).astype(dtype))
+        else:
+            low, span = self.range
+            present = np.zeros(span, dtype=bool)
+            for raster in rasters:
+                present |= np.bincount(self.offsets(raster).ravel(), minlength=span).astype(bool)
+            unique_values = (np.nonzero(present)[0] + low).astype(dtype)
+        self.unique_values = unique_values[data_pixels(unique_values, null_value)]
+
+        if self.range is not None:
+            self.lookup = np.zeros(self.range[1], dtype=np.int64)
+            self.lookup[self.offsets(self.unique_values)] = np.arange(self.unique_values.size)
+
+    def offsets(self, raster):
+        low = self.range[0]
+        return raster if low == 0 else np.subtract(raster, low, dtype=np.int64)
+
+    def index(self, raster):
+        # Class index of every pixel; pixels that are not a class get an arbitrary index and have to be masked by the caller
+        if self.range is None:
+            return np.searchsorted(self.unique_values, raster)
+        return self.lookup[self.offsets(raster)]
+
+
+def count_transitions(raster1, raster2, null_value, mask=None):
+    # Pixels are counted only if neither raster has the no-data value or NaN there and they lie inside the mask
+    encoder = class_encoder([raster1, raster2], null_value, mask)
+    n_classes = encoder.unique_values.size
+
+    valid = data_pixels(raster1, null_value) & data_pixels(raster2, null_value)
+    if mask is not None:
+        valid &= mask
+
+    # Map raster values to class indices and encode each pair as a single integer
+    index1 = encoder.index(raster1[valid])
+    index2 = encoder.index(raster2[valid])
+    pair_codes = index1.astype(np.int64) * n_classes + index2
+
+    return count_pairs(pair_codes, n_classes), encoder.unique_values
+
+
+def pair_code_dtype(n_classes):
+    # Smallest unsigned type that holds every pair code plus the no-data code n_classes ** 2
+    n_codes = n_classes * n_classes + 1
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_codes <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def encode_pairs(raster1, raster2, null_value, mask=None):
+    # Pair codes relative to the classes found in these rasters; no-data pixels and pixels outside the mask get the code n_classes ** 2
+    encoder = class_encoder([raster1, raster2], null_value, mask)
+    n_classes = encoder.unique_values.size
+
+    valid = data_pixels(raster1, null_value) & data_pixels(raster2, null_value)
+    if mask is not None:
+        valid &= mask
+    index1 = encoder.index(raster1)
+    index2 = encoder.index(raster2)
+    pair_codes = np.where(valid, index1.astype(np.int64) * n_classes + index2, n_classes * n_classes)
+
+    return pair_codes.astype(pair_code_dtype(n_classes)), encoder.unique_values
+
+
+def count_pairs(pair_codes, n_classes, weights=None):
+    # Count the pair codes of encode_pairs, the no-data code n_classes ** 2 is dropped; with weights (one per pixel, or a column
+    # of one weight per row, see count_row_weights) the weights of the pixels are summed instead.
+    # Few classes are counted in a dense histogram, many classes by sorting the codes into a sparse matrix
+    if weights is not None and pair_codes.ndim == 2 and np.shape(weights) == (pair_codes.shape[0], 1):
+        return count_row_weights(pair_codes, n_classes, np.ravel(weights))
+    if weights is not None:
+        weights = np.broadcast_to(weights, pair_codes.shape).ravel()
+
+    if n_classes <= DENSE_CLASSES:
+        counts = np.bincount(pair_codes.ravel(), weights, minlength=n_classes * n_classes + 1)
+        counts = counts[:n_classes * n_classes].reshape(n_classes, n_classes)
+        return counts if weights is not None else counts.astype(int)
+
+    if weights is None:
+        codes, counts = np.unique(pair_codes, return_counts=True)
+    else:
+        codes, inverse = np.unique(pair_codes, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights, minlength=codes.size)
+    codes = codes.astype(np.int64)
+    counted = codes < n_classes * n_classes
+    rows, columns = np.divmod(codes[counted], n_classes)
+    return sparse_matrix(rows, columns, counts[counted], n_classes)
+
+
+def count_row_weights(pair_codes, n_classes, row_weights, chunk_pixels=1 << 18):
+    # Weighted counts with one weight per row, without a weight for every pixel of the tile: equal weights scale the counts,
+    # other rows are weighted a chunk of rows at a time, so only the weights of one chunk are spread over its pixels
+    if pair_codes.size == 0 or np.all(row_weights == row_weights[0]):
+        counts = count_pairs(pair_codes, n_classes)
+        weight = float(row_weights[0]) if row_weights.size else 0.0
+        if isinstance(counts, sparse_matrix):
+            rows, columns, values = counts.entries()
+            return sparse_matrix(rows, columns, values * weight, n_classes)
+        return counts * weight
+
+    height, width = pair_codes.shape
+    chunk_rows = max(1, chunk_pixels // width)
+    parts = [count_pairs(pair_codes[start:start + chunk_rows].ravel(), n_classes, np.repeat(row_weights[start:start + chunk_rows], width)) for start in range(0, height, chunk_rows)]
+    if not isinstance(parts[0], sparse_matrix):
+        return sum(parts[1:], parts[0])
+    rows, columns, values = (np.concatenate(column) for column in zip(*(part.entries() for part in parts)))
+    return sparse_matrix(rows, columns, values, n_classes)
+
+
+class sparse_matrix:
+    # K x K count (or area) matrix in compressed sparse row form: the nonzero counts of row i are
+    # data[indptr[i]:indptr[i + 1]], in the columns indices[indptr[i]:indptr[i + 1]] sorted ascending
+    def __init__(self, rows, columns, counts, n_classes):
+        # Counts of repeated (row, column) entries are summed, zero counts are dropped
+        order = np.lexsort((columns, rows))
+        rows, columns, counts = rows[order], columns[order], counts[order]
+        starts = np.ones(counts.size, dtype=bool)
+        starts[1:] = (rows[1:] != rows[:-1]) | (columns[1:] != columns[:-1])
+        starts = np.nonzero(starts)[0]
+        counts = np.add.reduceat(counts, starts) if counts.size else counts
+        nonzero = counts != 0
+
+        self.data = counts[nonzero]
+        self.indices = columns[starts][nonzero].astype(np.int64)
+        self.indptr = np.searchsorted(rows[starts][nonzero], np.arange(n_classes + 1))
+        self.shape = (n_classes, n_classes)
+        self.size = n_classes * n_classes
+        self.ndim = 2
+
+    def entries(self):
+        # Coordinate form: rows, columns and counts of the nonzero cells
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        return rows, self.indices, self.data
+
+    def __getitem__(self, cell):
+        i, j = cell
+        start, end = self.indptr[i], self.indptr[i + 1]
+        k = start + np.searchsorted(self.indices[start:end], j)
+        if k < end and self.indices[k] == j:
+            return self.data[k]
+        return 0
+
+    def sum(self, axis=None):
+        if axis is None:
+            return self.data.sum()
+        rows, columns, counts = self.entries()
+        cells = rows if axis == 1 else columns
+        return np.bincount(cells, weights=counts, minlength=self.shape[0]).astype(self.data.dtype)
+
+    def toarray(self):
+        matrix = np.zeros(self.shape, dtype=self.data.dtype)
+        rows, columns, counts = self.entries()
+        matrix[rows, columns] = counts
+        return matrix
+
+
+def matrix_entries(counts):
+    # Rows, columns and counts of the nonzero cells of a dense or sparse matrix
+    if isinstance(counts, sparse_matrix):
+        return counts.entries()
+    rows, columns = np.nonzero(counts)
+    return rows, columns, counts[rows, columns]
+
+
+def reclassify(raster, table, null_value):
+    # Class of every pixel from a table of (minimum, maximum, class) rows, minimum inclusive and maximum exclusive,
+    # NaN bounds are open; the first matching row wins, pixels in no row and no-data pixels become null_value
+    table = np.asarray(table, dtype=float).reshape(-1, 3)
+    classes = table[:, 2]
+    # Integer output only when the classes and the no-data value fit it, so no-data pixels keep exactly null_value
+    integral = np.append(classes, null_value)
+    int64 = np.iinfo(np.int64)
+    fits = np.all(integral == np.round(integral)) and np.all((integral >= int64.min) & (integral <= int64.max))
+    dtype = np.int64 if fits else np.float64
+
+    reclassified = np.full(raster.shape, null_value, dtype=dtype)
+    unassigned = data_pixels(raster, null_value)
+    for minimum, maximum, value in table:
+        inside = unassigned.copy()
+        if not np.isnan(minimum):
+            inside &= raster >= minimum
+        if not np.isnan(maximum):
+            inside &= raster < maximum
+        reclassified[inside] = value
+        unassigned &= ~inside
+    return reclassified
+
+
+def break_table(breaks):
+    # Reclassification table binning values between consecutive breaks into the classes 1, 2, ...
+    breaks = sorted(breaks)
+    return [(low, high, number + 1) for number, (low, high) in enumerate(zip(breaks[:-1], breaks[1:]))]
+
+
+def series_pairs(n_dates, all_pairs=False):
+    # Consecutive date pairs first, then first to last, or every other earlier to later pair
+    pairs = [(t, t + 1) for t in range(n_dates - 1)]
+    if all_pairs:
+        pairs += [(s, t) for s in range(n_dates) for t in range(s + 2, n_dates)]
+    elif n_dates > 2:
+        pairs.append((0, n_dates - 1))
+    return pairs
+
+
+def count_series(rasters, null_value, pairs, masks=None):
+    # One matrix per date pair over the classes shared by all dates, every raster is encoded once;
+    # masks holds an optional mask of the valid pixels of every raster
+    masks = masks or [None] * len(rasters)
+    valid = [combine_masks(data_pixels(raster, null_value), mask) for raster, mask in zip(rasters, masks)]
+    encoder = class_encoder(rasters, null_value, valid)
+    unique_values = encoder.unique_values
+    n_classes = unique_values.size
+
+    indices = [encoder.index(raster) for raster in rasters]
+
+    counts = np.zeros((len(pairs), n_classes, n_classes), dtype=int)
+    for p, (s, t) in enumerate(pairs):
+        both = valid[s] & valid[t]
+        pair_codes = indices[s][both].astype(np.int64) * n_classes + indices[t][both]
+        counts[p] = np.bincount(pair_codes, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+
+    return counts, unique_values
+
+
+def tile_size(block_width, block_height, width, height, tile_pixels):
+    # Grow the native block by whole blocks until a tile holds roughly tile_pixels pixels
+    tile_width = min(width, block_width * max(1, int(np.sqrt(tile_pixels)) // block_width))
+    tile_height = min(height, block_height * max(1, tile_pixels // (tile_width * block_height)))
+    return tile_width, tile_height
+
+
+def tile_windows(width, height, tile_width, tile_height):
+    # Pixel windows (x offset, y offset, width, height) covering the raster row by row
+    for y in range(0, height, tile_height):
+        for x in range(0, width, tile_width):
+            yield x, y, min(tile_width, width - x), min(tile_height, height - y)
+
+
+def map_tiles(function, windows, workers=1):
+    # Apply function to every window on a thread pool and yield the results in window order
+    if workers <= 1:
+        for window in windows:
+            yield function(window)
+        return
+
+    # Only a few tiles per worker are in flight so memory stays bounded by the tile size
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for window in windows:
+            pending.append(executor.submit(function, window))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class transition_counter:
+    # Running transition matrix, or a stack of matrices when the counts have leading axes.
+    # A single matrix with more than DENSE_CLASSES classes is kept as (from, to, count) entries of class values
+    def __init__(self, null_value, consolidate_entries=1 << 20):
+        self.null_value = null_value
+        self.unique_values = None
+        self.transition_counts = np.zeros((0, 0), dtype=int)
+        self.parts = None
+        self.n_entries = 0
+        self.consolidate_entries = consolidate_entries
+
+    def add(self, raster1, raster2):
+        counts, unique_values = count_transitions(raster1, raster2, self.null_value)
+        self.add_counts(counts, unique_values)
+
+    def add_counts(self, counts, unique_values):
+        merged_values = unique_values if self.unique_values is None else np.union1d(self.unique_values, unique_values)
+        if self.parts is not None or (counts.ndim == 2 and merged_values.size > DENSE_CLASSES):
+            self.add_sparse_counts(counts, unique_values, merged_values)
+            return
+
+        if self.unique_values is None:
+            self.unique_values = unique_values
+            self.transition_counts = counts.copy()
+            return
+
+        # Grow the running matrix when a tile brings classes that were not seen yet
+        if merged_values.size != self.unique_values.size:
+            grown = np.zeros(self.transition_counts.shape[:-2] + (merged_values.size, merged_values.size), dtype=self.transition_counts.dtype)
+            old_index = np.searchsorted(merged_values, self.unique_values)
+            grown[..., old_index[:, None], old_index[None, :]] = self.transition_counts
+            self.unique_values = merged_values
+            self.transition_counts = grown
+
+        # Add the tile counts at the positions of its classes in the running matrix
+        index = np.searchsorted(self.unique_values, unique_values)
+        self.transition_counts[..., index[:, None], index[None, :]] += counts
+
+    def add_sparse_counts(self, counts, unique_values, merged_values):
+        if self.parts is None:
+            # The dense matrix counted so far becomes the first entries
+            self.parts = []
+            if self.unique_values is not None:
+                self.add_entries(self.transition_counts, self.unique_values)
+            self.transition_counts = None
+        self.add_entries(counts, unique_values)
+        self.unique_values = merged_values
+
+        if self.n_entries > self.consolidate_entries:
+            self.consolidate()
+            # Do not consolidate again until the entries have grown by the same amount
+            self.consolidate_entries = max(self.consolidate_entries, 2 * self.n_entries)
+
+    def add_entries(self, counts, unique_values):
+        rows, columns, counts = matrix_entries(counts)
+        self.parts.append((unique_values[rows], unique_values[columns], counts))
+        self.n_entries += counts.size
+
+    def consolidate(self):
+        # Sum repeated entries by building the sparse matrix over all classes seen so far
+        matrix = self.sparse_result()
+        self.parts = []
+        self.n_entries = 0
+        self.add_entries(matrix, self.unique_values)
+        return matrix
+
+    def sparse_result(self):
+        from_values, to_values, counts = (np.concatenate(column) for column in zip(*self.parts))
+        rows = np.searchsorted(self.unique_values, from_values)
+        columns = np.searchsorted(self.unique_values, to_values)
+        return sparse_matrix(rows, columns, counts, self.unique_values.size)
+
+    def result(self):
+        if self.unique_values is None:
+            return np.zeros((0, 0), dtype=int), np.array([])
+        if self.parts is not None:
+            return self.consolidate(), self.unique_values
+        return self.transition_counts, self.unique_values
+
+
+def sample_order(n_tiles, seed=None):
+    # Tile numbers in a stratified random order: the tiles are split into about sqrt(n_tiles) runs of neighbouring tiles and every
+    # round draws one tile of each run that was not drawn yet, so every prefix of the order is spread over the whole raster
+    rng = np.random.default_rng(seed)
+    size = max(1, int(np.sqrt(n_tiles)))
+    strata = [rng.permutation(np.arange(start, min(start + size, n_tiles))) for start in range(0, n_tiles, size)]
+    order = []
+    for draw in range(size):
+        order.extend(rng.permutation([stratum[draw] for stratum in strata if draw < stratum.size]))
+    return [int(number) for number in order]
+
+
+def square_counts(counts):
+    # Element-wise square of a dense or sparse matrix
+    if isinstance(counts, sparse_matrix):
+        rows, columns, values = counts.entries()
+        return sparse_matrix(rows, columns, values * values, counts.shape[0])
+    return counts * counts
+
+
+def scale_matrix(matrix, factor):
+    # Dense or sparse matrix times a number
+    if isinstance(matrix, sparse_matrix):
+        rows, columns, values = matrix.entries()
+        return sparse_matrix(rows, columns, values * factor, matrix.shape[0])
+    return matrix * factor
+
+
+class tile_sample:
+    # Estimate of the transition matrix from the first tiles of a random order, as a cluster sample without replacement:
+    # the total of a cell is n_tiles times its mean count per counted tile, with a normal confidence interval that
+    # narrows to zero once every tile is counted. The sums of the counts come from the running transition_counter
+    def __init__(self, null_value, n_tiles):
+        self.n_tiles = n_tiles
+        self.n_counted = 0
+        self.squares = transition_counter(null_value)
+
+    def add(self, counts, unique_values):
+        # Tiles without counted pixels (outside of an area) are part of the sample with zero counts
+        self.n_counted += 1
+        if counts is not None:
+            self.squares.add_counts(square_counts(counts), unique_values)
+
+    def estimate(self, sums, unique_values, z=1.96):
+        # Estimated counts and the half-widths of their confidence intervals (NaN until two tiles are counted), dense or sparse like sums.
+        # sums has to include every tile added so far; the squares are matched to it by cell, not by position
+        n, N = self.n_counted, self.n_tiles
+        if isinstance(sums, sparse_matrix):
+            rows, columns, values = sums.entries()
+        else:
+            values = sums
+        square_values = self.aligned_squares(sums, unique_values)
+        values = values.astype(float)
+        mean = values / n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = np.maximum(square_values - n * mean * mean, 0) / (n - 1) if n > 1 else np.full(mean.shape, np.nan)
+        margins = z * N * np.sqrt((1 - n / N) * variance / n)
+        if isinstance(sums, sparse_matrix):
+            return sparse_matrix(rows, columns, N * mean, sums.shape[0]), sparse_matrix(rows, columns, margins, sums.shape[0])
+        return N * mean, margins
+
+    def aligned_squares(self, sums, unique_values):
+        # Summed squares at the cells of sums: a matrix like a dense sums, the values at the entries of a sparse one
+        squares, square_classes = self.squares.result()
+        n_classes = unique_values.size
+        square_rows, square_columns, square_values = matrix_entries(squares)
+        index = np.searchsorted(unique_values, square_classes)
+        square_codes = index[square_rows].astype(np.int64) * n_classes + index[square_columns]
+        if not isinstance(sums, sparse_matrix):
+            aligned = np.zeros(sums.shape, dtype=float)
+            aligned.flat[square_codes] = square_values
+            return aligned
+        # Entries come in row-major order over sorted classes, so the square codes are sorted
+        rows, columns, _ = sums.entries()
+        codes = rows.astype(np.int64) * n_classes + columns
+        position = np.searchsorted(square_codes, codes)
+        found = position < square_codes.size
+        found[found] = square_codes[position[found]] == codes[found]
+        aligned = np.zeros(codes.size, dtype=float)
+        aligned[found] = square_values[position[found]]
+        return aligned
+
+
+def class_presence(counts):
+    # Classes of a tile matrix that occur in raster 1 (rows) and in raster 2 (columns)
+    return np.asarray(counts.sum(axis=1)) > 0, np.asarray(counts.sum(axis=0)) > 0
+
+
+def matching_pixels(pair_codes, codes, n_classes):
+    # Pixels of a pair-code tile holding one of codes; small code ranges go through a lookup table
+    if codes.size == 1:
+        return pair_codes == codes[0]
+    if n_classes * n_classes < LOOKUP_RANGE:
+        table = np.zeros(n_classes * n_classes + 1, dtype=bool)
+        table[codes] = True
+        return table[pair_codes]
+    return np.isin(pair_codes, codes)
+
+
+class pair_index:
+    # Pair-code tiles kept from the matrix computation, each coded against its own class list, with bitmaps of the classes
+    # every tile holds in raster 1 and raster 2 and a decimated copy of every tile for mask previews.
+    # With a path the pair codes are appended to that file and read back per tile when queried, so only the bitmaps and previews stay in memory.
+    # Tiles can also point to a file that already holds their codes, such as a tile store. No file handle or map stays open between queries
+    def __init__(self, width, height, preview_size=400, path=None):
+        self.width = width
+        self.height = height
+        self.tiles = []
+        self.path = path
+        self.offset = 0
+        if path is not None:
+            open(path, "wb").close()
+
+        # Every step-th pixel in both directions makes up the preview, so its longer side is at most preview_size
+        self.step = max(1, -(-max(width, height) // preview_size))
+        self.preview_shape = (-(-height // self.step), -(-width // self.step))
+
+    def add(self, window, pair_codes, unique_values, from_present=None, to_present=None, stored=None):
+        # Without the class bitmaps (see class_presence) they are taken from the pair codes.
+        # stored is the path of a file holding exactly these codes, they are then read from there instead of kept or appended to path
+        n_classes = unique_values.size
+        if from_present is None:
+            codes = np.unique(pair_codes)
+            codes = codes[codes < n_classes * n_classes]
+            from_present = np.zeros(n_classes, dtype=bool)
+            to_present = np.zeros(n_classes, dtype=bool)
+            from_present[codes // n_classes] = True
+            to_present[codes % n_classes] = True
+
+        overview = self.overview(window, pair_codes)
+        if stored is not None:
+            pair_codes = (stored, 0, pair_codes.dtype.str, pair_codes.shape)
+        elif self.path is not None:
+            pair_codes = np.ascontiguousarray(pair_codes)
+            with open(self.path, "ab") as codes_file:
+                pair_codes.tofile(codes_file)
+            location = (self.path, self.offset, pair_codes.dtype.str, pair_codes.shape)
+            self.offset += pair_codes.nbytes
+            pair_codes = location
+        self.tiles.append((window, pair_codes, unique_values, self.overview_offset(window), overview, from_present, to_present))
+
+    def add_stored(self, window, location, unique_values, overview, from_present, to_present):
+        # Tile whose codes are at location (path, offset, dtype, shape) and whose overview and bitmaps were kept, nothing is read
+        self.tiles.append((window, tuple(location), unique_values, self.overview_offset(window), overview, from_present, to_present))
+
+    def overview(self, window, pair_codes):
+        # Pixels of the tile on the global preview grid, starting at the first of them
+        x, y, _, _ = window
+        return pair_codes[(-y) % self.step::self.step, (-x) % self.step::self.step].copy()
+
+    def overview_offset(self, window):
+        x, y, _, _ = window
+        return (x + (-x) % self.step) // self.step, (y + (-y) % self.step) // self.step
+
+    def codes(self, tile):
+        # Pair codes of a tile, read from a file when it is stored as (path, offset, dtype, shape)
+        pair_codes = tile[1]
+        if isinstance(pair_codes, np.ndarray):
+            return pair_codes
+        path, offset, dtype, shape = pair_codes
+        return np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    def tile_codes(self, tile, cells):
+        # Codes of the (from, to) value cells in the class list of a tile. Cells whose from class is not in raster 1
+        # or whose to class is not in raster 2 of the tile are left out, so an empty result means the tile cannot match
+        _, _, unique_values, _, _, from_present, to_present = tile
+        n_classes = unique_values.size
+        cells = np.asarray(cells).reshape(-1, 2)
+        i = np.searchsorted(unique_values, cells[:, 0])
+        j = np.searchsorted(unique_values, cells[:, 1])
+        found = (i < n_classes) & (j < n_classes)
+        i, j, cells = i[found], j[found], cells[found]
+        found = (unique_values[i] == cells[:, 0]) & (unique_values[j] == cells[:, 1])
+        i, j = i[found], j[found]
+        present = from_present[i] & to_present[j]
+        return np.unique(i[present] * n_classes + j[present])
+
+    def cell_tiles(self, cells):
+        # Window and mask of the pixels of the cells for every tile that can hold one of them; the codes of other tiles are not read
+        for tile in self.tiles:
+            codes = self.tile_codes(tile, cells)
+            if codes.size:
+                yield tile[0], matching_pixels(self.codes(tile), codes, tile[2].size)
+
+    def mask(self, cells):
+        transition_mask = np.zeros((self.height, self.width), dtype=bool)
+        for (x, y, w, h), tile_mask in self.cell_tiles(cells):
+            transition_mask[y:y + h, x:x + w] = tile_mask
+        return transition_mask
+
+    def count(self, cells, region=None):
+        # Number of pixels of the cells; region(window) limits them to a mask of the window, returns None for all of it
+        # or False for none of it, in which case the tile is skipped before its codes are read
+        total = 0
+        for tile in self.tiles:
+            inside = region(tile[0]) if region is not None else None
+            if inside is False:
+                continue
+            codes = self.tile_codes(tile, cells)
+            if not codes.size:
+                continue
+            tile_mask = matching_pixels(self.codes(tile), codes, tile[2].size)
+            total += np.count_nonzero(tile_mask if inside is None else tile_mask & inside)
+        return total
+
+    def transition_tiles(self, unique_values):
+        # Windows and pair codes of every tile recoded against the global classes unique_values (i * K + j), no data as K ** 2
+        n_classes = unique_values.size
+        for tile in self.tiles:
+            window, tile_values, pair_codes = tile[0], tile[2], self.codes(tile)
+            n_tile_classes = tile_values.size
+            if n_tile_classes == 0:
+                yield window, np.full(pair_codes.shape, n_classes * n_classes, dtype=np.int64)
+                continue
+            index = np.searchsorted(unique_values, tile_values)
+            codes = pair_codes.astype(np.int64)
+            i, j = np.divmod(codes, n_tile_classes)
+            global_codes = index[np.minimum(i, n_tile_classes - 1)] * n_classes + index[j]
+            yield window, np.where(codes == n_tile_classes * n_tile_classes, n_classes * n_classes, global_codes)
+
+    def preview(self, cells):
+        preview_mask = np.zeros(self.preview_shape, dtype=bool)
+        for tile in self.tiles:
+            codes = self.tile_codes(tile, cells)
+            if codes.size:
+                _, _, unique_values, (x, y), overview, _, _ = tile
+                h, w = overview.shape
+                preview_mask[y:y + h, x:x + w] = matching_pixels(overview, codes, unique_values.size)
+        return preview_mask
+
+
+def count_zones(raster1, raster2, zones, null_value, zone_null_value, mask=None):
+    # Nonzero (zone, from, to, count) entries of one tile, pixels without a zone are not counted
+    valid = data_pixels(raster1, null_value) & data_pixels(raster2, null_value) & data_pixels(zones, zone_null_value)
+    if mask is not None:
+        valid &= mask
+
+    zone_values, zone_index = np.unique(zones[valid], return_inverse=True)
+    encoder = class_encoder([raster1[valid], raster2[valid]], null_value)
+    unique_values = encoder.unique_values
+    n_zones = zone_values.size
+    n_classes = unique_values.size
+
+    index1 = encoder.index(raster1[valid])
+    index2 = encoder.index(raster2[valid])
+    codes = (zone_index.astype(np.int64) * n_classes + index1) * n_classes + index2
+
+    # A dense histogram is cheaper while it is not much larger than the tile, otherwise the codes are sorted
+    if n_zones * n_classes * n_classes <= 4 * codes.size:
+        counts = np.bincount(codes, minlength=n_zones * n_classes * n_classes)
+        codes = np.nonzero(counts)[0]
+        counts = counts[codes]
+    else:
+        codes, counts = np.unique(codes, return_counts=True)
+
+    codes, index2 = np.divmod(codes, n_classes)
+    zone_index, index1 = np.divmod(codes, n_classes)
+    return zone_values[zone_index], unique_values[index1], unique_values[index2], counts
+
+
+class zonal_counter:
+    # Sparse running Z x K x K tensor stored as (zone, from, to, count) entries
+    def __init__(self, consolidate_entries=1 << 20):
+        self.parts = []
+        self.n_entries = 0
+        self.consolidate_entries = consolidate_entries
+
+    def add_entries(self, zones, from_values, to_values, counts):
+        self.parts.append((zones, from_values, to_values, counts))
+        self.n_entries += counts.size
+        if self.n_entries > self.consolidate_entries:
+            self.consolidate()
+            # Do not consolidate again until the table has grown by the same amount
+            self.consolidate_entries = max(self.consolidate_entries, 2 * self.n_entries)
+
+    def consolidate(self):
+        if not self.parts:
+            return
+        zones, from_values, to_values, counts = (np.concatenate(column) for column in zip(*self.parts))
+
+        # Sum the counts of identical (zone, from, to) entries
+        order = np.lexsort((to_values, from_values, zones))
+        zones, from_values, to_values, counts = zones[order], from_values[order], to_values[order], counts[order]
+        starts = np.ones(counts.size, dtype=bool)
+        starts[1:] = (zones[1:] != zones[:-1]) | (from_values[1:] != from_values[:-1]) | (to_values[1:] != to_values[:-1])
+        starts = np.nonzero(starts)[0]
+        counts = np.add.reduceat(counts, starts) if counts.size else counts
+
+        self.parts = [(zones[starts], from_values[starts], to_values[starts], counts)]
+        self.n_entries = counts.size
+
+    def result(self):
+        self.consolidate()
+        if not self.parts:
+            return np.array([]), np.array([]), np.array([]), np.array([], dtype=int)
+        return self.parts[0]
+
+    def dense(self):
+        # Z x K x K tensor over the zones and classes that occur, for small numbers of zones
+        zones, from_values, to_values, counts = self.result()
+        zone_values = np.unique(zones)
+        unique_values = np.union1d(from_values, to_values)
+        tensor = np.zeros((zone_values.size, unique_values.size, unique_values.size), dtype=int)
+        tensor[np.searchsorted(zone_values, zones), np.searchsorted(unique_values, from_values), np.searchsorted(unique_values, to_values)] = counts
+        return tensor, zone_values, unique_values
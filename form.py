@@ -5,7 +5,17 @@ from qgis.core import *
 from qgis.gui import *
 from qgis.utils import iface
 import numpy as np
+import os
+import tempfile
+import time
 from .geospatial import renderer
+from .units import AREA_UNITS
+from .task import transmat_task
+from .model import matrix_model
+from .counting import break_table, sparse_matrix
+from .profiling import PROFILE_LOG_TAG
+
+SELECTION_TIP = "Select cells, rows or columns to generate a transition mask."
 
 class message(QDialog):
     def __init__(self):
@@ -27,11 +37,50 @@ class message(QDialog):
         self.raster2_band_label = QLabel("Raster 2 band")
         self.raster2_band_combo = QComboBox()
 
-        self.na_spin_label = QLabel("No-Data value")
-        self.na_spin = QSpinBox()
-        self.na_spin.setMinimum(-9999)
-        self.na_spin.setMaximum(9999)
-        self.na_spin.setValue(0)
+        # Any integer or float value, e.g. -32768 or -3.4e38, can be the no-data value
+        self.na_edit_label = QLabel("No-Data value")
+        self.na_edit = QLineEdit("0")
+        self.na_edit.setValidator(QDoubleValidator())
+
+        # Pixels marked by the no-data value, no-data ranges or mask bands of the layers are skipped too
+        self.layer_nodata_checkbox = QCheckBox("Use layer no-data values and masks")
+        self.layer_nodata_checkbox.setChecked(True)
+
+        # Areas cost a measurement per raster row and a weighted count per tile, so they are only computed on request
+        self.areas_checkbox = QCheckBox("Measure transition areas (ha, km²)")
+
+        # Optional breaks that bin continuous (float) values into the classes 1, 2, ...
+        self.breaks_edit_label = QLabel("Class breaks")
+        self.breaks_edit = QLineEdit()
+        self.breaks_edit.setPlaceholderText("Optional, e.g. 0, 0.2, 0.5, 1")
+
+        # Number of threads counting raster tiles in parallel
+        self.workers_spin_label = QLabel("Worker threads")
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setMinimum(1)
+        self.workers_spin.setMaximum(os.cpu_count() or 1)
+        self.workers_spin.setValue(1)
+
+        # Area the matrix is computed for
+        self.area_combo_label = QLabel("Area")
+        self.area_combo = QComboBox()
+        self.area_combo.addItems(["Whole raster", "Map canvas extent", "Polygon layer"])
+        self.area_layer_combo = QgsMapLayerComboBox()
+        self.area_layer_combo.setFilters(Qgis.LayerFilter.PolygonLayer)
+        self.area_selected_checkbox = QCheckBox("Selected features only")
+        self.area_layer_combo.hide()
+        self.area_selected_checkbox.hide()
+
+        # Reuse results of unchanged inputs stored on disk
+        self.cache_checkbox = QCheckBox("Cache results")
+        self.cache_checkbox.setChecked(True)
+
+        # Dump cProfile statistics of the background task for performance reports
+        self.cprofile_checkbox = QCheckBox("Write cProfile dump")
+
+        # Count the tiles in a random order and show estimates with confidence intervals while the exact matrix is counted
+        self.quick_estimate_checkbox = QCheckBox("Quick estimate (refine the table while counting)")
+        self.estimating = False
 
         # Auto-compatibility fix checkbox
         self.compatibility_checkbox = QCheckBox("Auto-compatibility fix")
@@ -46,6 +95,18 @@ class message(QDialog):
         # Button to generate matrix
         self.generate_btn = QPushButton("Generate Transition Matrix")
 
+        # Progress of the background task and a button to cancel it
+        self.task = None
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.hide()
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.hide()
+
+        # Time and memory of the stages of the last run
+        self.profile_label = QLabel()
+        self.profile_label.hide()
+
         # QComboBox Matrix values shown label
         self.values_shown_combo_label = QLabel("Values shown")
         self.values_shown_combo_label.hide()
@@ -58,7 +119,7 @@ class message(QDialog):
         self.transition_mask_tip_label = QLabel()
 
         # Selection plot
-        self.transition_mask = np.array([])
+        self.selected_cells = []
         self.pixmap_label = QLabel()
         width, height = 200, 200
         self.pixmap_white = QPixmap(width, height)
@@ -70,26 +131,31 @@ class message(QDialog):
         self.close_button = QPushButton("&Close")
         self.save_matrix_button = QPushButton("&Save Transition Matrix")
         self.save_selection_button = QPushButton("&Save Transition Mask")
+        self.export_transitions_button = QPushButton("&Export Transitions")
         self.harmonized_rasters_button = QPushButton("&Add Harmonized Rasters")
         self.button_layout = QHBoxLayout()
         self.button_layout.addStretch()
         self.button_layout.addWidget(self.close_button)
         self.button_layout.addWidget(self.save_matrix_button)
         self.button_layout.addWidget(self.save_selection_button)
+        self.button_layout.addWidget(self.export_transitions_button)
         self.button_layout.addWidget(self.harmonized_rasters_button)
         self.harmonized_rasters_button.hide()
 
         # Matrix table layout
-        self.transition_counts = np.array([])
+        self.renderer = renderer()
+        self.harmonized_rasters_added = False
         table_top_label = QLabel("Raster 2")
         table_top_label.setAlignment(Qt.AlignCenter)
         table_left_label = QLabel("Raster 1")
         table_left_label.setAlignment(Qt.AlignCenter)
-        self.table_widget = QTableWidget()
+        self.matrix_model = matrix_model()
+        self.table_view = QTableView()
+        self.table_view.setModel(self.matrix_model)
         self.table_layout = QGridLayout()
         self.table_layout.addWidget(table_top_label, 0, 1)
         self.table_layout.addWidget(table_left_label, 1, 0)
-        self.table_layout.addWidget(self.table_widget, 1, 1)
+        self.table_layout.addWidget(self.table_view, 1, 1)
 
         # Add to your main layout
         mainLayout = QVBoxLayout()
@@ -101,12 +167,28 @@ class message(QDialog):
         mainLayout.addWidget(self.raster2_combo)
         mainLayout.addWidget(self.raster2_band_label)
         mainLayout.addWidget(self.raster2_band_combo)
-        mainLayout.addWidget(self.na_spin_label)
-        mainLayout.addWidget(self.na_spin)
+        mainLayout.addWidget(self.na_edit_label)
+        mainLayout.addWidget(self.na_edit)
+        mainLayout.addWidget(self.layer_nodata_checkbox)
+        mainLayout.addWidget(self.areas_checkbox)
+        mainLayout.addWidget(self.breaks_edit_label)
+        mainLayout.addWidget(self.breaks_edit)
+        mainLayout.addWidget(self.workers_spin_label)
+        mainLayout.addWidget(self.workers_spin)
+        mainLayout.addWidget(self.area_combo_label)
+        mainLayout.addWidget(self.area_combo)
+        mainLayout.addWidget(self.area_layer_combo)
+        mainLayout.addWidget(self.area_selected_checkbox)
+        mainLayout.addWidget(self.cache_checkbox)
+        mainLayout.addWidget(self.cprofile_checkbox)
+        mainLayout.addWidget(self.quick_estimate_checkbox)
         mainLayout.addWidget(self.compatibility_checkbox)
         mainLayout.addWidget(self.default_raster_combo_label)
         mainLayout.addWidget(self.default_raster_combo)
         mainLayout.addWidget(self.generate_btn)
+        mainLayout.addWidget(self.progress_bar)
+        mainLayout.addWidget(self.cancel_btn)
+        mainLayout.addWidget(self.profile_label)
         mainLayout.addWidget(self.values_shown_combo_label)
         mainLayout.addWidget(self.values_shown_combo)
         mainLayout.addLayout(self.table_layout)
@@ -121,14 +203,17 @@ class message(QDialog):
         # Actions
         self.compatibility_checkbox.stateChanged.connect(self.toggle_visibility_defrast)
         self.generate_btn.clicked.connect(self.compute_transition_matrix)
+        self.cancel_btn.clicked.connect(self.cancel_transition_matrix)
         self.close_button.clicked.connect(self.close)
         self.save_matrix_button.clicked.connect(self.save_matrix)
-        self.table_widget.cellClicked.connect(self.on_cell_clicked)
+        self.table_view.selectionModel().selectionChanged.connect(self.on_selection_changed)
         self.save_selection_button.clicked.connect(self.save_transition_mask_as_tif)
+        self.export_transitions_button.clicked.connect(self.export_transitions)
         self.harmonized_rasters_button.clicked.connect(self.add_rasters)
         self.raster1_combo.layerChanged.connect(self.setup_raster1_band_combo)
         self.raster2_combo.layerChanged.connect(self.setup_raster2_band_combo)
         self.values_shown_combo.currentIndexChanged.connect(self.change_shown_values)
+        self.area_combo.currentIndexChanged.connect(self.toggle_visibility_area)
 
         self.setup_raster1_band_combo()
         self.setup_raster2_band_combo()
@@ -141,62 +226,187 @@ class message(QDialog):
             self.default_raster_combo_label.hide()
             self.default_raster_combo.hide()
 
+    def toggle_visibility_area(self):
+        if self.area_combo.currentText() == "Polygon layer":
+            self.area_layer_combo.show()
+            self.area_selected_checkbox.show()
+        else:
+            self.area_layer_combo.hide()
+            self.area_selected_checkbox.hide()
+
+    def selected_area(self):
+        # Geometry and crs of the chosen area, (None, None) for the whole raster
+        if self.area_combo.currentText() == "Map canvas extent":
+            canvas = iface.mapCanvas()
+            return QgsGeometry.fromRect(canvas.extent()), canvas.mapSettings().destinationCrs()
+
+        if self.area_combo.currentText() == "Polygon layer":
+            area_layer = self.area_layer_combo.currentLayer()
+            if area_layer is None:
+                return None, None
+            if self.area_selected_checkbox.isChecked():
+                features = area_layer.getSelectedFeatures()
+            else:
+                features = area_layer.getFeatures()
+            geometries = [feature.geometry() for feature in features if feature.hasGeometry()]
+            if not geometries:
+                return None, None
+            return QgsGeometry.unaryUnion(geometries), area_layer.crs()
+
+        return None, None
+
     def compute_transition_matrix(self):
-        self.raster1_layer = self.raster1_combo.currentLayer()
-        self.raster2_layer = self.raster2_combo.currentLayer()
-        null_value = self.na_spin.value()
+        raster1_layer = self.raster1_combo.currentLayer()
+        raster2_layer = self.raster2_combo.currentLayer()
 
-        if not self.raster1_layer or not self.raster2_layer:
+        if not raster1_layer or not raster2_layer:
             QMessageBox.warning(self, "Missing Input", "Please select two raster layers.")
             return
-        
-        # Check the raster compatibility
-        rast_check = renderer.check_rasters(self, self.raster1_layer, self.raster2_layer)
-        fixed_layers = None
-        # If it is not none there is a compatibility problem
-        if rast_check is not None:
-            # If auto-compatibility is enabled try to fix the rasters
-            if self.compatibility_checkbox.isChecked():
-                fixed_layers = renderer.fix_rasters(self, self.raster1_layer, self.raster2_layer, self.default_raster_combo.currentText())
-                # If string is returned the harmonisation was not successful
-                if isinstance(fixed_layers, str):
-                    QMessageBox.critical(self, "Auto-compatibility fix failed", fixed_layers)
-                    return
-                idx = 0 if self.default_raster_combo.currentText() == "Raster 1" else 1
-                self.raster1_layer, self.raster2_layer = fixed_layers[idx], fixed_layers[1 - idx]
-            else:
-                QMessageBox.warning(self, "Raster Layer Error" ,rast_check)
-                return
 
-        self.matrix = renderer.calculate_transmat(self, self.raster1_layer, self.raster2_layer, null_value)
+        area, area_crs = self.selected_area()
+        if area is None and self.area_combo.currentText() == "Polygon layer":
+            QMessageBox.warning(self, "Missing Input", "Please select a polygon layer with at least one feature.")
+            return
 
-        self.table_widget.clear()
-        self.table_widget.setRowCount(self.n_classes)
-        self.table_widget.setColumnCount(self.n_classes)
-        self.table_widget.setHorizontalHeaderLabels([str(v) for v in self.unique_values])
-        self.table_widget.setVerticalHeaderLabels([str(v) for v in self.unique_values])
+        try:
+            null_value = float(self.na_edit.text())
+        except ValueError:
+            QMessageBox.warning(self, "Invalid Input", "The No-Data value must be a number.")
+            return
+        if null_value.is_integer():
+            null_value = int(null_value)
+
+        reclass_table = None
+        if self.breaks_edit.text().strip():
+            try:
+                breaks = [float(value) for value in self.breaks_edit.text().replace(";", ",").split(",") if value.strip()]
+            except ValueError:
+                breaks = []
+            if len(breaks) < 2:
+                QMessageBox.warning(self, "Invalid Input", "Class breaks must be at least two comma-separated numbers.")
+                return
+            reclass_table = break_table(breaks)
+
+        # The widget state is read here, the check, harmonization and counting run in a background task
+        self.task = transmat_task(
+            raster1_layer,
+            raster2_layer,
+            int(self.raster1_band_combo.currentText()),
+            int(self.raster2_band_combo.currentText()),
+            null_value,
+            self.compatibility_checkbox.isChecked(),
+            self.default_raster_combo.currentText(),
+            self.workers_spin.value(),
+            self.cache_checkbox.isChecked(),
+            area,
+            area_crs,
+            reclass_table,
+            self.areas_checkbox.isChecked(),
+            os.path.join(tempfile.gettempdir(), time.strftime("transmat_%Y%m%d_%H%M%S.prof")) if self.cprofile_checkbox.isChecked() else None,
+            self.layer_nodata_checkbox.isChecked(),
+            self.quick_estimate_checkbox.isChecked()
+        )
+        self.task.progressChanged.connect(self.update_progress)
+        self.task.matrix_ready.connect(self.show_transition_matrix)
+        self.task.matrix_estimated.connect(self.show_estimate)
+        self.task.run_failed.connect(self.show_task_error)
+        self.task.taskCompleted.connect(self.task_done)
+        self.task.taskTerminated.connect(self.task_done)
+
+        self.generate_btn.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.cancel_btn.show()
+        QgsApplication.taskManager().addTask(self.task)
+
+    def update_progress(self, progress):
+        self.progress_bar.setValue(int(progress))
+
+    def cancel_transition_matrix(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def task_done(self):
+        self.task = None
+        self.generate_btn.setEnabled(True)
+        self.progress_bar.hide()
+        self.cancel_btn.hide()
+
+        # A run that failed or was canceled while estimating gives the table back to the last finished matrix
+        if self.estimating:
+            self.estimating = False
+            if self.renderer.unique_values is not None:
+                self.matrix_model.set_matrix(self.renderer.transition_counts, self.renderer.unique_values, self.renderer.transition_areas)
+            else:
+                self.matrix_model.set_matrix(np.zeros((0, 0), dtype=int), [])
+            self.transition_mask_tip_label.setText(SELECTION_TIP if self.renderer.unique_values is not None else "")
+
+    def show_estimate(self, counts, margins, areas, unique_values, fraction):
+        # The estimate replaces the table while the task counts; masks are only available for the finished matrix
+        if not self.estimating:
+            self.estimating = True
+            self.table_view.clearSelection()
+            self.pixmap_label.setPixmap(self.pixmap_white)
+            self.values_shown_combo_label.show()
+            self.values_shown_combo.show()
+        self.set_value_modes(areas is not None)
+        self.matrix_model.set_matrix(counts, unique_values, areas, margins)
+        self.transition_mask_tip_label.setText(f"Estimate from {100 * fraction:.0f} % of the tiles (count ± 95 % confidence interval), refined while counting.")
+
+    def closeEvent(self, event):
+        # The pair-code index of the shown matrix can be as large as the rasters, it is not kept while the dialog is closed
+        self.renderer.release_index()
+        self.table_view.clearSelection()
+        super().closeEvent(event)
+
+    def cleanup(self):
+        # Temporary files of the shown matrix, when the plugin is unloaded; harmonized rasters added to the project are kept
+        self.renderer.cleanup(keep_rasters=self.harmonized_rasters_added)
+
+    def show_task_error(self, title, text):
+        if title == "Raster Layer Error":
+            QMessageBox.warning(self, title, text)
+        else:
+            QMessageBox.critical(self, title, text)
+
+    def show_transition_matrix(self, result_renderer, raster1_layer, raster2_layer, harmonized):
+        # The index and harmonized rasters of the previous run are removed, the rasters not if they were added to the project
+        self.renderer.cleanup(keep_rasters=self.harmonized_rasters_added)
+        self.harmonized_rasters_added = False
+        self.estimating = False
+        self.table_view.clearSelection()
+        self.renderer = result_renderer
+        self.raster1_layer = raster1_layer
+        self.raster2_layer = raster2_layer
+        self.matrix_model.set_mode("Cell count")
+        with self.renderer.profile.stage("table"):
+            self.matrix_model.set_matrix(self.renderer.transition_counts, self.renderer.unique_values, self.renderer.transition_areas)
+        self.log_profile()
 
-        for i in range(self.n_classes):
-            for j in range(self.n_classes):
-                item = QTableWidgetItem(str(self.matrix[i, j]))
-                item.setTextAlignment(Qt.AlignCenter)
-                self.table_widget.setItem(i, j, item)
-        
         self.pixmap_label.setPixmap(self.pixmap_white)
-        self.transition_mask_tip_label.setText("Click on a cell to generate a transition mask.")
-        self.transition_mask = np.array([])
+        self.transition_mask_tip_label.setText(SELECTION_TIP)
+        self.selected_cells = []
 
         self.values_shown_combo_label.show()
         self.values_shown_combo.show()
+        self.set_value_modes(self.renderer.transition_areas is not None)
         self.values_shown_combo.setCurrentText("Cell count")
 
-        if isinstance(fixed_layers, list):
+        if harmonized:
             self.harmonized_rasters_button.show()
         else:
             self.harmonized_rasters_button.hide()
     
+    def log_profile(self):
+        summary = self.renderer.profile.summary()
+        if self.task is not None and self.task.profile_path:
+            summary += f"\ncProfile dump: {self.task.profile_path}"
+        QgsMessageLog.logMessage(summary, PROFILE_LOG_TAG, Qgis.Info)
+        self.profile_label.setText(summary)
+        self.profile_label.show()
+
     def save_matrix(self):
-        if self.transition_counts.size == 0:
+        if self.renderer.transition_counts.size == 0:
             QMessageBox.warning(self, "Error", "Transition matrix is empty.")
             return
         filename, _ = QFileDialog.getSaveFileName(
@@ -211,16 +421,33 @@ class message(QDialog):
             filename += ".csv"
         try:
             if self.values_shown_combo.currentText() == "Cell count":
-                np.savetxt(filename, self.transition_counts, delimiter=";", fmt='%d')
+                self.renderer.save_matrix(filename)
+            elif self.values_shown_combo.currentText() in AREA_UNITS:
+                self.renderer.save_matrix(filename, self.values_shown_combo.currentText())
+            elif isinstance(self.renderer.transition_counts, sparse_matrix):
+                # Too many classes for a K x K table, the nonzero cells are saved in long format
+                rows, columns, values = self.matrix_model.shown_entries()
+                unique_values = self.renderer.unique_values
+                np.savetxt(filename, np.column_stack([unique_values[rows], unique_values[columns], values]), delimiter=";", fmt='%s', header="from;to;value", comments="")
             else:
-                np.savetxt(filename, self.show_matrix, delimiter=";", fmt='%.2f')
+                np.savetxt(filename, self.matrix_model.shown_matrix(), delimiter=";", fmt='%.2f')
             QMessageBox.information(self, "Saved", f"Transition matrix saved to:\n{filename}")     
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to save file:\n{str(e)}")
 
-    def on_cell_clicked(self, row, column):
-        self.transition_mask = renderer.get_selection(self, row, column)
-        grayscale = np.where(self.transition_mask, 0, 255).astype(np.uint8)
+    def on_selection_changed(self):
+        # Cells, whole rows (all transitions from a class) or whole columns (all transitions into a class) make up one mask.
+        # Only the decimated preview is computed here, the full resolution mask is computed when it is saved
+        if self.estimating:
+            self.selected_cells = []
+            return
+        self.selected_cells = sorted({(index.row(), index.column()) for index in self.table_view.selectionModel().selectedIndexes()})
+        if not self.selected_cells or self.renderer.pair_index is None:
+            self.pixmap_label.setPixmap(self.pixmap_white)
+            self.transition_mask_tip_label.setText(SELECTION_TIP)
+            return
+        preview = self.renderer.get_preview(self.selected_cells)
+        grayscale = np.where(preview, 0, 255).astype(np.uint8)
         height, width = grayscale.shape
         bytes_per_line = width
         qimg = QImage(grayscale.data, width, height, bytes_per_line, QImage.Format_Grayscale8).copy()
@@ -230,7 +457,7 @@ class message(QDialog):
         self.transition_mask_tip_label.setText("")
 
     def save_transition_mask_as_tif(self):
-        if self.transition_mask.size == 0:
+        if not self.selected_cells:
             QMessageBox.warning(self, "Error", "The transition mask is empty. Please select a cell from the transition matrix.")
             return
         
@@ -247,21 +474,43 @@ class message(QDialog):
             filename += ".tif"
 
         try:
-            bufor = self.transition_mask.tobytes()
-            self.block.setData(bufor)
-            provider_save = QgsRasterFileWriter(filename).createOneBandRaster(Qgis.DataType.Byte,self.width,self.height,self.extent,self.raster1_layer_crs)
-            provider_save.setEditable(True)
-            provider_save.writeBlock(self.block, 1)
-            provider_save.setEditable(False)
+            self.renderer.save_transition_mask(filename, self.selected_cells)
             QMessageBox.information(self, "Saved", f"Transition mask saved to:\n{filename}")
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to save file:\n{str(e)}")
 
+    def export_transitions(self):
+        # With several selected cells one mask band per cell is saved, otherwise one raster of transition codes
+        if self.renderer.pair_index is None:
+            QMessageBox.warning(self, "Error", "Please generate a transition matrix first.")
+            return
+
+        cells = self.selected_cells
+        if len(cells) < 2:
+            cells = None
+
+        filename, _ = QFileDialog.getSaveFileName(
+            parent=self,
+            caption="Export Transitions" if cells is None else "Export Transition Masks",
+            filter="TIFF files (*.tif *.tiff)",
+        )
+        if not filename:
+            return
+        if not filename.lower().endswith(('.tif', '.tiff')):
+            filename += ".tif"
+
+        result = self.renderer.export_transitions(filename, cells)
+        if result is not None:
+            QMessageBox.critical(self, "Error", f"Failed to save file:\n{result}")
+            return
+        QMessageBox.information(self, "Saved", f"Transitions saved to:\n{filename}")
+
     def add_rasters(self):
         self.raster1_layer.setName("Raster 1")
         self.raster2_layer.setName("Raster 2")
         QgsProject.instance().addMapLayer(self.raster1_layer)
         QgsProject.instance().addMapLayer(self.raster2_layer)
+        self.harmonized_rasters_added = True
 
     def setup_raster1_band_combo(self):
         raster1_layer = self.raster1_combo.currentLayer()
@@ -281,21 +530,18 @@ class message(QDialog):
         self.raster2_band_combo.clear()
         self.raster2_band_combo.addItems([str(i) for i in range(1, raster2_band_number + 1)])
 
-    def change_shown_values(self):
-        if self.values_shown_combo.currentText() == "Overall percentage":
-            self.show_matrix = (self.matrix / self.matrix.sum()) * 100
-            self.show_matrix = np.round(self.show_matrix, 2)
-        elif self.values_shown_combo.currentText() == "Row percentage":
-            self.show_matrix = (self.matrix / self.matrix.sum(axis=1, keepdims=True)) * 100
-            self.show_matrix = np.round(self.show_matrix, 2)
-        elif self.values_shown_combo.currentText() == "Column percentage":
-            self.show_matrix = (self.matrix / self.matrix.sum(axis=0, keepdims=True)) * 100
-            self.show_matrix = np.round(self.show_matrix, 2)
-        else:
-            self.show_matrix = self.matrix
+    def set_value_modes(self, with_areas):
+        # The area units are only offered when the areas were measured
+        modes = ["Cell count", "Overall percentage", "Row percentage", "Column percentage"] + (list(AREA_UNITS) if with_areas else [])
+        if [self.values_shown_combo.itemText(i) for i in range(self.values_shown_combo.count())] == modes:
+            return
+        current = self.values_shown_combo.currentText()
+        self.values_shown_combo.blockSignals(True)
+        self.values_shown_combo.clear()
+        self.values_shown_combo.addItems(modes)
+        self.values_shown_combo.setCurrentText(current if current in modes else "Cell count")
+        self.values_shown_combo.blockSignals(False)
+        self.change_shown_values()
 
-        for i in range(self.n_classes):
-            for j in range(self.n_classes):
-                item = QTableWidgetItem(str(self.show_matrix[i, j]))
-                item.setTextAlignment(Qt.AlignCenter)
-                self.table_widget.setItem(i, j, item)
\ No newline at end of file
+    def change_shown_values(self):
+        self.matrix_model.set_mode(self.values_shown_combo.currentText())
@@ -1,23 +1,184 @@
 from qgis.core import *
-from qgis.gui import *
-from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
-from qgis.utils import iface
 import numpy as np
-from osgeo import gdal
+from osgeo import gdal, ogr
 import tempfile
 import os
-gdal_to_numpy = {
-    1: np.uint8,     # Byte
-    2: np.uint16,    # UInt16
-    3: np.int16,     # Int16
-    4: np.uint32,    # UInt32
-    5: np.int32,     # Int32
-    6: np.float32,   # Float32
-    7: np.float64,   # Float64
-    10: np.complex64,   # CFloat32
-    11: np.complex128,  # CFloat64
-}
+import shutil
+import threading
+import time
+from .counting import TILE_PIXELS, class_presence, combine_masks, count_pairs, count_series, count_transitions, count_zones, zonal_counter, encode_pairs, map_tiles, matrix_entries, pair_index, reclassify, sample_order, scale_matrix, series_pairs, sparse_matrix, tile_sample, transition_counter, tile_size, tile_windows
+from collections import OrderedDict
+from .profiling import run_profile
+from .units import AREA_UNITS
+from .cache import layer_fingerprint
+from .rasters import band_reader, gdal_to_numpy, read_valid, snap_bounds, warp_options
+
+# Memory used by the bit-packed mask previews of recently clicked cells
+MASK_CACHE_BYTES = 16 * 1024 * 1024
+
+# Seconds between two estimates of the matrix while it is counted in quick estimate mode
+ESTIMATE_SECONDS = 0.5
+
+def native_block_size(layer:QgsRasterLayer, band):
+    # GDAL knows the block layout of the file, other providers are read in strips of 256 rows
+    if layer.providerType() == "gdal":
+        dataset = gdal.Open(layer.source())
+        if dataset is not None:
+            return dataset.GetRasterBand(band).GetBlockSize()
+    return layer.width(), min(256, layer.height())
+
+def window_extent(extent:QgsRectangle, width, height, window):
+    # Map extent of a pixel window (x offset, y offset, width, height) of a raster
+    x, y, window_width, window_height = window
+    x_res = extent.width() / width
+    y_res = extent.height() / height
+    return QgsRectangle(
+        extent.xMinimum() + x * x_res,
+        extent.yMaximum() - (y + window_height) * y_res,
+        extent.xMinimum() + (x + window_width) * x_res,
+        extent.yMaximum() - y * y_res,
+    )
+
+def area_window(extent:QgsRectangle, width, height, area:QgsRectangle):
+    # Smallest pixel window covering the area, or None if the area lies outside of the raster
+    x_res = extent.width() / width
+    y_res = extent.height() / height
+    x0 = max(0, int(np.floor((area.xMinimum() - extent.xMinimum()) / x_res)))
+    x1 = min(width, int(np.ceil((area.xMaximum() - extent.xMinimum()) / x_res)))
+    y0 = max(0, int(np.floor((extent.yMaximum() - area.yMaximum()) / y_res)))
+    y1 = min(height, int(np.ceil((extent.yMaximum() - area.yMinimum()) / y_res)))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+def rasterize_geometry(geometry:QgsGeometry, extent:QgsRectangle, width, height):
+    # Boolean mask of the pixels whose centre lies inside the geometry
+    dataset = gdal.GetDriverByName("MEM").Create("", width, height, 1, gdal.GDT_Byte)
+    dataset.SetGeoTransform((extent.xMinimum(), extent.width() / width, 0, extent.yMaximum(), 0, -extent.height() / height))
+    source = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = source.CreateLayer("area")
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geometry.asWkb())))
+    layer.CreateFeature(feature)
+    gdal.RasterizeLayer(dataset, [1], layer, burn_values=[1])
+    return dataset.GetRasterBand(1).ReadAsArray().astype(bool)
+
+def row_areas(extent:QgsRectangle, width, height, crs:QgsCoordinateReferenceSystem):
+    # Ellipsoidal area in square metres of a pixel in every row, measured once per row on the pixel in the middle column.
+    # In geographic coordinates the pixel area only changes with the latitude; without an ellipsoid the planar area is used
+    distance_area = QgsDistanceArea()
+    distance_area.setSourceCrs(crs, QgsProject.instance().transformContext())
+    distance_area.setEllipsoid(crs.ellipsoidAcronym() or "WGS84")
+
+    x_res = extent.width() / width
+    y_res = extent.height() / height
+    x_min = extent.xMinimum() + (width // 2) * x_res
+    areas = np.empty(height)
+    for row in range(height):
+        y_max = extent.yMaximum() - row * y_res
+        pixel = QgsGeometry.fromRect(QgsRectangle(x_min, y_max - y_res, x_min + x_res, y_max))
+        areas[row] = distance_area.convertAreaMeasurement(distance_area.measureArea(pixel), QgsUnitTypes.AreaSquareMeters)
+    return areas
+
+def read_tile(provider:QgsRasterDataProvider, band, extent:QgsRectangle, width, height, window, numpy_dtype):
+    # Convert the pixel window to map coordinates so that the provider returns native pixels
+    _, _, tile_width, tile_height = window
+    block = provider.block(band, window_extent(extent, width, height, window), tile_width, tile_height)
+    tile = np.frombuffer(block.data(), dtype=numpy_dtype)
+    tile.shape = (tile_height, tile_width)
+    return tile
+
+class tile_reader(band_reader):
+    # band_reader of a layer. GDAL layers are read through their dataset, other providers (and sources GDAL cannot open by
+    # themselves, with layer options or when GDAL raises) through provider.block. Not thread-safe, one reader per thread
+    def __init__(self, layer:QgsRasterLayer, band, layer_nodata=True):
+        self.extent = layer.extent()
+        self.width = layer.width()
+        self.height = layer.height()
+
+        # With layer_nodata the no-data value and the user no-data ranges of the layer mark pixels without data
+        provider = layer.dataProvider()
+        null_value = None
+        null_ranges = []
+        if layer_nodata:
+            if provider.sourceHasNoDataValue(band) and provider.useSourceNoDataValue(band):
+                null_value = provider.sourceNoDataValue(band)
+            null_ranges = [(null_range.min(), null_range.max()) for null_range in provider.userNoDataValues(band)]
+
+        dataset = None
+        if layer.providerType() == "gdal":
+            try:
+                dataset = gdal.Open(layer.source())
+            except RuntimeError:
+                dataset = None
+        if dataset is not None and (dataset.RasterXSize, dataset.RasterYSize) != (self.width, self.height):
+            dataset = None
+        super().__init__(dataset, band, null_value, null_ranges, layer_nodata)
+
+        self.provider = None
+        if dataset is None:
+            self.numpy_dtype = gdal_to_numpy.get(provider.dataType(band), np.float32)
+            self.provider = provider.clone()
+
+    def read(self, window):
+        if self.provider is not None:
+            return read_tile(self.provider, self.band, self.extent, self.width, self.height, window, self.numpy_dtype)
+        return super().read(window)
+
+class stack_reader:
+    # Reads several bands of one layer per tile with one interleaved GDAL read per datatype, so the blocks of a band stack are
+    # decoded once for all its bands. Memory-mapped GeoTIFFs and other providers are read band by band. Not thread-safe, one reader per thread
+    def __init__(self, layer:QgsRasterLayer, bands, layer_nodata=True):
+        self.readers = {band: tile_reader(layer, band, layer_nodata) for band in dict.fromkeys(bands)}
+        first = next(iter(self.readers.values()))
+        self.dataset = first.dataset if all(reader.raster_band is not None and reader.memmap is None for reader in self.readers.values()) else None
+        groups = {}
+        for band, reader in self.readers.items():
+            groups.setdefault(np.dtype(reader.numpy_dtype), []).append(band)
+        self.groups = list(groups.items())
+        self.buffers = {}
+
+    def read(self, window):
+        # {band: tile}, valid until the next read
+        if self.dataset is None:
+            return {band: reader.read(window) for band, reader in self.readers.items()}
+        x, y, w, h = window
+        tiles = {}
+        for number, (numpy_dtype, group) in enumerate(self.groups):
+            if (number, h, w) not in self.buffers:
+                self.buffers[(number, h, w)] = np.empty((len(group), h, w) if len(group) > 1 else (h, w), dtype=numpy_dtype)
+            stack = self.dataset.ReadAsArray(x, y, w, h, buf_obj=self.buffers[(number, h, w)], band_list=group)
+            tiles.update(zip(group, stack if len(group) > 1 else [stack]))
+        return tiles
+
+    def valid(self, window, tiles):
+        return {band: reader.valid(window, tiles[band]) for band, reader in self.readers.items()}
+
+def gdal_callback(feedback:QgsFeedback, start=0, end=100):
+    # Report GDAL progress within [start, end] and stop the operation when the run is canceled
+    def callback(complete, message, data):
+        if feedback is None:
+            return 1
+        feedback.setProgress(start + complete * (end - start))
+        return 0 if feedback.isCanceled() else 1
+    return callback
+
+def step_feedback(n_steps, feedback:QgsFeedback):
+    # QgsProcessingMultiStepFeedback only wraps a QgsProcessingFeedback; a plain QgsFeedback (of a QgsTask or a caller of its own) is bridged
+    # through one that forwards the progress and takes over cancellation. The bridge is kept on the wrapper so it is not collected
+    if feedback is None:
+        return None
+    if isinstance(feedback, QgsProcessingFeedback):
+        return QgsProcessingMultiStepFeedback(n_steps, feedback)
+    bridge = QgsProcessingFeedback()
+    bridge.progressChanged.connect(feedback.setProgress)
+    feedback.canceled.connect(bridge.cancel)
+    if feedback.isCanceled():
+        bridge.cancel()
+    steps = QgsProcessingMultiStepFeedback(n_steps, bridge)
+    steps.bridge = bridge
+    return steps
 
 class renderer:
     def __init__(self):
@@ -27,57 +188,254 @@ class renderer:
         self.n_classes = 1
         self.unique_values = None
         self.value_to_index = None
+        self.transition_counts = np.array([])
+        self.transition_areas = None
+        self.pair_index = None
+        self.mask_cache = OrderedDict()
+        self.mask_cache_bytes = 0
+        self.transition_cube = np.array([])
+        self.temporary_directory = None
+        self.index_directory = None
+        self.pairs = []
+        self.band_pairs = []
+        self.band_matrices = []
+        self.zone_table = None
+        self.zone_names = None
+        self.pixel_area = 0
+        self.profile = run_profile()
 
-    def calculate_transmat(self,raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, null_value):
-        # rasters must have the same crs, extent, and resolutions, both must have the same datatype
-        raster1_provider = raster1_layer.dataProvider()
-        raster2_provider = raster2_layer.dataProvider()
+    def generate(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, raster1_band, raster2_band, null_value, compatibility_fix=True, default_raster="Raster 1", workers=1, keep_index=True, feedback:QgsFeedback=None, cache=None, area:QgsGeometry=None, area_crs:QgsCoordinateReferenceSystem=None, reclass_table=None, pixel_areas=False, layer_nodata=True, estimate=None):
+        # Check, harmonize if needed and count; returns the counted layers and whether they were harmonized, or an error message.
+        # With an area (rectangle or polygons in area_crs) only the pixels inside it are counted,
+        # with a reclassification table (rows of minimum, maximum, class) the classes of the table are counted instead of the raster values,
+        # with pixel_areas the ellipsoidal area of the transitions is summed next to the counts.
+        # Besides null_value and NaN, pixels are skipped where a layer has its own no-data value or a mask band says so, unless layer_nodata is off.
+        # With an estimate callback the tiles are counted in a random order and estimates of the matrix are passed to it while counting.
+        # The time and memory of every stage are recorded in self.profile
+        self.profile = run_profile()
+        steps = step_feedback(2, feedback)
 
+        # Unchanged inputs with the same settings are loaded from the cache. Inputs without file stamps (see cache.file_stamps)
+        # are always counted, their tiles are only reused when the checksums of the pixels read again match
+        if cache is not None:
+            area_key = None if area is None else [area.asWkt(), area_crs.authid() if area_crs is not None else None]
+            table_key = None if reclass_table is None else [float(v) for v in np.ravel(reclass_table)]
+            options = [null_value, compatibility_fix, default_raster, keep_index, area_key, table_key, pixel_areas, layer_nodata]
+            key = cache.key([raster1_layer, raster2_layer], [raster1_band, raster2_band], *options)
+            cached = None
+            if key is not None:
+                with self.profile.stage("cache lookup"):
+                    cached = cache.load(key, self)
+            if cached is not None:
+                if cached:
+                    raster1_layer, raster2_layer = [QgsRasterLayer(path, name) for path, name in cached]
+                return [raster1_layer, raster2_layer, bool(cached)]
+
+            # On a miss the tiles of the last run with the same layout and settings are checked and only the changed ones counted
+            tiles = cache.tiles([raster1_layer, raster2_layer], [raster1_band, raster2_band], *options)
+        else:
+            tiles = None
+
+        prepared = self.prepare_layers(raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, compatibility_fix, default_raster, steps, layer_nodata)
+        if isinstance(prepared, str):
+            return prepared
+        raster1_layer, raster2_layer, harmonized = prepared
+
+        if steps is not None:
+            steps.setCurrentStep(1)
+
+        with self.profile.stage("count"):
+            matrix = self.calculate_transmat(raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, keep_index, workers, steps, area, area_crs, reclass_table, pixel_areas, layer_nodata, tiles, estimate)
+        if isinstance(matrix, str):
+            return matrix
+        if matrix is None:
+            return "Generating the transition matrix was canceled."
+
+        if cache is not None and key is not None:
+            with self.profile.stage("cache store"):
+                cache.store(key, self, [raster1_layer, raster2_layer] if harmonized else None)
+
+        return [raster1_layer, raster2_layer, harmonized]
+
+    def prepare_layers(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, raster1_band, raster2_band, null_value, compatibility_fix=True, default_raster="Raster 1", feedback:QgsFeedback=None, layer_nodata=True):
+        # Check the raster compatibility, if it is not none there is a compatibility problem
+        with self.profile.stage("check"):
+            rast_check = self.check_rasters(raster1_layer, raster2_layer)
+        if rast_check is None:
+            return [raster1_layer, raster2_layer, False]
+        if not compatibility_fix:
+            return rast_check
+
+        # If string is returned the harmonisation was not successful
+        with self.profile.stage("harmonize"):
+            fixed_layers = self.fix_rasters(raster1_layer, raster2_layer, default_raster, raster1_band, raster2_band, null_value, feedback, layer_nodata)
+        if isinstance(fixed_layers, str):
+            return fixed_layers
+        idx = 0 if default_raster == "Raster 1" else 1
+        return [fixed_layers[idx], fixed_layers[1 - idx], True]
+
+    def calculate_transmat(self,raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, raster1_band, raster2_band, null_value, keep_index=True, workers=1, feedback:QgsFeedback=None, area:QgsGeometry=None, area_crs:QgsCoordinateReferenceSystem=None, reclass_table=None, pixel_areas=False, layer_nodata=True, tiles=None, estimate=None):
+        # rasters must have the same crs, extent, and resolutions; every band is read with its own datatype.
+        # With a tile store the tiles whose pixels did not change since its last run are loaded instead of counted.
+        # With estimate the tiles are counted in a stratified random order, and every ESTIMATE_SECONDS
+        # estimate(counts, margins, areas, unique_values, fraction) receives the matrix extrapolated from the tiles counted so far,
+        # the half-widths of its 95 % confidence intervals, the extrapolated areas (or None) and the fraction of tiles counted
         # Prepare common metadata for both layers
-        self.width = raster1_layer.width()
-        self.height = raster1_layer.height()
-        self.extent = raster1_layer.extent()
-        qgis_dtype = raster1_provider.dataType(1)
-        numpy_dtype = gdal_to_numpy.get(qgis_dtype, np.float32)
+        layer_width = raster1_layer.width()
+        layer_height = raster1_layer.height()
+        layer_extent = raster1_layer.extent()
+        self.width = layer_width
+        self.height = layer_height
+        self.extent = layer_extent
+        x_offset = y_offset = 0
+
+        # With an area only the pixel window around it is read, the results describe that window
+        area_geometry = None
+        if area is not None:
+            area_geometry = QgsGeometry(area)
+            if area_crs is not None and area_crs.isValid() and area_crs != raster1_layer.crs():
+                area_geometry.transform(QgsCoordinateTransform(area_crs, raster1_layer.crs(), QgsProject.instance()))
+            window = area_window(layer_extent, layer_width, layer_height, area_geometry.boundingBox())
+            if window is None:
+                return "The selected area does not overlap the rasters."
+            x_offset, y_offset, self.width, self.height = window
+            self.extent = window_extent(layer_extent, layer_width, layer_height, window)
         self.raster1_layer_crs = raster1_layer.crs()
 
-        # Convert raster1_layer to numpy array
-        raster1_band = int(self.raster1_band_combo.currentText())
-        self.block = raster1_provider.block(raster1_band,self.extent,self.width,self.height)
-        self.raster1_numpy = np.frombuffer(self.block.data(), dtype=numpy_dtype)
-        self.raster1_numpy.shape = (self.height,self.width)
-
-        # Convert raster2_layer to numpy array
-        raster2_band = int(self.raster2_band_combo.currentText())
-        self.block = raster2_provider.block(raster2_band,self.extent,self.width,self.height)
-        self.raster2_numpy = np.frombuffer(self.block.data(), dtype=numpy_dtype)
-        self.raster2_numpy.shape = (self.height,self.width)
-
-        # Flatten the arrays
-        raster1_flat = self.raster1_numpy.flatten()
-        raster2_flat = self.raster2_numpy.flatten()
-
-        # Get the number of classes
-        combined = np.concatenate([raster1_flat, raster2_flat])
-        self.unique_values = np.unique(combined)
-        self.unique_values = self.unique_values[self.unique_values != null_value]
+        # Read both layers in aligned tiles built from the native block size of raster1
+        block_width, block_height = native_block_size(raster1_layer, raster1_band)
+        tile_width, tile_height = tile_size(block_width, block_height, self.width, self.height, TILE_PIXELS)
+
+        # Pixel areas are measured once per row and summed per transition in the same pass as the counts
+        areas = row_areas(self.extent, self.width, self.height, self.raster1_layer_crs) if pixel_areas else None
+
+        # The pair codes of every tile are only kept when transition masks are needed afterwards: the index reads them from the
+        # tile store, which writes them anyway, or without one from a file of their own (see index_path)
+        self.pair_index = None
+        if keep_index:
+            self.pair_index = pair_index(self.width, self.height, path=self.index_path("pair_codes.bin") if tiles is None else None)
+        self.mask_cache.clear()
+        self.mask_cache_bytes = 0
+
+        # Tiles are numbered in window order; a stored tile is reused when the checksums of both layers match
+        windows = list(tile_windows(self.width, self.height, tile_width, tile_height))
+        fingerprints = [layer_fingerprint(raster1_layer, raster1_band), layer_fingerprint(raster2_layer, raster2_band)]
+        if tiles is not None:
+            tiles.load(windows, fingerprints)
+            tiles.begin()
+
+        # Datasets and providers are not thread-safe, so every thread (including a background task) reads through its own readers
+        local = threading.local()
+
+        def count_tile(item):
+            number, window = item
+            if not hasattr(local, "readers"):
+                local.readers = (tile_reader(raster1_layer, raster1_band, layer_nodata), tile_reader(raster2_layer, raster2_band, layer_nodata))
+                local.area = QgsGeometry(area_geometry) if area_geometry is not None else None
+
+            # Tiles outside of the area are not read, tiles on its border are masked with the rasterized area
+            x, y, w, h = window
+            source_window = (x + x_offset, y + y_offset, w, h)
+            mask = None
+            if local.area is not None:
+                tile_extent = window_extent(layer_extent, layer_width, layer_height, source_window)
+                if not local.area.intersects(tile_extent):
+                    return window, None, None, None, None, None
+                if not local.area.contains(QgsGeometry.fromRect(tile_extent)):
+                    mask = rasterize_geometry(local.area, tile_extent, w, h)
+
+            # Reads are timed on their own, summed over the threads; the tile store only reads the layers it needs for the checksums
+            start = time.perf_counter()
+            checksums, layer_tiles = [None, None], [None, None]
+            if tiles is not None:
+                stored, checksums, layer_tiles = tiles.reuse(number, lambda i: read_valid(local.readers[i], source_window))
+                if stored is not None:
+                    self.profile.add("read", time.perf_counter() - start, sum(tile.nbytes for tile, _ in filter(None, layer_tiles)))
+                    self.profile.add("reuse", tiles=1)
+                    return (window, *stored, checksums)
+            for i, reader in enumerate(local.readers):
+                if layer_tiles[i] is None:
+                    layer_tiles[i] = read_valid(reader, source_window)
+            (raster1_tile, raster1_valid), (raster2_tile, raster2_valid) = layer_tiles
+            tile_bytes = raster1_tile.nbytes + raster2_tile.nbytes
+            self.profile.add("read", time.perf_counter() - start, tile_bytes)
+            self.profile.hold(tile_bytes)
+
+            # The no-data of the layers and the area are combined into one mask of the pixels to count
+            mask = combine_masks(mask, raster1_valid, raster2_valid)
+
+            if reclass_table is not None:
+                raster1_tile = reclassify(raster1_tile, reclass_table, null_value)
+                raster2_tile = reclassify(raster2_tile, reclass_table, null_value)
+            tile_areas = None
+            if keep_index or areas is not None:
+                pair_codes, unique_values = encode_pairs(raster1_tile, raster2_tile, null_value, mask)
+                counts = count_pairs(pair_codes, unique_values.size)
+                if areas is not None:
+                    tile_areas = count_pairs(pair_codes, unique_values.size, areas[y:y + h, None])
+            else:
+                counts, unique_values = count_transitions(raster1_tile, raster2_tile, null_value, mask)
+                pair_codes = None
+
+            if tiles is not None:
+                tiles.store_tile(number, counts, unique_values, pair_codes if keep_index else None, tile_areas)
+            self.profile.add("count", tiles=1)
+
+            self.profile.release(tile_bytes)
+            return window, counts, unique_values, pair_codes if keep_index else None, tile_areas, checksums
+
+        # Add the counts of every tile into one running matrix, in tile order (or the sample order of an estimate) so the result matches serial runs
+        counter = transition_counter(null_value)
+        area_counter = transition_counter(null_value)
+        tile_checksums = [None] * len(windows)
+        items = list(enumerate(windows))
+        sample = None
+        if estimate is not None:
+            items = [items[number] for number in sample_order(len(items))]
+            sample = tile_sample(null_value, len(items))
+            last_estimate = time.perf_counter()
+        for tile_number, ((number, _), (window, counts, unique_values, pair_codes, tile_areas, checksums)) in enumerate(zip(items, map_tiles(count_tile, items, workers))):
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return None
+                feedback.setProgress(100 * (tile_number + 1) / len(windows))
+
+            tile_checksums[number] = checksums
+            if counts is not None:
+                counter.add_counts(counts, unique_values)
+                if tile_areas is not None:
+                    area_counter.add_counts(tile_areas, unique_values)
+                if keep_index:
+                    self.pair_index.add(window, pair_codes, unique_values, *class_presence(counts), stored=tiles.codes_path(number) if tiles is not None else None)
+
+            # The sample takes the tile only after the running sums, so the estimate divides the sums of n tiles by n
+            if sample is not None:
+                sample.add(counts, unique_values)
+                if counts is not None and tile_number + 1 < len(items) and time.perf_counter() - last_estimate >= ESTIMATE_SECONDS:
+                    self.send_estimate(estimate, sample, counter, area_counter if pixel_areas else None)
+                    last_estimate = time.perf_counter()
+
+        if tiles is not None:
+            tiles.finish(windows, fingerprints, tile_checksums)
+
+        self.transition_counts, self.unique_values = counter.result()
+        self.transition_areas = area_counter.result()[0] if pixel_areas else None
         self.n_classes = self.unique_values.size
 
         # Map raster values to indices
         self.value_to_index = {val: idx for idx, val in enumerate(self.unique_values)}
 
-        # Create a 2D histogram to count the transitions
-        self.transition_counts = np.zeros((self.n_classes, self.n_classes), dtype=int)
-
-        # Count transitions
-        for old_val, new_val in zip(raster1_flat, raster2_flat):
-            if old_val != null_value and new_val != null_value:
-                i = self.value_to_index[old_val]
-                j = self.value_to_index[new_val]
-                self.transition_counts[i, j] += 1
-
         return self.transition_counts
     
+    def send_estimate(self, estimate, sample, counter, area_counter=None):
+        # Matrix of the tiles counted so far extrapolated to all tiles; the running counts are copied, not handed over
+        sums, unique_values = counter.result()
+        if unique_values.size == 0:
+            return
+        counts, margins = sample.estimate(sums, unique_values)
+        areas = scale_matrix(area_counter.result()[0], sample.n_tiles / sample.n_counted) if area_counter is not None else None
+        estimate(counts, margins, areas, unique_values.copy(), sample.n_counted / sample.n_tiles)
+
     def check_rasters(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer):
         rast_warning = None
 
@@ -119,143 +477,577 @@ class renderer:
 
         return rast_warning
 
-    def fix_rasters(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, default_raster:str):
-        # Check if the rasters are empty
-        if raster1_layer.dataProvider().xSize() == 0 or raster1_layer.dataProvider().ySize() == 0:
-            return f"{raster1_layer.name()} is empty."
-        
-        if raster2_layer.dataProvider().xSize() == 0 or raster2_layer.dataProvider().ySize() == 0:
-            return f"{raster2_layer.name()} is empty."
-
-        # Check which raster to default to
-        if default_raster == "Raster 1":
-            default_raster = raster1_layer
-            auxiliary_raster = raster2_layer
-            default_raster_band = int(self.raster1_band_combo.currentText())
-            auxiliary_raster_band = int(self.raster2_band_combo.currentText())
-        else:
-            default_raster = raster2_layer
-            auxiliary_raster = raster1_layer
-            default_raster_band = int(self.raster2_band_combo.currentText())
-            auxiliary_raster_band = int(self.raster1_band_combo.currentText())
-
-        # Assign crs to raster1 if needed
-        if not default_raster.crs().isValid():
-            default_raster.setCrs(QgsCoordinateReferenceSystem("EPSG:4326"))
-
-        # Assign crs to raster1 if needed
-        if not auxiliary_raster.crs().isValid():
-            auxiliary_raster.setCrs(QgsCoordinateReferenceSystem("EPSG:4326")) 
-        
-        # Get the source of the auxiliary raster
-        src_path1 = auxiliary_raster.source()
-
-        # Create a temporary file on disk and get a file descriptor (fd) and its path (dst_path) and close it immediately (since we only need the file path)
-        fd1, dst_path1 = tempfile.mkstemp(suffix=".tif")
-        os.close(fd1)
-
-        # Run GDAL Warp to change auxiliary_raster CRS, resolution and output datatype to the ones of the default raster. Change the default nodata value to the one defined by the user
-        gdal.Warp(
-            dst_path1,
-            src_path1,
-            srcSRS = auxiliary_raster.crs().authid(),
-            dstSRS = default_raster.crs().authid(),
-            srcNodata = auxiliary_raster.dataProvider().sourceNoDataValue(auxiliary_raster_band),
-            dstNodata = self.na_spin.value(),
-            xRes = default_raster.rasterUnitsPerPixelX(),
-            yRes = default_raster.rasterUnitsPerPixelY(),
-            outputType = default_raster.dataProvider().dataType(default_raster_band)
-        )
+    def fix_rasters(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, default_raster:str, raster1_band, raster2_band, null_value, feedback:QgsFeedback=None, layer_nodata=True):
+        # Reproject the auxiliary raster onto the default raster and clip both to their intersection, one warped VRT per raster
+        reference_index = 0 if default_raster == "Raster 1" else 1
+        harmonized = self.harmonize_series([raster1_layer, raster2_layer], [raster1_band, raster2_band], reference_index, null_value, feedback, layer_nodata=layer_nodata)
+        if isinstance(harmonized, str):
+            return harmonized
 
-        # Load the warped raster as a new QgsRasterLayer
-        warped = QgsRasterLayer(dst_path1, f"{auxiliary_raster.name()}_warped")
+        # Default raster first, auxiliary raster second
+        return [harmonized[reference_index], harmonized[1 - reference_index]]
+    
+    def generate_cube(self, layers, bands, null_value, compatibility_fix=True, reference_index=0, all_pairs=False, workers=1, feedback:QgsFeedback=None):
+        # Multi-date version of generate: harmonize all dates once against the reference, then count every date pair in one pass
+        self.profile = run_profile()
+        steps = step_feedback(2, feedback)
 
-        # Check validity
-        if not warped.isValid():
-            return "Could not harmonize the rasters."
-        
-        # Assign the new warped raster as the new auxiliary_raster
-        auxiliary_raster = warped
-
-        # you have to check the extent after warping to the same crs and then clip BOTH rasters to the extent
-        # If the rasters have different extent find the intersection
-        if default_raster.extent() != auxiliary_raster.extent():
-            extent1 = default_raster.extent()
-            extent2 = auxiliary_raster.extent()
-            intersection = extent1.intersect(extent2)
-            
-            if intersection.isEmpty():
-                return "Rasters do not overlap"
-        else:
-            intersection = default_raster.extent()
-
-        # Clip the auxiliary raster to the intersection
-        src_path2 = auxiliary_raster.source()
-        fd2, dst_path2 = tempfile.mkstemp(suffix=".tif")
-        os.close(fd2)
-
-        gdal.Warp(
-            dst_path2,
-            src_path2,
-            outputBounds = (
-                intersection.xMinimum(),
-                intersection.yMinimum(),
-                intersection.xMaximum(),
-                intersection.yMaximum(),
-            ),
-            outputBoundsSRS=default_raster.crs().authid(),
-            xRes=default_raster.rasterUnitsPerPixelX(),
-            yRes=default_raster.rasterUnitsPerPixelY(),
-            dstNodata=self.na_spin.value(),
-            outputType=default_raster.dataProvider().dataType(default_raster_band)
-        )
+        rast_check = None
+        for layer in layers:
+            rast_check = rast_check or self.check_rasters(layers[reference_index], layer)
+        if rast_check is not None:
+            if not compatibility_fix:
+                return rast_check
+            with self.profile.stage("harmonize"):
+                layers = self.harmonize_series(layers, bands, reference_index, null_value, steps)
+            if isinstance(layers, str):
+                return layers
 
-        warped = QgsRasterLayer(dst_path2, f"{auxiliary_raster.name()}_warped")
+        if steps is not None:
+            steps.setCurrentStep(1)
 
-        if not warped.isValid():
-            return f"Could not clip {auxiliary_raster.name()} to the intersection of two rasters."
-        
-        auxiliary_raster = warped
-
-        # Clip the default raster to the intersection and change the default nodata value to the one defined by the user
-        src_path3 = default_raster.source()
-        fd3, dst_path3 = tempfile.mkstemp(suffix=".tif")
-        os.close(fd3)
-
-        gdal.Warp(
-            dst_path3,
-            src_path3,
-            srcNodata = default_raster.dataProvider().sourceNoDataValue(default_raster_band),
-            dstNodata = self.na_spin.value(),
-            outputBounds = (
-                intersection.xMinimum(),
-                intersection.yMinimum(),
-                intersection.xMaximum(),
-                intersection.yMaximum(),
-            ),
-            outputBoundsSRS=default_raster.crs().authid(),
-            xRes=default_raster.rasterUnitsPerPixelX(),
-            yRes=default_raster.rasterUnitsPerPixelY(),
-            outputType=default_raster.dataProvider().dataType(default_raster_band)
+        with self.profile.stage("count"):
+            cube = self.calculate_cube(layers, bands, null_value, all_pairs, workers, steps)
+        if cube is None:
+            return "Generating the transition matrices was canceled."
+        return layers
+
+    def calculate_cube(self, layers, bands, null_value, all_pairs=False, workers=1, feedback:QgsFeedback=None):
+        # layers must have the same crs, extent and resolution; each band is read with its own datatype
+        self.width = layers[0].width()
+        self.height = layers[0].height()
+        self.extent = layers[0].extent()
+        self.raster1_layer_crs = layers[0].crs()
+        self.pairs = series_pairs(len(layers), all_pairs)
+
+        block_width, block_height = native_block_size(layers[0], bands[0])
+        tile_width, tile_height = tile_size(block_width, block_height, self.width, self.height, TILE_PIXELS // len(layers))
+
+        # Every tile of every date is read once and shared by all the pairs it takes part in
+        local = threading.local()
+
+        def count_tile(window):
+            if not hasattr(local, "readers"):
+                local.readers = [tile_reader(layer, band) for layer, band in zip(layers, bands)]
+            tiles = [reader.read(window) for reader in local.readers]
+            masks = [reader.valid(window, tile) for reader, tile in zip(local.readers, tiles)]
+            return count_series(tiles, null_value, self.pairs, masks)
+
+        counter = transition_counter(null_value)
+        windows = list(tile_windows(self.width, self.height, tile_width, tile_height))
+        for tile_number, (counts, unique_values) in enumerate(map_tiles(count_tile, windows, workers)):
+            counter.add_counts(counts, unique_values)
+
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return None
+                feedback.setProgress(100 * (tile_number + 1) / len(windows))
+
+        self.transition_cube, self.unique_values = counter.result()
+        self.n_classes = self.unique_values.size
+        return self.transition_cube
+
+    def generate_bands(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, band_pairs, null_value, compatibility_fix=True, default_raster="Raster 1", workers=1, feedback:QgsFeedback=None, confidence_bands=(None, None), min_confidence=None, layer_nodata=True):
+        # Band-stack version of generate: one matrix per (raster 1 band, raster 2 band) pair, all counted in one pass over the tiles.
+        # confidence_bands names a band of raster 1 and of raster 2 (either may be None) whose value must reach min_confidence for a pixel to be counted.
+        # Returns the counted layers and whether they were harmonized, or an error message
+        self.profile = run_profile()
+        steps = step_feedback(2, feedback)
+
+        bands = [[band for band, _ in band_pairs], [band for _, band in band_pairs]]
+        for number, layer in enumerate([raster1_layer, raster2_layer]):
+            if confidence_bands[number] is not None:
+                bands[number].append(confidence_bands[number])
+            for band in bands[number]:
+                if not 1 <= band <= layer.bandCount():
+                    return f"{layer.name()} has no band {band}."
+
+        with self.profile.stage("check"):
+            rast_check = self.check_rasters(raster1_layer, raster2_layer)
+        harmonized = False
+        if rast_check is not None:
+            if not compatibility_fix:
+                return rast_check
+
+            # Stacks with bands of different datatypes are warped into Float64, so no band is truncated
+            data_types = {layer.dataProvider().dataType(band) for layer, layer_bands in zip([raster1_layer, raster2_layer], bands) for band in layer_bands}
+            with self.profile.stage("harmonize"):
+                layers = self.harmonize_series([raster1_layer, raster2_layer], [bands[0][0], bands[1][0]], 0 if default_raster == "Raster 1" else 1, null_value, steps, gdal.GDT_Float64 if len(data_types) > 1 else None, layer_nodata)
+            if isinstance(layers, str):
+                return layers
+            raster1_layer, raster2_layer = layers
+            harmonized = True
+
+        if steps is not None:
+            steps.setCurrentStep(1)
+
+        with self.profile.stage("count"):
+            matrices = self.calculate_bands(raster1_layer, raster2_layer, band_pairs, null_value, workers, steps, confidence_bands, min_confidence, layer_nodata)
+        if matrices is None:
+            return "Generating the transition matrices was canceled."
+        return [raster1_layer, raster2_layer, harmonized]
+
+    def calculate_bands(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, band_pairs, null_value, workers=1, feedback:QgsFeedback=None, confidence_bands=(None, None), min_confidence=None, layer_nodata=True):
+        # rasters must have the same crs, extent and resolution; sets self.band_pairs and self.band_matrices, one (counts, unique_values) per pair
+        self.width = raster1_layer.width()
+        self.height = raster1_layer.height()
+        self.extent = raster1_layer.extent()
+        self.raster1_layer_crs = raster1_layer.crs()
+        self.band_pairs = list(band_pairs)
+
+        bands = [[band for band, _ in band_pairs], [band for _, band in band_pairs]]
+        for number in range(2):
+            if confidence_bands[number] is not None:
+                bands[number].append(confidence_bands[number])
+
+        block_width, block_height = native_block_size(raster1_layer, bands[0][0])
+        n_bands = len(set(bands[0])) + len(set(bands[1]))
+        tile_width, tile_height = tile_size(block_width, block_height, self.width, self.height, max(1, 2 * TILE_PIXELS // n_bands))
+
+        # Every band of a tile is read once and shared by all the pairs it takes part in
+        local = threading.local()
+
+        def count_tile(window):
+            if not hasattr(local, "readers"):
+                local.readers = (stack_reader(raster1_layer, bands[0], layer_nodata), stack_reader(raster2_layer, bands[1], layer_nodata))
+
+            start = time.perf_counter()
+            tiles1 = local.readers[0].read(window)
+            tiles2 = local.readers[1].read(window)
+            self.profile.add("read", time.perf_counter() - start, sum(tile.nbytes for tile in tiles1.values()) + sum(tile.nbytes for tile in tiles2.values()))
+            valid1 = local.readers[0].valid(window, tiles1)
+            valid2 = local.readers[1].valid(window, tiles2)
+
+            # Pixels below the confidence threshold (or with NaN confidence) are left out of every pair
+            confident = None
+            if min_confidence is not None:
+                confident = combine_masks(*[tiles[band] >= min_confidence for tiles, band in zip([tiles1, tiles2], confidence_bands) if band is not None])
+
+            results = []
+            for band1, band2 in band_pairs:
+                mask = combine_masks(confident, valid1[band1], valid2[band2])
+                results.append(count_transitions(tiles1[band1], tiles2[band2], null_value, mask))
+            self.profile.add("count", tiles=1)
+            return results
+
+        counters = [transition_counter(null_value) for _ in band_pairs]
+        windows = list(tile_windows(self.width, self.height, tile_width, tile_height))
+        for tile_number, results in enumerate(map_tiles(count_tile, windows, workers)):
+            for counter, (counts, unique_values) in zip(counters, results):
+                counter.add_counts(counts, unique_values)
+
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return None
+                feedback.setProgress(100 * (tile_number + 1) / len(windows))
+
+        self.band_matrices = [counter.result() for counter in counters]
+        return self.band_matrices
+
+    def save_bands(self, filename):
+        # Long-format table of the nonzero cells of every band-pair matrix
+        with open(filename, "w") as csv_file:
+            csv_file.write("band1;band2;from;to;count\n")
+            for (band1, band2), (counts, unique_values) in zip(self.band_pairs, self.band_matrices):
+                rows, columns, values = matrix_entries(counts)
+                for from_value, to_value, count in zip(unique_values[rows], unique_values[columns], values):
+                    csv_file.write(f"{band1};{band2};{from_value};{to_value};{count}\n")
+
+    def harmonize_series(self, layers, bands, reference_index, null_value, feedback:QgsFeedback=None, output_type=None, layer_nodata=True):
+        # Warp every layer onto the grid of the reference layer, clipped to the intersection of all layers.
+        # All bands are warped into the datatype of the reference band, or into output_type.
+        # With layer_nodata the no-data value the layer uses becomes null_value and its user no-data ranges are copied to the warped layer,
+        # without it every source value is kept as data; pixels outside of a layer are null_value either way
+        reference = layers[reference_index]
+        reference_band = bands[reference_index]
+        reference_crs = reference.crs() if reference.crs().isValid() else QgsCoordinateReferenceSystem("EPSG:4326")
+        x_res = reference.rasterUnitsPerPixelX()
+        y_res = reference.rasterUnitsPerPixelY()
+
+        intersection = QgsRectangle(reference.extent())
+        for layer in layers:
+            if layer.dataProvider().xSize() == 0 or layer.dataProvider().ySize() == 0:
+                return f"{layer.name()} is empty."
+            crs = layer.crs() if layer.crs().isValid() else QgsCoordinateReferenceSystem("EPSG:4326")
+            extent = layer.extent()
+            if crs != reference_crs:
+                extent = QgsCoordinateTransform(crs, reference_crs, QgsProject.instance()).transformBoundingBox(extent)
+            intersection = intersection.intersect(extent)
+
+        if intersection.isEmpty():
+            return "Rasters do not overlap"
+
+        # Snap the intersection inwards onto the pixel grid of the reference layer
+        reference_extent = reference.extent()
+        bounds = snap_bounds(
+            (reference_extent.xMinimum(), x_res, 0, reference_extent.yMaximum(), 0, -y_res),
+            (intersection.xMinimum(), intersection.yMinimum(), intersection.xMaximum(), intersection.yMaximum())
         )
 
-        warped = QgsRasterLayer(dst_path3, f"{default_raster.name()}_warped")
+        harmonized = []
+        for number, (layer, band) in enumerate(zip(layers, bands)):
+            crs = layer.crs() if layer.crs().isValid() else QgsCoordinateReferenceSystem("EPSG:4326")
+            dst_path = self.temporary_path(f"{layer.name()}_warped.vrt")
 
-        if not warped.isValid():
-            return f"Could not clip {default_raster.name()} to the intersection of two rasters."
-        
-        default_raster = warped
+            provider = layer.dataProvider()
+            use_nodata = layer_nodata and provider.sourceHasNoDataValue(band) and provider.useSourceNoDataValue(band)
+            gdal.Warp(dst_path, layer.source(), **warp_options(
+                crs.authid(),
+                reference_crs.authid(),
+                bounds,
+                x_res,
+                y_res,
+                null_value,
+                output_type or reference.dataProvider().dataType(reference_band),
+                provider.sourceNoDataValue(band) if use_nodata else None,
+                gdal_callback(feedback, 100 * number / len(layers), 100 * (number + 1) / len(layers))
+            ))
 
-        return [default_raster, auxiliary_raster]
-    
-    def get_selection(self, row, column):
-        index_to_value = {idx: val for val, idx in self.value_to_index.items()}
+            if feedback is not None and feedback.isCanceled():
+                return "Harmonization was canceled."
+
+            warped = QgsRasterLayer(dst_path, f"{layer.name()}_warped")
+            if not warped.isValid():
+                return f"Could not harmonize {layer.name()}."
+            # Values are warped with the nearest neighbour, so the ranges still describe the same pixels
+            if layer_nodata and provider.userNoDataValues(band):
+                warped.dataProvider().setUserNoDataValue(band, provider.userNoDataValues(band))
+            harmonized.append(warped)
+
+        return harmonized
+
+    def temporary_path(self, name):
+        # Intermediate files of this renderer live in one temporary directory that cleanup() removes
+        if self.temporary_directory is None:
+            self.temporary_directory = tempfile.mkdtemp(prefix="transmat_")
+        return os.path.join(self.temporary_directory, f"{len(os.listdir(self.temporary_directory))}_{os.path.basename(name)}")
+
+    def index_path(self, name):
+        # The pair-code index is as large as the rasters and only needed while its matrix is shown, so it lives apart
+        # from the harmonized rasters, which stay when they were added to the project
+        if self.index_directory is None:
+            self.index_directory = tempfile.mkdtemp(prefix="transmat_index_")
+        return os.path.join(self.index_directory, name)
+
+    def release_index(self):
+        # Drop the pair-code index and its file; transition masks are not available afterwards
+        self.pair_index = None
+        self.mask_cache.clear()
+        self.mask_cache_bytes = 0
+        if self.index_directory is not None:
+            shutil.rmtree(self.index_directory, ignore_errors=True)
+            self.index_directory = None
+
+    def cleanup(self, keep_rasters=False):
+        # The index is always removed, the harmonized rasters and other intermediate files unless keep_rasters
+        self.release_index()
+        if self.temporary_directory is not None and not keep_rasters:
+            shutil.rmtree(self.temporary_directory, ignore_errors=True)
+            self.temporary_directory = None
+
+    def save_matrix(self, filename, unit=None):
+        # Counts, or areas in one of AREA_UNITS; a dense matrix is written as a K x K table, a sparse one as a long-format table of its nonzero cells
+        matrix = self.transition_counts if unit is None else self.transition_areas
+        scale = 1 if unit is None else AREA_UNITS[unit]
+        if not isinstance(matrix, sparse_matrix):
+            np.savetxt(filename, matrix / scale if unit is not None else matrix, delimiter=";", fmt='%d' if unit is None else '%.4f')
+            return
+
+        rows, columns, values = matrix_entries(matrix)
+        with open(filename, "w") as csv_file:
+            csv_file.write("from;to;count\n" if unit is None else "from;to;area\n")
+            for i, j, value in zip(rows, columns, values):
+                csv_file.write(f"{self.unique_values[i]};{self.unique_values[j]};{value / scale if unit is not None else value}\n")
+
+    def save_cube(self, filename):
+        # .npy keeps the (pairs, classes, classes) array, anything else is written as a long-format .csv
+        if filename.lower().endswith(".npy"):
+            np.save(filename, self.transition_cube)
+            return
+
+        with open(filename, "w") as csv_file:
+            csv_file.write("from_date;to_date;from_class;to_class;count\n")
+            for (s, t), matrix in zip(self.pairs, self.transition_cube):
+                for i, j in zip(*np.nonzero(matrix)):
+                    csv_file.write(f"{s + 1};{t + 1};{self.unique_values[i]};{self.unique_values[j]};{matrix[i, j]}\n")
+
+    def generate_zones(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, raster1_band, raster2_band, null_value, zone_layer:QgsMapLayer, zone_band=1, zone_field=None, compatibility_fix=True, default_raster="Raster 1", workers=1, feedback:QgsFeedback=None, layer_nodata=True):
+        # One transition matrix per zone of a zone raster or a polygon layer, counted in a single pass over both rasters
+        self.profile = run_profile()
+        steps = step_feedback(3, feedback)
+        if isinstance(zone_layer, QgsRasterLayer) and not 1 <= zone_band <= zone_layer.bandCount():
+            return f"{zone_layer.name()} has no band {zone_band}."
+
+        prepared = self.prepare_layers(raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, compatibility_fix, default_raster, steps, layer_nodata)
+        if isinstance(prepared, str):
+            return prepared
+        raster1_layer, raster2_layer, _ = prepared
+
+        if steps is not None:
+            steps.setCurrentStep(1)
+        with self.profile.stage("zones"):
+            zones = self.zone_grid(zone_layer, zone_band, zone_field, raster1_layer, steps)
+        if isinstance(zones, str):
+            return zones
+        zone_raster, zone_band, zone_null_value = zones
+
+        if steps is not None:
+            steps.setCurrentStep(2)
+        with self.profile.stage("count"):
+            table = self.calculate_zones(raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, zone_raster, zone_band, zone_null_value, workers, steps, layer_nodata)
+        if table is None:
+            return "Generating the zonal transition matrices was canceled."
+        return [raster1_layer, raster2_layer]
 
-        row_value = index_to_value[row]
-        column_value = index_to_value[column]
+    def zone_grid(self, zone_layer:QgsMapLayer, zone_band, zone_field, grid_layer:QgsRasterLayer, feedback:QgsFeedback=None):
+        # Zone raster on the grid of grid_layer, returned with its band and the value of pixels without a zone
+        extent = grid_layer.extent()
+        width = grid_layer.width()
+        height = grid_layer.height()
+        bounds = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+
+        if isinstance(zone_layer, QgsRasterLayer):
+            self.zone_names = None
+            provider = zone_layer.dataProvider()
+            zone_null_value = provider.sourceNoDataValue(zone_band) if provider.sourceHasNoDataValue(zone_band) else np.nan
+            if zone_layer.crs() == grid_layer.crs() and zone_layer.extent() == extent and zone_layer.width() == width and zone_layer.height() == height:
+                return zone_layer, zone_band, zone_null_value
+
+            # Pixels the zone raster does not cover get its no-data value. Without one they get a value no zone can have:
+            # float types keep their type with NaN, small integer types are widened to Int32 and larger ones to Float64 with NaN
+            output_type = provider.dataType(zone_band)
+            if not provider.sourceHasNoDataValue(zone_band):
+                if output_type in (gdal.GDT_Byte, gdal.GDT_UInt16, gdal.GDT_Int16):
+                    output_type, zone_null_value = gdal.GDT_Int32, np.iinfo(np.int32).min
+                elif output_type not in (gdal.GDT_Float32, gdal.GDT_Float64):
+                    output_type = gdal.GDT_Float64
+
+            # Zones are resampled with the nearest neighbour, so zone values are never mixed
+            dst_path = self.temporary_path(f"{zone_layer.name()}_zones.vrt")
+            gdal.Warp(
+                dst_path,
+                zone_layer.source(),
+                format = "VRT",
+                dstSRS = grid_layer.crs().authid(),
+                outputBounds = bounds,
+                width = width,
+                height = height,
+                resampleAlg = "near",
+                dstNodata = zone_null_value,
+                outputType = output_type,
+                callback = gdal_callback(feedback)
+            )
+            warped = QgsRasterLayer(dst_path, f"{zone_layer.name()}_zones")
+            if not warped.isValid():
+                return f"Could not align {zone_layer.name()} with the rasters."
+            return warped, zone_band, zone_null_value
+
+        # Polygons are rasterized once, every pixel gets the 1-based number of its feature and 0 outside of all features
+        transform = QgsCoordinateTransform(zone_layer.crs(), grid_layer.crs(), QgsProject.instance())
+        source = ogr.GetDriverByName("Memory").CreateDataSource("")
+        layer = source.CreateLayer("zones")
+        layer.CreateField(ogr.FieldDefn("zone", ogr.OFTInteger))
+        zone_names = []
+        for feature in zone_layer.getFeatures():
+            if not feature.hasGeometry():
+                continue
+            geometry = QgsGeometry(feature.geometry())
+            geometry.transform(transform)
+            zone_names.append(feature[zone_field] if zone_field else feature.id())
+            ogr_feature = ogr.Feature(layer.GetLayerDefn())
+            ogr_feature.SetField("zone", len(zone_names))
+            ogr_feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(geometry.asWkb())))
+            layer.CreateFeature(ogr_feature)
+        self.zone_names = zone_names
+
+        dst_path = self.temporary_path(f"{zone_layer.name()}_zones.tif")
+        dataset = gdal.GetDriverByName("GTiff").Create(dst_path, width, height, 1, gdal.GDT_Int32, ["TILED=YES", "COMPRESS=DEFLATE"])
+        dataset.SetGeoTransform((extent.xMinimum(), extent.width() / width, 0, extent.yMaximum(), 0, -extent.height() / height))
+        dataset.SetProjection(grid_layer.crs().toWkt())
+        dataset.GetRasterBand(1).SetNoDataValue(0)
+        dataset.GetRasterBand(1).Fill(0)
+        gdal.RasterizeLayer(dataset, [1], layer, options=["ATTRIBUTE=zone"], callback=gdal_callback(feedback))
+        dataset = None
+
+        if feedback is not None and feedback.isCanceled():
+            return "Rasterizing the zones was canceled."
+        rasterized = QgsRasterLayer(dst_path, f"{zone_layer.name()}_zones")
+        if not rasterized.isValid():
+            return f"Could not rasterize {zone_layer.name()}."
+        return rasterized, 1, 0
+
+    def calculate_zones(self, raster1_layer:QgsRasterLayer, raster2_layer:QgsRasterLayer, raster1_band, raster2_band, null_value, zone_layer:QgsRasterLayer, zone_band, zone_null_value, workers=1, feedback:QgsFeedback=None, layer_nodata=True):
+        # The zone raster must be on the grid of raster1; the counts are kept sparse as (zone, from, to, count) entries
+        layers = [raster1_layer, raster2_layer, zone_layer]
+        bands = [raster1_band, raster2_band, zone_band]
+
+        self.width = raster1_layer.width()
+        self.height = raster1_layer.height()
+        self.extent = raster1_layer.extent()
+        self.raster1_layer_crs = raster1_layer.crs()
+        self.pixel_area = raster1_layer.rasterUnitsPerPixelX() * raster1_layer.rasterUnitsPerPixelY()
+
+        block_width, block_height = native_block_size(raster1_layer, raster1_band)
+        tile_width, tile_height = tile_size(block_width, block_height, self.width, self.height, TILE_PIXELS)
+        local = threading.local()
+
+        def count_tile(window):
+            if not hasattr(local, "readers"):
+                local.readers = [tile_reader(layer, band, layer_nodata) for layer, band in zip(layers, bands)]
+            raster1_tile, raster2_tile, zone_tile = [reader.read(window) for reader in local.readers]
+            mask = combine_masks(*[reader.valid(window, tile) for reader, tile in zip(local.readers[:2], [raster1_tile, raster2_tile])])
+            return count_zones(raster1_tile, raster2_tile, zone_tile, null_value, zone_null_value, mask)
+
+        counter = zonal_counter()
+        windows = list(tile_windows(self.width, self.height, tile_width, tile_height))
+        for tile_number, entries in enumerate(map_tiles(count_tile, windows, workers)):
+            counter.add_entries(*entries)
+
+            if feedback is not None:
+                if feedback.isCanceled():
+                    return None
+                feedback.setProgress(100 * (tile_number + 1) / len(windows))
+
+        self.zone_table = counter.result()
+        return self.zone_table
+
+    def save_zones(self, filename):
+        # Long-format table with one row per zone and transition that occurs
+        zones, from_values, to_values, counts = self.zone_table
+        with open(filename, "w") as csv_file:
+            csv_file.write("zone;from;to;count;area\n")
+            for zone, from_value, to_value, count in zip(zones, from_values, to_values, counts):
+                zone_name = self.zone_names[int(zone) - 1] if self.zone_names is not None else zone
+                csv_file.write(f"{zone_name};{from_value};{to_value};{count};{count * self.pixel_area}\n")
+
+    def cell_values(self, cells):
+        # (from, to) class values of (row, column) matrix cells
+        return [(self.unique_values[row], self.unique_values[column]) for row, column in cells]
+
+    def get_preview(self, cells):
+        # Decimated mask of the (row, column) cells for the thumbnail, computed from the preview copy of the pair-code index.
+        # Previews of recent selections are kept bit-packed in a least recently used cache, so clicking them again is instant;
+        # full resolution masks are only written tile by tile when saved (see export_transitions)
+        key = tuple(sorted(cells))
+        if key in self.mask_cache:
+            self.mask_cache.move_to_end(key)
+            height, width = self.pair_index.preview_shape
+            return np.unpackbits(self.mask_cache[key], count=width * height).reshape(height, width).view(bool)
+
+        preview = self.pair_index.preview(self.cell_values(cells))
+        packed = np.packbits(preview)
+        self.mask_cache[key] = packed
+        self.mask_cache_bytes += packed.nbytes
+        while self.mask_cache_bytes > MASK_CACHE_BYTES and len(self.mask_cache) > 1:
+            _, evicted = self.mask_cache.popitem(last=False)
+            self.mask_cache_bytes -= evicted.nbytes
+        return preview
+
+    def class_index(self, value):
+        # Index of a class value in the matrix, or None if the value is not a class
+        index = np.searchsorted(self.unique_values, value)
+        if index == self.unique_values.size or self.unique_values[index] != value:
+            return None
+        return int(index)
+
+    def count_selection(self, cells, area:QgsGeometry=None, area_crs:QgsCoordinateReferenceSystem=None):
+        # Number of pixels of the (row, column) cells inside an area (rectangle or polygons in area_crs), or in the whole matrix without one.
+        # Tiles outside of the area or without the classes of the cells are skipped
+        if area is None:
+            return self.pair_index.count(self.cell_values(cells))
+
+        area_geometry = QgsGeometry(area)
+        if area_crs is not None and area_crs.isValid() and area_crs != self.raster1_layer_crs:
+            area_geometry.transform(QgsCoordinateTransform(area_crs, self.raster1_layer_crs, QgsProject.instance()))
+
+        def region(window):
+            tile_extent = window_extent(self.extent, self.width, self.height, window)
+            if not area_geometry.intersects(tile_extent):
+                return False
+            if area_geometry.contains(QgsGeometry.fromRect(tile_extent)):
+                return None
+            return rasterize_geometry(area_geometry, tile_extent, window[2], window[3])
+
+        return self.pair_index.count(self.cell_values(cells), region)
+
+    def save_transition_mask(self, filename, cells):
+        # One mask of the pixels of any of the (row, column) cells
+        result = self.export_transitions(filename, cells, union=True)
+        if result is not None:
+            raise RuntimeError(result)
+
+    def export_transitions(self, filename, cells=None, compression="DEFLATE", nbits=False, cog=False, feedback:QgsFeedback=None, union=False):
+        # Writes the pair-code index tile by tile into a tiled, compressed GeoTIFF, without a full-size buffer. Without cells one band of
+        # transition codes (row * K + column + 1, 0 where nothing was counted), with cells one 0/1 band per (row, column) cell,
+        # or with union one band of all of them, optionally 1-bit. With cog the file is converted to a Cloud Optimized GeoTIFF.
+        # Returns an error message or None
+        if self.pair_index is None:
+            return "The transition matrix was computed without the pair-code index."
+
+        n_classes = self.unique_values.size
+        no_data_code = n_classes * n_classes
+        if cells is None:
+            if no_data_code > np.iinfo(np.uint32).max:
+                return "There are too many classes for a transition code raster, export masks of single transitions instead."
+            n_bands = 1
+            data_type, numpy_dtype = next((gdal_type, dtype) for gdal_type, dtype in ((gdal.GDT_Byte, np.uint8), (gdal.GDT_UInt16, np.uint16), (gdal.GDT_UInt32, np.uint32)) if no_data_code <= np.iinfo(dtype).max)
+        else:
+            bands = [cells] if union else [[cell] for cell in cells]
+            n_bands = len(bands)
+            data_type, numpy_dtype = gdal.GDT_Byte, np.uint8
+
+        # GDAL builds without ZSTD support fall back to DEFLATE
+        driver = gdal.GetDriverByName("GTiff")
+        if compression not in driver.GetMetadataItem("DMD_CREATIONOPTIONLIST"):
+            compression = "DEFLATE"
+        options = ["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", f"COMPRESS={compression}", "INTERLEAVE=BAND", "BIGTIFF=IF_SAFER"]
+        if cells is not None and nbits:
+            options.append("NBITS=1")
+
+        path = self.temporary_path("transitions.tif") if cog else filename
+        dataset = driver.Create(path, self.width, self.height, n_bands, data_type, options)
+        if dataset is None:
+            return f"Could not create {filename}."
+        dataset.SetGeoTransform((self.extent.xMinimum(), self.extent.width() / self.width, 0, self.extent.yMaximum(), 0, -self.extent.height() / self.height))
+        dataset.SetProjection(self.raster1_layer_crs.toWkt())
+
+        if cells is None:
+            band = dataset.GetRasterBand(1)
+            band.SetNoDataValue(0)
+            band.SetDescription("transition code")
+            if no_data_code <= 65536:
+                band.SetCategoryNames([""] + [f"{from_value} -> {to_value}" for from_value in self.unique_values for to_value in self.unique_values])
+        else:
+            for number, band_cells in enumerate(bands):
+                dataset.GetRasterBand(number + 1).SetDescription(", ".join(f"{from_value} -> {to_value}" for from_value, to_value in self.cell_values(band_cells)))
+
+        # Tiles outside of an area were never counted and stay 0, as do mask tiles without the classes of the cells, which are not written
+        end = 50 if cog else 100
+        if cells is None:
+            tiles = ((1, window, np.where(codes == no_data_code, 0, codes + 1).astype(numpy_dtype)) for window, codes in self.pair_index.transition_tiles(self.unique_values))
+        else:
+            tiles = ((number + 1, window, tile_mask.astype(np.uint8)) for number, band_cells in enumerate(bands) for window, tile_mask in self.pair_index.cell_tiles(self.cell_values(band_cells)))
+        n_tiles = len(self.pair_index.tiles) * n_bands
+        for tile_number, (band_number, (x, y, _, _), tile) in enumerate(tiles):
+            dataset.GetRasterBand(band_number).WriteArray(tile, x, y)
 
-        raster1_numpy_selected = self.raster1_numpy == row_value
-        raster2_numpy_selected = self.raster2_numpy == column_value
+            if feedback is not None:
+                if feedback.isCanceled():
+                    dataset = None
+                    return "Exporting the transitions was canceled."
+                feedback.setProgress(end * (tile_number + 1) / n_tiles)
+        dataset = None
 
-        self.transition_mask = np.logical_and(raster1_numpy_selected, raster2_numpy_selected)
-        return self.transition_mask
\ No newline at end of file
+        if cog:
+            # Overviews of categorical data are resampled with the nearest neighbour
+            gdal.Translate(
+                filename,
+                path,
+                format = "COG",
+                creationOptions = [f"COMPRESS={compression}", "RESAMPLING=NEAREST", "BIGTIFF=IF_SAFER"],
+                callback = gdal_callback(feedback, 50, 100)
+            )
+            os.remove(path)
+            if feedback is not None and feedback.isCanceled():
+                return "Exporting the transitions was canceled."
+        return None
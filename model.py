@@ -0,0 +1,111 @@
+from PyQt5.QtCore import *
+import numpy as np
+from .counting import matrix_entries
+from .units import AREA_UNITS
+
+def format_estimate(count, margin):
+    # Estimated count with the half-width of its confidence interval, "?" while it cannot be estimated yet
+    if np.isnan(margin):
+        return f"~{count:.0f} ± ?"
+    return f"~{count:.0f} ± {margin:.0f}"
+
+class matrix_model(QAbstractTableModel):
+    # Table model over the dense or sparse count matrix; percentages are computed only for the cells the view asks for
+    def __init__(self):
+        super().__init__()
+        self.matrix = np.zeros((0, 0), dtype=int)
+        self.areas = None
+        self.margins = None
+        self.labels = []
+        self.mode = "Cell count"
+        self.total = 0
+        self.row_sums = np.zeros(0, dtype=int)
+        self.column_sums = np.zeros(0, dtype=int)
+
+    def set_matrix(self, matrix, unique_values, areas=None, margins=None):
+        # areas is the matrix of transition areas in square metres, needed for the AREA_UNITS modes;
+        # margins are the confidence half-widths of estimated counts, shown next to them.
+        # A matrix over the same classes only repaints the cells, so estimates update without losing the selection
+        labels = [str(v) for v in unique_values]
+        reset = labels != self.labels
+        if reset:
+            self.beginResetModel()
+        self.matrix = matrix
+        self.areas = areas
+        self.margins = margins
+        self.labels = labels
+        self.total = matrix.sum()
+        self.row_sums = matrix.sum(axis=1)
+        self.column_sums = matrix.sum(axis=0)
+        if reset:
+            self.endResetModel()
+        elif self.matrix.size:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, self.columnCount() - 1), [Qt.DisplayRole])
+
+    def set_mode(self, mode):
+        # Switching the values shown only asks the view to repaint the visible cells
+        self.mode = mode
+        if self.matrix.size:
+            self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, self.columnCount() - 1), [Qt.DisplayRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.matrix.shape[0]
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.matrix.shape[1]
+
+    def value(self, i, j):
+        if self.mode in AREA_UNITS and self.areas is not None:
+            return np.round(self.areas[i, j] / AREA_UNITS[self.mode], 4)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.mode == "Overall percentage":
+                return np.round((self.matrix[i, j] / self.total) * 100, 2)
+            if self.mode == "Row percentage":
+                return np.round((self.matrix[i, j] / self.row_sums[i]) * 100, 2)
+            if self.mode == "Column percentage":
+                return np.round((self.matrix[i, j] / self.column_sums[j]) * 100, 2)
+        return self.matrix[i, j]
+
+    def shown_matrix(self):
+        # Whole matrix in the current mode, for saving
+        if self.mode in AREA_UNITS and self.areas is not None:
+            return np.round(self.areas / AREA_UNITS[self.mode], 4)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.mode == "Overall percentage":
+                return np.round((self.matrix / self.total) * 100, 2)
+            if self.mode == "Row percentage":
+                return np.round((self.matrix / self.row_sums[:, None]) * 100, 2)
+            if self.mode == "Column percentage":
+                return np.round((self.matrix / self.column_sums[None, :]) * 100, 2)
+        return self.matrix
+
+    def shown_entries(self):
+        # Nonzero cells in the current mode as rows, columns and values, for saving sparse matrices
+        if self.mode in AREA_UNITS and self.areas is not None:
+            rows, columns, areas = matrix_entries(self.areas)
+            return rows, columns, np.round(areas / AREA_UNITS[self.mode], 4)
+        rows, columns, counts = matrix_entries(self.matrix)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.mode == "Overall percentage":
+                return rows, columns, np.round((counts / self.total) * 100, 2)
+            if self.mode == "Row percentage":
+                return rows, columns, np.round((counts / self.row_sums[rows]) * 100, 2)
+            if self.mode == "Column percentage":
+                return rows, columns, np.round((counts / self.column_sums[columns]) * 100, 2)
+        return rows, columns, counts
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            if self.margins is not None and self.mode == "Cell count":
+                return format_estimate(self.matrix[index.row(), index.column()], self.margins[index.row(), index.column()])
+            return str(self.value(index.row(), index.column()))
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and section < len(self.labels):
+            return self.labels[section]
+        return None
@@ -1,18 +1,30 @@
 from qgis.core import *
 from qgis.PyQt.QtGui import *
 from qgis.PyQt.QtWidgets import *
+import time
 
 # initialize Qt resources from file resources.py
 from . import resources
-from .form import message
+from .profiling import PROFILE_LOG_TAG
+from .provider import transmat_provider
 
 class transmat:
-  def __init__(self, iface):
+  def __init__(self, iface, load_start=None):
     # save reference to the QGIS interface
     self.iface = iface
-    self.msg=message()
+    self.provider = None
+    # the dialog and the counting engine behind it (NumPy, GDAL) are only imported and built on the first run
+    self.msg = None
+    self.load_start = load_start if load_start is not None else time.perf_counter()
+
+  def initProcessing(self):
+    # register the Processing algorithms, also used by qgis_process without the GUI
+    self.provider = transmat_provider()
+    QgsApplication.processingRegistry().addProvider(self.provider)
 
   def initGui(self):
+    self.initProcessing()
+
     # create action that will start plugin configuration
     self.action = QAction(QIcon(":/plugins/custom/icon.png"), "Transmat", self.iface.mainWindow())
     self.action.triggered.connect(self.run)
@@ -20,13 +32,24 @@ class transmat:
     # add toolbar button and menu item
     self.iface.addToolBarIcon(self.action)
     self.iface.addPluginToMenu("&Home made", self.action)
+    QgsMessageLog.logMessage(f"Plugin loaded in {1000 * (time.perf_counter() - self.load_start):.1f} ms", PROFILE_LOG_TAG, Qgis.Info)
 
   def unload(self):
     # remove the plugin menu item and icon
     self.iface.removePluginMenu("&Home made", self.action)
     self.iface.removeToolBarIcon(self.action)
+    if self.provider is not None:
+      QgsApplication.processingRegistry().removeProvider(self.provider)
+    if self.msg is not None:
+      self.msg.cleanup()
+      self.msg.close()
 
   def run(self):
     # create and show a configuration dialog or something similar
     #print "TestPlugin: run called!"
+    if self.msg is None:
+      start = time.perf_counter()
+      from .form import message
+      self.msg = message()
+      QgsMessageLog.logMessage(f"Dialog built in {1000 * (time.perf_counter() - start):.1f} ms", PROFILE_LOG_TAG, Qgis.Info)
     self.msg.show()
\ No newline at end of file
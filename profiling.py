@@ -0,0 +1,61 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Message log tab of the stage timings and of the plugin load time
+PROFILE_LOG_TAG = "Transmat profile"
+
+class run_profile:
+    # Wall time, bytes read, peak bytes of the arrays held and tiles processed by every stage of one run.
+    # Worker threads add to the stage the run is in, so the per-tile numbers are summed over all threads
+    def __init__(self):
+        self.stages = {}
+        self.current = "run"
+        self.held_bytes = 0
+        self.lock = threading.Lock()
+
+    def entry(self, name):
+        return self.stages.setdefault(name, {"seconds": 0.0, "bytes_read": 0, "peak_bytes": 0, "tiles": 0})
+
+    @contextmanager
+    def stage(self, name):
+        previous = self.current
+        self.current = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, seconds=time.perf_counter() - start)
+            self.current = previous
+
+    def add(self, name, seconds=0.0, bytes_read=0, tiles=0):
+        with self.lock:
+            entry = self.entry(name)
+            entry["seconds"] += seconds
+            entry["bytes_read"] += bytes_read
+            entry["tiles"] += tiles
+
+    def hold(self, nbytes):
+        # Arrays of nbytes are alive until release(nbytes); the peak is recorded for the current stage
+        with self.lock:
+            self.held_bytes += nbytes
+            entry = self.entry(self.current)
+            entry["peak_bytes"] = max(entry["peak_bytes"], self.held_bytes)
+
+    def release(self, nbytes):
+        with self.lock:
+            self.held_bytes -= nbytes
+
+    def summary(self):
+        # One line per stage, for the message log and the dialog
+        lines = []
+        for name, entry in self.stages.items():
+            parts = [f"{entry['seconds']:.2f} s"]
+            if entry["bytes_read"]:
+                parts.append(f"{entry['bytes_read'] / 2 ** 20:.1f} MB read")
+            if entry["peak_bytes"]:
+                parts.append(f"{entry['peak_bytes'] / 2 ** 20:.1f} MB peak")
+            if entry["tiles"]:
+                parts.append(f"{entry['tiles']} tiles")
+            lines.append(f"{name}: {', '.join(parts)}")
+        return "\n".join(lines)
@@ -0,0 +1,23 @@
+from qgis.core import *
+from qgis.PyQt.QtGui import QIcon
+from .algorithms import transition_matrix_algorithm, transition_mask_algorithm, transition_raster_algorithm, transition_count_algorithm, harmonize_algorithm, transition_cube_algorithm, zonal_transitions_algorithm, band_stack_algorithm
+
+class transmat_provider(QgsProcessingProvider):
+    def id(self):
+        return "transmat"
+
+    def name(self):
+        return "Transmat"
+
+    def icon(self):
+        return QIcon(":/plugins/custom/icon.png")
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(transition_matrix_algorithm())
+        self.addAlgorithm(transition_mask_algorithm())
+        self.addAlgorithm(transition_raster_algorithm())
+        self.addAlgorithm(transition_count_algorithm())
+        self.addAlgorithm(harmonize_algorithm())
+        self.addAlgorithm(transition_cube_algorithm())
+        self.addAlgorithm(zonal_transitions_algorithm())
+        self.addAlgorithm(band_stack_algorithm())
@@ -0,0 +1,125 @@
+import numpy as np
+import os
+from osgeo import gdal
+from .counting import combine_masks
+
+# Reading and warping of rasters through GDAL alone; geospatial builds its layers on these, and the benchmark runs them without QGIS
+
+gdal_to_numpy = {
+    1: np.uint8,     # Byte
+    2: np.uint16,    # UInt16
+    3: np.int16,     # Int16
+    4: np.uint32,    # UInt32
+    5: np.int32,     # Int32
+    6: np.float32,   # Float32
+    7: np.float64,   # Float64
+    10: np.complex64,   # CFloat32
+    11: np.complex128,  # CFloat64
+}
+
+def snap_bounds(geotransform, intersection):
+    # The intersection (x min, y min, x max, y max) snapped inwards onto the pixel grid of a north-up geotransform
+    x_min, x_res, _, y_max, _, y_res = geotransform
+    y_res = -y_res
+    return (
+        x_min + np.ceil((intersection[0] - x_min) / x_res) * x_res,
+        y_max - np.floor((y_max - intersection[1]) / y_res) * y_res,
+        x_min + np.floor((intersection[2] - x_min) / x_res) * x_res,
+        y_max - np.ceil((y_max - intersection[3]) / y_res) * y_res,
+    )
+
+def warp_options(src_srs, dst_srs, bounds, x_res, y_res, null_value, output_type, src_nodata=None, callback=None):
+    # Keyword arguments of gdal.Warp for a warped VRT that reprojects, clips and remaps the no-data value in one step, lazily
+    # while the tiles are read. Without src_nodata the source has no no-data value, its pixels are all warped as data
+    return {
+        "format": "VRT",
+        "srcSRS": src_srs,
+        "dstSRS": dst_srs,
+        "srcNodata": src_nodata if src_nodata is not None else "None",
+        "dstNodata": null_value,
+        "outputBounds": bounds,
+        "xRes": x_res,
+        "yRes": y_res,
+        "outputType": output_type,
+        "callback": callback,
+    }
+
+def geotiff_memmap(dataset, band):
+    # Read-only memory map of a band of an uncompressed, stripped GeoTIFF whose strips follow each other in the file, otherwise None.
+    # Only local files can be mapped, GeoTIFFs in /vsizip/, /vsicurl/, /vsimem/ and the like are read through GDAL
+    if dataset.GetDriver().ShortName != "GTiff" or dataset.GetMetadataItem("COMPRESSION", "IMAGE_STRUCTURE"):
+        return None
+    path = dataset.GetDescription()
+    if not os.path.isfile(path):
+        return None
+    raster_band = dataset.GetRasterBand(band)
+    numpy_dtype = gdal_to_numpy.get(raster_band.DataType)
+    block_width, block_height = raster_band.GetBlockSize()
+    if numpy_dtype is None or block_width != dataset.RasterXSize or raster_band.GetMetadataItem("NBITS", "IMAGE_STRUCTURE"):
+        return None
+
+    pixel_interleaved = dataset.RasterCount > 1 and dataset.GetMetadataItem("INTERLEAVE", "IMAGE_STRUCTURE") == "PIXEL"
+    pixel_bands = dataset.RasterCount if pixel_interleaved else 1
+    n_strips = -(-dataset.RasterYSize // block_height)
+    strip_bytes = dataset.RasterXSize * block_height * pixel_bands * np.dtype(numpy_dtype).itemsize
+    first = raster_band.GetMetadataItem("BLOCK_OFFSET_0_0", "TIFF")
+    last = raster_band.GetMetadataItem(f"BLOCK_OFFSET_0_{n_strips - 1}", "TIFF")
+    if first is None or last is None or int(last) - int(first) != (n_strips - 1) * strip_bytes:
+        return None
+
+    with open(path, "rb") as tiff_file:
+        byte_order = "<" if tiff_file.read(2) == b"II" else ">"
+    pixels = np.memmap(path, dtype=np.dtype(numpy_dtype).newbyteorder(byte_order), mode="r", offset=int(first), shape=(dataset.RasterYSize, dataset.RasterXSize, pixel_bands))
+    return pixels[:, :, band - 1 if pixel_interleaved else 0]
+
+class band_reader:
+    # Reads pixel windows of one band of a GDAL dataset in its own datatype, straight into NumPy buffers that are reused for tiles
+    # of the same shape, so a tile is only valid until the next read; uncompressed GeoTIFFs are memory-mapped and their tiles are
+    # views of the file. null_value and null_ranges mark pixels without data, and with use_mask the mask band of the dataset.
+    # Without a dataset nothing is set up for reading, which is left to a subclass. Not thread-safe, one reader per thread
+    def __init__(self, dataset, band, null_value=None, null_ranges=(), use_mask=True):
+        self.band = band
+        self.dataset = dataset
+        self.null_value = null_value
+        self.null_ranges = list(null_ranges)
+        self.buffers = {}
+        self.numpy_dtype = None
+        self.memmap = None
+        self.raster_band = None
+        self.mask_band = None
+        if dataset is None:
+            return
+
+        self.raster_band = dataset.GetRasterBand(band)
+        self.numpy_dtype = gdal_to_numpy.get(self.raster_band.DataType, np.float32)
+        self.memmap = geotiff_memmap(dataset, band)
+
+        # Mask bands that do not just repeat the no-data value (alpha bands, per-dataset and explicit masks) are read too
+        flags = self.raster_band.GetMaskFlags()
+        if use_mask and not flags & (gdal.GMF_ALL_VALID | gdal.GMF_NODATA):
+            self.mask_band = self.raster_band.GetMaskBand()
+
+    def read(self, window):
+        x, y, w, h = window
+        if self.memmap is not None:
+            return self.memmap[y:y + h, x:x + w]
+        if (h, w) not in self.buffers:
+            self.buffers[(h, w)] = np.empty((h, w), dtype=self.numpy_dtype)
+        return self.raster_band.ReadAsArray(x, y, w, h, buf_obj=self.buffers[(h, w)])
+
+    def valid(self, window, tile):
+        # Pixels of a tile that hold data, or None if none are marked as missing; NaN is left to the counting
+        masks = []
+        if self.null_value is not None and not np.isnan(self.null_value):
+            masks.append(tile != self.null_value)
+        for minimum, maximum in self.null_ranges:
+            masks.append((tile < minimum) | (tile > maximum))
+        if self.mask_band is not None:
+            x, y, w, h = window
+            masks.append(self.mask_band.ReadAsArray(x, y, w, h) != 0)
+        return combine_masks(*masks)
+
+def read_valid(reader, window):
+    # Pixels of a tile and the mask of its valid pixels
+    tile = reader.read(window)
+    return tile, reader.valid(window, tile)
@@ -0,0 +1,108 @@
+from qgis.core import *
+import cProfile
+from qgis.PyQt.QtCore import *
+from .geospatial import renderer
+from .cache import result_cache
+
+class transmat_task(QgsTask):
+    # Emitted on the main thread with the renderer holding the results, the two layers that were counted and whether they were harmonized
+    matrix_ready = pyqtSignal(object, object, object, bool)
+    # Emitted on the main thread with a title and a message when the run fails
+    run_failed = pyqtSignal(str, str)
+    # Emitted on the main thread in quick estimate mode with the estimated counts, their confidence margins, the estimated areas,
+    # the classes and the fraction of tiles counted so far
+    matrix_estimated = pyqtSignal(object, object, object, object, float)
+
+    def __init__(self, raster1_layer, raster2_layer, raster1_band, raster2_band, null_value, compatibility_fix, default_raster, workers, use_cache=True, area=None, area_crs=None, reclass_table=None, pixel_areas=False, profile_path=None, layer_nodata=True, quick_estimate=False):
+        super().__init__("Transmat: generating transition matrix", QgsTask.CanCancel)
+        self.raster1_layer = raster1_layer
+        self.raster2_layer = raster2_layer
+        self.raster1_band = raster1_band
+        self.raster2_band = raster2_band
+        self.null_value = null_value
+        self.compatibility_fix = compatibility_fix
+        self.default_raster = default_raster
+        self.workers = workers
+        self.cache = result_cache() if use_cache else None
+        self.area = area
+        self.area_crs = area_crs
+        self.reclass_table = reclass_table
+        self.pixel_areas = pixel_areas
+        # With a path the task thread is profiled with cProfile and the statistics are dumped there
+        self.profile_path = profile_path
+        self.layer_nodata = layer_nodata
+        self.quick_estimate = quick_estimate
+
+        self.renderer = renderer()
+        self.harmonized = False
+        self.error = None
+
+        # Processing feedback, so renderer.generate can split it into steps
+        self.feedback = QgsProcessingFeedback()
+        self.feedback.progressChanged.connect(self.setProgress)
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def run(self):
+        profiler = cProfile.Profile() if self.profile_path else None
+        try:
+            if profiler is not None:
+                profiler.enable()
+            return self.generate()
+        except Exception as e:
+            self.error = ("Error", f"Generating the transition matrix failed:\n{str(e)}")
+            return False
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_path)
+
+    def generate(self):
+        result = self.renderer.generate(
+            self.raster1_layer,
+            self.raster2_layer,
+            self.raster1_band,
+            self.raster2_band,
+            self.null_value,
+            self.compatibility_fix,
+            self.default_raster,
+            self.workers,
+            feedback=self.feedback,
+            cache=self.cache,
+            area=self.area,
+            area_crs=self.area_crs,
+            reclass_table=self.reclass_table,
+            pixel_areas=self.pixel_areas,
+            layer_nodata=self.layer_nodata,
+            estimate=self.matrix_estimated.emit if self.quick_estimate else None
+        )
+        if self.isCanceled():
+            return False
+
+        # If string is returned the check or the harmonisation was not successful
+        if isinstance(result, str):
+            title = "Auto-compatibility fix failed" if self.compatibility_fix else "Raster Layer Error"
+            self.error = (title, result)
+            return False
+
+        # Harmonized layers were created on this thread and have to be handed over to the main thread
+        self.raster1_layer, self.raster2_layer, self.harmonized = result
+        if self.harmonized:
+            main_thread = QCoreApplication.instance().thread()
+            self.raster1_layer.moveToThread(main_thread)
+            self.raster2_layer.moveToThread(main_thread)
+        return True
+
+    def finished(self, result):
+        if result:
+            self.matrix_ready.emit(self.renderer, self.raster1_layer, self.raster2_layer, self.harmonized)
+            return
+
+        # Harmonized rasters of a failed or canceled run are not needed anymore
+        self.renderer.cleanup()
+        if self.error is not None:
+            self.run_failed.emit(*self.error)
+        elif not self.isCanceled():
+            self.run_failed.emit("Error", "Generating the transition matrix failed.")
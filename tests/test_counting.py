@@ -0,0 +1,221 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import counting  # noqa: E402
+from counting import count_transitions, data_pixels, reclassify, sparse_matrix, tile_sample, tile_windows, transition_counter  # noqa: E402
+
+
+def reference_counts(raster1, raster2, null_value, mask=None):
+    # Transition counts of a pixel by pixel loop, as a {(from, to): count} dict of class values
+    counts = {}
+    for index in np.ndindex(raster1.shape):
+        a, b = raster1[index], raster2[index]
+        if mask is not None and not mask[index]:
+            continue
+        if a == null_value or b == null_value or np.isnan(a) or np.isnan(b):
+            continue
+        counts[(a.item(), b.item())] = counts.get((a.item(), b.item()), 0) + 1
+    return counts
+
+
+def result_counts(counts, unique_values):
+    # The same dict from a dense or sparse matrix and its classes
+    if isinstance(counts, sparse_matrix):
+        counts = counts.toarray()
+    rows, columns = np.nonzero(counts)
+    return {(unique_values[i].item(), unique_values[j].item()): int(counts[i, j]) for i, j in zip(rows, columns)}
+
+
+def tiled_counts(raster1, raster2, null_value, tile_width, tile_height, mask=None):
+    height, width = raster1.shape
+    counter = transition_counter(null_value)
+    for x, y, w, h in tile_windows(width, height, tile_width, tile_height):
+        window = np.s_[y:y + h, x:x + w]
+        tile_mask = None if mask is None else mask[window]
+        counter.add_counts(*count_transitions(raster1[window], raster2[window], null_value, tile_mask))
+    return counter.result()
+
+
+def random_rasters(rng, shape, n_classes, dtype, null_value):
+    raster1 = rng.integers(0, n_classes, shape).astype(dtype)
+    raster2 = rng.integers(0, n_classes, shape).astype(dtype)
+    raster1[rng.random(shape) < 0.1] = null_value
+    raster2[rng.random(shape) < 0.1] = null_value
+    return raster1, raster2
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int32, np.int64, np.float32])
+def test_count_transitions_matches_reference(dtype):
+    rng = np.random.default_rng(1)
+    raster1, raster2 = random_rasters(rng, (37, 23), 6, dtype, 0)
+    counts, unique_values = count_transitions(raster1, raster2, 0)
+    assert result_counts(counts, unique_values) == reference_counts(raster1, raster2, 0)
+
+
+def test_count_transitions_mask():
+    rng = np.random.default_rng(2)
+    raster1, raster2 = random_rasters(rng, (30, 30), 5, np.int16, -1)
+    mask = rng.random(raster1.shape) < 0.5
+    counts, unique_values = count_transitions(raster1, raster2, -1, mask)
+    assert result_counts(counts, unique_values) == reference_counts(raster1, raster2, -1, mask)
+
+
+def test_count_transitions_nan():
+    rng = np.random.default_rng(3)
+    raster1, raster2 = random_rasters(rng, (25, 31), 4, np.float64, -9999.5)
+    raster1[rng.random(raster1.shape) < 0.1] = np.nan
+    raster2[rng.random(raster2.shape) < 0.1] = np.nan
+    counts, unique_values = count_transitions(raster1, raster2, -9999.5)
+    assert not np.isnan(unique_values).any()
+    assert result_counts(counts, unique_values) == reference_counts(raster1, raster2, -9999.5)
+
+
+def test_count_transitions_sparse():
+    rng = np.random.default_rng(4)
+    n_classes = counting.DENSE_CLASSES + 200
+    raster1, raster2 = random_rasters(rng, (60, 80), n_classes, np.int32, -1)
+    counts, unique_values = count_transitions(raster1, raster2, -1)
+    assert isinstance(counts, sparse_matrix)
+    assert result_counts(counts, unique_values) == reference_counts(raster1, raster2, -1)
+
+
+@pytest.mark.parametrize("n_classes", [7, counting.DENSE_CLASSES + 200])
+def test_tiled_counter_matches_reference(n_classes):
+    # Tiles see different subsets of the classes, so the running matrix has to grow and, above DENSE_CLASSES, turn sparse
+    rng = np.random.default_rng(5)
+    raster1, raster2 = random_rasters(rng, (70, 90), n_classes, np.int32, -1)
+    mask = rng.random(raster1.shape) < 0.8
+    counts, unique_values = tiled_counts(raster1, raster2, -1, 16, 11, mask)
+    assert result_counts(counts, unique_values) == reference_counts(raster1, raster2, -1, mask)
+
+
+def test_tiled_counter_consolidates_entries():
+    rng = np.random.default_rng(6)
+    raster1, raster2 = random_rasters(rng, (50, 50), counting.DENSE_CLASSES + 50, np.int64, -1)
+    height, width = raster1.shape
+    counter = transition_counter(-1, consolidate_entries=100)
+    for x, y, w, h in tile_windows(width, height, 10, 10):
+        window = np.s_[y:y + h, x:x + w]
+        counter.add(raster1[window], raster2[window])
+    counts, unique_values = counter.result()
+    assert result_counts(counts, unique_values) == reference_counts(raster1, raster2, -1)
+
+
+def sampled_estimates(tiles, null_value):
+    # Estimates after every tile, adding each tile to the running sums before the sample as the renderer does
+    counter = transition_counter(null_value)
+    sample = tile_sample(null_value, len(tiles))
+    estimates = []
+    for raster1, raster2 in tiles:
+        counts, unique_values = count_transitions(raster1, raster2, null_value)
+        counter.add_counts(counts, unique_values)
+        sample.add(counts, unique_values)
+        estimates.append(sample.estimate(*counter.result()) + (counter.result()[1],))
+    return estimates
+
+
+@pytest.mark.parametrize("n_classes", [4, counting.DENSE_CLASSES + 100])
+def test_uniform_tiles_estimate_exactly(n_classes):
+    rng = np.random.default_rng(7)
+    tile = random_rasters(rng, (40, 40), n_classes, np.int32, -1)
+    reference, _ = count_transitions(*tile, -1)
+    reference = reference.toarray() if isinstance(reference, sparse_matrix) else reference
+    for n, (counts, margins, _) in enumerate(sampled_estimates([tile] * 16, -1), 1):
+        if isinstance(counts, sparse_matrix):
+            counts, margins = counts.toarray(), margins.toarray()
+        assert np.allclose(counts, 16 * reference)
+        if n > 1:
+            assert np.allclose(margins, 0)
+
+
+@pytest.mark.parametrize("n_classes", [4, counting.DENSE_CLASSES + 100])
+def test_estimate_aligns_new_classes(n_classes):
+    # The second tile brings classes the first did not have, the margins still line up with the counts
+    rng = np.random.default_rng(8)
+    first = random_rasters(rng, (30, 30), n_classes // 2, np.int32, -1)
+    second = tuple(raster + (n_classes // 2) * (raster != -1) for raster in random_rasters(rng, (30, 30), n_classes // 2, np.int32, -1))
+    counts, margins, unique_values = sampled_estimates([first, second, first, second], -1)[1]
+    if isinstance(counts, sparse_matrix):
+        counts, margins = counts.toarray(), margins.toarray()
+    assert counts.shape == margins.shape == (unique_values.size, unique_values.size)
+    # Every cell holds c pixels in only one of the two tiles: estimate 2c, sample variance c ** 2 / 2
+    tile_counts = counts / 2
+    expected = 1.96 * 4 * np.sqrt((1 - 2 / 4) * tile_counts ** 2 / 2 / 2)
+    assert np.allclose(margins, expected)
+
+
+@pytest.mark.parametrize("null_value", [-9999, -9999.5, -3.4e38, np.nan])
+def test_reclassify_keeps_null_value(null_value):
+    raster = np.array([[0.5, 1.5, 2.5], [null_value, np.nan, 7.0]])
+    reclassified = reclassify(raster, [(0, 1, 10), (1, 3, 20)], null_value)
+    assert reclassified[0].tolist() == [10, 20, 20]
+    # No-data, NaN and unmatched pixels all end up as no data and are not counted as a class
+    assert not data_pixels(reclassified[1], null_value).any()
+    counts, unique_values = count_transitions(reclassified, reclassified, null_value)
+    assert unique_values.tolist() == [10, 20]
+
+
+def test_pair_index_reads_tiles_from_file(tmp_path):
+    # More tiles than a process may hold open files; every query reads the codes of a tile back from the one file
+    rng = np.random.default_rng(9)
+    raster1, raster2 = random_rasters(rng, (64, 64), 5, np.int32, -1)
+    index = counting.pair_index(64, 64, path=str(tmp_path / "pair_codes.bin"))
+    for x, y, w, h in tile_windows(64, 64, 1, 1):
+        pair_codes, unique_values = counting.encode_pairs(raster1[y:y + h, x:x + w], raster2[y:y + h, x:x + w], -1)
+        index.add((x, y, w, h), pair_codes, unique_values)
+    assert len(index.tiles) == 4096
+    cells = [(1, 2), (3, 3)]
+    expected = np.zeros(raster1.shape, dtype=bool)
+    for a, b in cells:
+        expected |= (raster1 == a) & (raster2 == b)
+    assert np.array_equal(index.mask(cells), expected)
+    assert index.count(cells) == np.count_nonzero(expected)
+
+
+@pytest.mark.parametrize("n_classes", [5, counting.DENSE_CLASSES + 100])
+@pytest.mark.parametrize("equal_rows", [False, True])
+def test_row_weights_match_pixel_weights(n_classes, equal_rows):
+    rng = np.random.default_rng(10)
+    raster1, raster2 = random_rasters(rng, (45, 37), n_classes, np.int32, -1)
+    pair_codes, unique_values = counting.encode_pairs(raster1, raster2, -1)
+    row_weights = np.full(45, 2.5) if equal_rows else rng.random(45)
+    expected = counting.count_pairs(pair_codes, unique_values.size, np.repeat(row_weights, 37).reshape(45, 37))
+    # A few rows per chunk, so the chunks are summed
+    weighted = counting.count_row_weights(pair_codes, unique_values.size, row_weights, chunk_pixels=200)
+    through_count_pairs = counting.count_pairs(pair_codes, unique_values.size, row_weights[:, None])
+    for result in (weighted, through_count_pairs):
+        dense = result.toarray() if isinstance(result, sparse_matrix) else result
+        assert np.allclose(dense, expected.toarray() if isinstance(expected, sparse_matrix) else expected)
+
+
+def test_pair_index_counts_inside_regions():
+    # The region says per tile: False to skip it, None to count all of it, or a mask of the pixels to count
+    rng = np.random.default_rng(11)
+    raster1, raster2 = random_rasters(rng, (48, 64), 4, np.int32, -1)
+    index = counting.pair_index(64, 48)
+    for x, y, w, h in tile_windows(64, 48, 16, 16):
+        index.add((x, y, w, h), *counting.encode_pairs(raster1[y:y + h, x:x + w], raster2[y:y + h, x:x + w], -1))
+    area = np.zeros(raster1.shape, dtype=bool)
+    area[5:30, 10:50] = True
+    read = []
+
+    def region(window):
+        x, y, w, h = window
+        inside = area[y:y + h, x:x + w]
+        if not inside.any():
+            return False
+        read.append(window)
+        return None if inside.all() else inside
+
+    cells = [(0, 1), (2, 2), (3, 0)]
+    expected = np.zeros(raster1.shape, dtype=bool)
+    for a, b in cells:
+        expected |= (raster1 == a) & (raster2 == b)
+    assert index.count(cells, region) == np.count_nonzero(expected & area)
+    assert len(read) == 8
+    assert index.count(cells) == np.count_nonzero(expected)
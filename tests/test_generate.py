@@ -0,0 +1,47 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+qgis_core = pytest.importorskip("qgis.core")
+gdal = pytest.importorskip("osgeo.gdal")
+
+from qgis.testing import start_app  # noqa: E402
+
+# The plugin uses relative imports, so it is imported as the package it is installed as
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(root))
+geospatial = importlib.import_module(os.path.basename(root) + ".geospatial")
+
+start_app()
+
+
+def write_raster(path, array):
+    dataset = gdal.GetDriverByName("GTiff").Create(str(path), array.shape[1], array.shape[0], 1, gdal.GDT_Byte)
+    dataset.SetGeoTransform((0, 1, 0, array.shape[0], 0, -1))
+    dataset.SetProjection(qgis_core.QgsCoordinateReferenceSystem("EPSG:3857").toWkt())
+    dataset.GetRasterBand(1).WriteArray(array)
+    dataset = None
+    return qgis_core.QgsRasterLayer(str(path), path.stem)
+
+
+@pytest.mark.parametrize("feedback_type", [qgis_core.QgsFeedback, qgis_core.QgsProcessingFeedback])
+def test_generate_with_feedback(tmp_path, feedback_type):
+    # The dialog task hands over its own feedback, which generate splits into steps whatever its type
+    rng = np.random.default_rng(0)
+    raster1 = rng.integers(1, 4, (40, 30)).astype(np.uint8)
+    raster2 = rng.integers(1, 4, (40, 30)).astype(np.uint8)
+    layer1 = write_raster(tmp_path / "raster1.tif", raster1)
+    layer2 = write_raster(tmp_path / "raster2.tif", raster2)
+
+    feedback = feedback_type()
+    matrix_renderer = geospatial.renderer()
+    result = matrix_renderer.generate(layer1, layer2, 1, 1, 0, feedback=feedback)
+    assert not isinstance(result, str), result
+    expected = np.zeros((3, 3), dtype=int)
+    np.add.at(expected, (raster1.ravel() - 1, raster2.ravel() - 1), 1)
+    assert np.array_equal(matrix_renderer.transition_counts, expected)
+    assert feedback.progress() == pytest.approx(100)
+    matrix_renderer.cleanup()
@@ -0,0 +1,106 @@
+import importlib
+import os
+import sys
+
+import numpy as np
+
+# The plugin uses relative imports, so it is imported as the package it is installed as; the tile store needs no QGIS
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(root))
+counting = importlib.import_module(os.path.basename(root) + ".counting")
+tiles = importlib.import_module(os.path.basename(root) + ".tiles")
+
+
+def fingerprint(name, stamp):
+    # Layout of layer_fingerprint: source, file stamps (None when unknown), band
+    return [name, None if stamp is None else [[name, 100, stamp]], 1]
+
+
+def counts_dict(counts, unique_values):
+    if isinstance(counts, counting.sparse_matrix):
+        counts = counts.toarray()
+    rows, columns = np.nonzero(counts)
+    return {(unique_values[i].item(), unique_values[j].item()): int(counts[i, j]) for i, j in zip(rows, columns)}
+
+
+def run(store, rasters, fingerprints, tile_width=8, tile_height=8):
+    # One counting pass as calculate_transmat makes it; returns the counts, the recounted tiles and the (tile, layer) reads of the checksums
+    height, width = rasters[0].shape
+    windows = list(counting.tile_windows(width, height, tile_width, tile_height))
+    store.load(windows, fingerprints)
+    store.begin()
+    counter = counting.transition_counter(-1)
+    checksums, recounted, reads = [], [], []
+    for number, (x, y, w, h) in enumerate(windows):
+        def read(i):
+            reads.append((number, i))
+            return rasters[i][y:y + h, x:x + w], None
+
+        stored, tile_checksums, _ = store.reuse(number, read)
+        if stored is None:
+            recounted.append(number)
+            pair_codes, unique_values = counting.encode_pairs(rasters[0][y:y + h, x:x + w], rasters[1][y:y + h, x:x + w], -1)
+            counts = counting.count_pairs(pair_codes, unique_values.size)
+            store.store_tile(number, counts, unique_values, pair_codes)
+            stored = counts, unique_values, pair_codes, None
+        counter.add_counts(stored[0], stored[1])
+        checksums.append(tile_checksums)
+    store.finish(windows, fingerprints, checksums)
+    return counts_dict(*counter.result()), recounted, reads
+
+
+def rasters(seed=12):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(-1, 5, (32, 40)).astype(np.int32) for _ in range(2)]
+
+
+def test_edited_tile_is_the_only_one_recounted(tmp_path):
+    raster1, raster2 = rasters()
+    full, recounted, _ = run(tiles.tile_store(str(tmp_path)), [raster1, raster2], [fingerprint("a", 1), fingerprint("b", 1)])
+    assert recounted == list(range(20))
+
+    # Tile 8 is x 24-32, y 8-16 (five tiles per row); raster2 was rewritten, raster1 was not and keeps its stored checksums
+    raster2[10:12, 25:30] = (raster2[10:12, 25:30] + 1) % 5
+    counts, recounted, reads = run(tiles.tile_store(str(tmp_path)), [raster1, raster2], [fingerprint("a", 1), fingerprint("b", 2)])
+    assert recounted == [8]
+    assert reads == [(number, 1) for number in range(20)]
+    assert counts == counts_dict(*counting.count_transitions(raster1, raster2, -1))
+    assert counts != full
+
+    # Reused tiles give their pair codes back from the store
+    stored = tiles.tile_store(str(tmp_path)).tile(3)
+    assert np.array_equal(stored[2], counting.encode_pairs(raster1[0:8, 24:32], raster2[0:8, 24:32], -1)[0])
+
+
+def test_untrusted_layers_are_read_again(tmp_path):
+    # Without file stamps an unchanged fingerprint says nothing about the pixels, both layers are checksummed
+    raster1, raster2 = rasters()
+    fingerprints = [fingerprint("a", None), fingerprint("b", None)]
+    run(tiles.tile_store(str(tmp_path)), [raster1, raster2], fingerprints)
+    raster1[0, 0] = (raster1[0, 0] + 1) % 5
+    counts, recounted, reads = run(tiles.tile_store(str(tmp_path)), [raster1, raster2], fingerprints)
+    assert recounted == [0]
+    assert len(reads) == 40
+    assert counts == counts_dict(*counting.count_transitions(raster1, raster2, -1))
+
+
+def test_interrupted_store_is_not_used(tmp_path):
+    raster1, raster2 = rasters()
+    fingerprints = [fingerprint("a", 1), fingerprint("b", 1)]
+    run(tiles.tile_store(str(tmp_path)), [raster1, raster2], fingerprints)
+    # A run that stopped after begin left its tiles without a tile list
+    store = tiles.tile_store(str(tmp_path))
+    store.begin()
+    assert not tiles.tile_store(str(tmp_path)).load(list(counting.tile_windows(40, 32, 8, 8)), fingerprints)
+    _, recounted, _ = run(tiles.tile_store(str(tmp_path)), [raster1, raster2], fingerprints)
+    assert recounted == list(range(20))
+
+
+def test_other_tiling_recounts_and_prunes(tmp_path):
+    raster1, raster2 = rasters()
+    fingerprints = [fingerprint("a", 1), fingerprint("b", 1)]
+    run(tiles.tile_store(str(tmp_path)), [raster1, raster2], fingerprints)
+    counts, recounted, _ = run(tiles.tile_store(str(tmp_path)), [raster1, raster2], fingerprints, 20, 16)
+    assert recounted == [0, 1, 2, 3]
+    assert counts == counts_dict(*counting.count_transitions(raster1, raster2, -1))
+    assert sorted(os.listdir(tmp_path)) == sorted(["tiles.json"] + [f"tile_{n}.npz" for n in range(4)] + [f"codes_{n}.bin" for n in range(4)])
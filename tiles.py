@@ -0,0 +1,127 @@
+import numpy as np
+import hashlib
+import json
+import os
+from .counting import pair_code_dtype, sparse_matrix
+
+# The tile store keeps the partial counts of the last run on disk. It only needs NumPy, so it can be used and tested without QGIS
+
+def trusted(fingerprint):
+    # Whether an unchanged fingerprint means unchanged pixels, which needs the stamps of the files
+    return fingerprint[1] is not None
+
+def tile_checksum(tile, mask=None):
+    # Digest of the pixels of a tile and of the mask of its valid pixels
+    digest = hashlib.blake2b(np.ascontiguousarray(tile), digest_size=16)
+    if mask is not None:
+        digest.update(np.ascontiguousarray(mask))
+    return digest.hexdigest()
+
+def matrix_arrays(name, matrix):
+    # Arrays for np.savez of a dense matrix, or of the entries of a sparse one
+    if isinstance(matrix, sparse_matrix):
+        rows, columns, values = matrix.entries()
+        return {f"{name}_rows": rows, f"{name}_columns": columns, f"{name}_values": values}
+    return {name: matrix}
+
+def stored_matrix(arrays, name, n_classes):
+    # Matrix saved by matrix_arrays, or None if it was not saved
+    if name in arrays:
+        return arrays[name]
+    if f"{name}_rows" in arrays:
+        return sparse_matrix(arrays[f"{name}_rows"], arrays[f"{name}_columns"], arrays[f"{name}_values"], n_classes)
+    return None
+
+
+class tile_store:
+    # Partial counts and checksums of every tile of the last run, one file per tile so an update rewrites only the changed tiles.
+    # Pair codes are written raw to a file of their own per tile, which the pair index of the run and cached results read from directly.
+    # The tile list is written last and removed first, a store that was interrupted while updating is not used
+    def __init__(self, directory):
+        self.directory = directory
+        self.fingerprints = []
+        self.checksums = []
+
+    def load(self, windows, fingerprints):
+        # Read the tile list, returns False when there is none or it was made for other tiles.
+        # fingerprints describe the counted layers; a layer with the same fingerprint as last time is not read again
+        self.fingerprints = [False] * len(fingerprints)
+        self.checksums = []
+        try:
+            with open(os.path.join(self.directory, "tiles.json")) as tiles_file:
+                stored = json.load(tiles_file)
+        except (OSError, ValueError):
+            return False
+        if stored["windows"] != [[int(v) for v in window] for window in windows]:
+            return False
+        self.fingerprints = [stored_fingerprint == fingerprint and trusted(fingerprint) for stored_fingerprint, fingerprint in zip(stored["fingerprints"], fingerprints)]
+        self.checksums = stored["checksums"]
+        os.utime(self.directory)
+        return True
+
+    def unchanged(self, number):
+        # Stored checksums of tile number for the layers whose files did not change, None for the others
+        if not self.checksums or self.checksums[number] is None:
+            return [None] * len(self.fingerprints)
+        return [checksum if same else None for checksum, same in zip(self.checksums[number], self.fingerprints)]
+
+    def reuse(self, number, read):
+        # Stored counts of tile number when the checksums of all its layers match the last run, else None, with the checksums
+        # and the layer tiles that were read. read(i) returns the pixels and valid mask of layer i; a layer whose file did not
+        # change keeps its stored checksum and is only read when another one changed (its tile is None then)
+        checksums = self.unchanged(number)
+        layer_tiles = [None] * len(checksums)
+        for i, checksum in enumerate(checksums):
+            if checksum is None:
+                layer_tiles[i] = read(i)
+                checksums[i] = tile_checksum(*layer_tiles[i])
+        if not self.checksums or checksums != self.checksums[number]:
+            return None, checksums, layer_tiles
+        return self.tile(number), checksums, layer_tiles
+
+    def begin(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            os.remove(os.path.join(self.directory, "tiles.json"))
+        except FileNotFoundError:
+            pass
+
+    def codes_path(self, number):
+        return os.path.join(self.directory, f"codes_{number}.bin")
+
+    def tile(self, number):
+        # counts, unique_values, pair_codes and areas stored for tile number, or None if a file is missing or broken
+        try:
+            arrays = np.load(os.path.join(self.directory, f"tile_{number}.npz"), allow_pickle=False)
+            unique_values = arrays["unique_values"]
+            counts = stored_matrix(arrays, "counts", unique_values.size)
+            pair_codes = None
+            if "codes_shape" in arrays:
+                pair_codes = np.fromfile(self.codes_path(number), dtype=pair_code_dtype(unique_values.size)).reshape(arrays["codes_shape"])
+            return counts, unique_values, pair_codes, stored_matrix(arrays, "areas", unique_values.size)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store_tile(self, number, counts, unique_values, pair_codes=None, tile_areas=None):
+        arrays = matrix_arrays("counts", counts)
+        if pair_codes is not None:
+            arrays["codes_shape"] = np.array(pair_codes.shape)
+            with open(self.codes_path(number) + ".tmp", "wb") as codes_file:
+                np.ascontiguousarray(pair_codes).tofile(codes_file)
+            os.replace(self.codes_path(number) + ".tmp", self.codes_path(number))
+        if tile_areas is not None:
+            arrays.update(matrix_arrays("areas", tile_areas))
+        path = os.path.join(self.directory, f"tile_{number}.npz")
+        with open(path + ".tmp", "wb") as tile_file:
+            np.savez(tile_file, unique_values=unique_values, **arrays)
+        os.replace(path + ".tmp", path)
+
+    def finish(self, windows, fingerprints, checksums):
+        # Files of tiles beyond the current tile list are left over from another tiling
+        for name in os.listdir(self.directory):
+            if name.startswith(("tile_", "codes_")) and int(name.split("_")[1].split(".")[0]) >= len(windows):
+                os.remove(os.path.join(self.directory, name))
+        stored = {"windows": [[int(v) for v in window] for window in windows], "fingerprints": fingerprints, "checksums": checksums}
+        with open(os.path.join(self.directory, "tiles.json.tmp"), "w") as tiles_file:
+            json.dump(stored, tiles_file, default=str)
+        os.replace(os.path.join(self.directory, "tiles.json.tmp"), os.path.join(self.directory, "tiles.json"))
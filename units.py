@@ -0,0 +1,7 @@
+# Units of the values shown in the matrix, kept free of heavy imports so the Processing provider can load without the counting engine
+
+# Square metres per unit of the area values shown
+AREA_UNITS = {
+    "Area (ha)": 10000,
+    "Area (km²)": 1000000,
+}